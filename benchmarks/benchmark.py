@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Times the main molutils operations on synthetic water and argon clusters.
+
+    python -m benchmarks.benchmark --output results.json
+    python -m benchmarks.benchmark --baseline results.json --threshold 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from molutils.util.molecule import Molecule, AUTO_FRAGMENTS
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_PATH = os.path.join(REPOSITORY_ROOT, "molutils.py")
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+DEFAULT_THRESHOLD = 0.25
+
+# Timings below this many seconds are too noisy to count as regressions
+NOISE_FLOOR = 0.002
+
+WATER_GEOMETRY = np.array([[0.0, 0.0, 0.0], [0.757, 0.586, 0.0], [-0.757, 0.586, 0.0]])
+WATER_SPACING = 3.1
+ARGON_SPACING = 3.8
+
+
+def _lattice(n_sites, spacing, rng):
+    side = int(np.ceil(n_sites ** (1.0 / 3)))
+    grid = np.stack(np.meshgrid(np.arange(side), np.arange(side), np.arange(side), indexing='ij'), -1)
+    sites = grid.reshape(-1, 3)[:n_sites] * spacing
+    return sites + rng.uniform(-0.2, 0.2, sites.shape)
+
+
+def water_cluster(n_atoms, seed=0):
+    """
+    A box of water molecules on a jittered lattice
+    :param n_atoms: number of atoms, rounded down to a whole number of molecules
+    :return: an array-backed Molecule
+    """
+    rng = np.random.default_rng(seed)
+    sites = _lattice(max(1, n_atoms // 3), WATER_SPACING, rng)
+    coordinates = (sites[:, None, :] + WATER_GEOMETRY[None, :, :]).reshape(-1, 3)
+    return Molecule.from_arrays("water_%i" % len(coordinates), np.tile(['O', 'H', 'H'], len(sites)), coordinates)
+
+
+def argon_cluster(n_atoms, seed=0):
+    """
+    Argon atoms on a jittered lattice
+    :return: an array-backed Molecule
+    """
+    rng = np.random.default_rng(seed)
+    coordinates = _lattice(n_atoms, ARGON_SPACING, rng)
+    return Molecule.from_arrays("argon_%i" % n_atoms, ['Ar'] * n_atoms, coordinates)
+
+
+def xyz_text(molecule):
+    return "%i\n%s\n" % (len(molecule), molecule.title) + "".join(
+        "%s %.8f %.8f %.8f\n" % atom for atom in molecule)
+
+
+def psi4_output_text(molecule):
+    return ("    Geometry (in Angstrom), charge = 0, multiplicity = 1:\n\n"
+            "       Center              X                  Y                   Z               Mass\n"
+            "    ------------   -----------------  -----------------  -----------------  -----------------\n" +
+            "".join("    %8s    %15.12f    %15.12f    %15.12f    1.000000000000\n" % atom for atom in molecule) +
+            "\n")
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def halves(molecule):
+    order = np.argsort(molecule.coordinates[:, 0], kind='stable')
+    half = len(order) // 2
+    labels = molecule.labels
+    coordinates = molecule.coordinates
+    return (Molecule.from_arrays("a", labels[order[:half]], coordinates[order[:half]]),
+            Molecule.from_arrays("b", labels[order[half:]], coordinates[order[half:]]))
+
+
+def benchmark_system(name, size, molecule, directory, repeat, results):
+    key = "{operation}/%s/%i" % (name, size)
+
+    xyz_path = os.path.join(directory, "%s_%i.xyz" % (name, size))
+    with open(xyz_path, "w") as f:
+        f.write(xyz_text(molecule))
+    psi4_path = os.path.join(directory, "%s_%i.out" % (name, size))
+    with open(psi4_path, "w") as f:
+        f.write(psi4_output_text(molecule))
+
+    timings = {
+        "from_xyz_file": lambda: Molecule.from_xyz_file(xyz_path),
+        "from_psi4_output": lambda: Molecule.from_psi4_output(psi4_path),
+        "get_z_sum": lambda: Molecule(molecule.title, list(molecule)).get_z_sum(),
+        "fragment": lambda: molecule.fragment(2),
+        "fragment_auto": lambda: molecule.fragment(AUTO_FRAGMENTS),
+    }
+    first, second = halves(molecule)
+    timings["distance_from"] = lambda: Molecule.from_arrays("a", first.labels, first.coordinates).distance_from(second)
+    fragments = molecule.fragment(2)
+    timings["format_psi4"] = molecule.format_psi4
+    timings["format_psi4_group"] = lambda: Molecule.format_psi4_group(fragments)
+    timings["format_gamess"] = molecule.format_gamess
+    output_path = os.path.join(directory, "%s_%i.inp" % (name, size))
+    timings["cli"] = lambda: subprocess.check_call(
+        [sys.executable, CLI_PATH, xyz_path, "--n_frags", "2", "--output_to", output_path],
+        stdout=subprocess.DEVNULL, cwd=REPOSITORY_ROOT)
+
+    for operation, function in timings.items():
+        results[key.format(operation=operation)] = best_time(function, repeat)
+        print("%-40s %10.4f s" % (key.format(operation=operation), results[key.format(operation=operation)]),
+              file=sys.stderr)
+
+
+def run(sizes, repeat):
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            benchmark_system("water", size, water_cluster(size), directory, repeat, results)
+            benchmark_system("argon", size, argon_cluster(size), directory, repeat, results)
+    finally:
+        shutil.rmtree(directory)
+    return {
+        "metadata": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "sizes": sizes,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """
+    Compares timings with a baseline report
+    :return: a list of (name, baseline time, new time) for every timing slower than the threshold allows
+    """
+    regressions = []
+    for name, elapsed in sorted(report["results"].items()):
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        if elapsed > previous * (1 + threshold) and elapsed - previous > NOISE_FLOOR:
+            regressions.append((name, previous, elapsed))
+    return regressions
+
+
+def main(args):
+    report = run(args.sizes, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for name, previous, elapsed in regressions:
+            print("Regression: %s took %.4f s, baseline %.4f s (%+.0f%%)" %
+                  (name, elapsed, previous, 100 * (elapsed / previous - 1)), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark molutils on synthetic clusters")
+    parser.add_argument("--sizes", help="cluster sizes in atoms", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", help="runs per timing; the best is kept", type=int, default=3)
+    parser.add_argument("--output", help="file to write the JSON report to, otherwise it is printed", type=str,
+                        default=None)
+    parser.add_argument("--baseline", help="a previous JSON report to compare against", type=str, default=None)
+    parser.add_argument("--threshold", help="allowed slow-down relative to the baseline (0.25 = 25%%)", type=float,
+                        default=DEFAULT_THRESHOLD)
+    sys.exit(main(parser.parse_args()))
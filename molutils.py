@@ -1,75 +1,394 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import functools
+import json
+import os
 import re
-from molutils.util.molecule import Molecule
+import signal
+import sys
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import molutils.util.molecule as molecule_settings
+from molutils.util import instrumentation
+from molutils.util.archive import ArchiveWriter, archive_type
+from molutils.util.daemon import Daemon, default_socket_path
+from molutils.util.fingerprint import DEFAULT_RMSD_TOLERANCE, deduplicate, format_mapping
+from molutils.util.molecule import Molecule, AUTO_FRAGMENTS
+from molutils.util.pipeline import Pipeline, Stage
+from molutils.util.psi4_pool import Psi4WorkerPool
 from molutils.util.job_formatters.psi4 import Psi4JobFormatter
 from molutils.util.job_formatters.gamess import GamessJobFormatter
 
 
+# Threads reading input files
+READ_THREADS = 4
+
+
+class _FileJob(object):
+    """
+    One input file on its way through the pipeline
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.molecules = None
+        # For each fragment, a (representative fragment number, rmsd) tuple when duplicates are being merged
+        self.mapping = None
+        self.counters = {}
+        # Timers recorded by the library while working on the file, as in a profiler report
+        self.timers = {}
+
+    def add_report(self, report):
+        """
+        Adds the measurements of a profiler report, which may come from a worker process
+        """
+        for name, n in report["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        for name, timer in report["timers"].items():
+            total = self.timers.setdefault(name, {"seconds": 0.0, "calls": 0})
+            total["seconds"] += timer["seconds"]
+            total["calls"] += timer["calls"]
+
+
 def main(args):
-    for file in args.input:
-        molecules = Molecule.from_file(file, psi4_path=args.path_to_psi4)
-        if args.n_frags > 1:
-            molecules = molecules.fragment(args.n_frags)
-        else:
-            molecules = [molecules]
-
-        # Psi4 calcs
-        if args.output_format.lower() == "psi4":
-            job_formatter = Psi4JobFormatter(molecules, basis_set=args.basis_set, memory=args.memory, memory_units="Gb")
-            _output(job_formatter.format(args.calc_type, args.calc_method, guess_charge=args.guess_charge),
-                    file,
-                    'inp',
-                    args.output_to)
-
-        # GAMESS calcs
-        elif args.output_format.lower() == "gamess":
-            i = 0
-            for m in molecules:
-                if len(molecules) > 1:
-                    output_file = "%i_%s" % (i, file)
-                else:
-                    output_file = file
-                job_formatter = GamessJobFormatter(m, args.basis_set, args.memory, args.memory_ddi)
-                _output(job_formatter.format(args.calc_type, args.calc_method, guess_charge=args.guess_charge),
-                        output_file,
-                        'inp',
-                        args.output_to)
-                i += 1
+    """
+    Runs every input file through a pipeline of read, fragment and charge guess stages, which work on different
+    files at the same time, and streams the inputs formatted from the results to their outputs
+    :return: the number of files that failed
+    """
+    _configure(args)
+    start_time = time.time()
+    n_files = 0
+    n_failed = 0
+    n_outputs = 0
+    file_reports = []
+    if args.profile:
+        instrumentation.start()
 
-        else:
-            raise NotImplemented("%s output format not yet implemented" % args.output_format)
+    # With more than one job the CPU-bound stages share a process pool; otherwise they run in threads
+    if args.jobs > 1:
+        process_executor = ProcessPoolExecutor(max_workers=args.jobs, initializer=_configure, initargs=(args,))
+        read_executor, read_workers = process_executor, args.jobs
+        fragment_executor, fragment_workers = process_executor, args.jobs
+    else:
+        read_executor, read_workers = ThreadPoolExecutor(max_workers=READ_THREADS), READ_THREADS
+        fragment_executor, fragment_workers = None, 1
+
+    stages = [Stage("parse", functools.partial(_collecting, _read, args=args), workers=read_workers,
+                    executor=read_executor)]
+    if args.n_frags == AUTO_FRAGMENTS or args.n_frags > 1:
+        stages.append(Stage("fragment", functools.partial(_collecting, _fragment, args=args),
+                            workers=fragment_workers, executor=fragment_executor))
+        if args.dedup:
+            stages.append(Stage("dedup", functools.partial(_collecting, _dedup, args=args)))
+    if args.guess_charge:
+        stages.append(_charge_stage(args))
+        if args.psi4_pool:
+            molecule_settings.PSI4_POOL = Psi4WorkerPool(_psi4_process_limit(args), psi4_path=args.path_to_psi4,
+                                                         python=args.psi4_python, n_threads=args.psi4_threads)
+    # Every output goes into one archive, written as a single stream, when --output_to names one
+    archive = ArchiveWriter(args.output_to) if archive_type(args.output_to) is not None else None
+
+    try:
+        for item in Pipeline(stages, ordered=not args.unordered).run(_FileJob(file) for file in args.input):
+            job = item.value
+            error = item.error
+            write_time = 0.0
+            if error is None:
+                write_start = time.perf_counter()
+                open_output = functools.partial(_open_output, destination=args.output_to, archive=archive,
+                                                source=job.file, counters=job.counters)
+                try:
+                    molecules = job.molecules if isinstance(job.molecules, list) else [job.molecules]
+                    n_outputs += write_outputs(job.file, molecules, args, open_output, mapping=job.mapping)
+                except Exception as e:
+                    error = e
+                job.molecules = None
+                write_time = time.perf_counter() - write_start
+            n_files += 1
+            if args.profile:
+                profiler = instrumentation.Profiler()
+                profiler.merge({"timers": job.timers, "counters": job.counters})
+                for name, seconds in dict(item.timings, write=write_time).items():
+                    profiler.add_time(name, seconds)
+                file_reports.append(dict(profiler.report(), file=job.file, failed=error is not None))
+            if error is not None:
+                n_failed += 1
+                print("Failed: %s (%s: %s)" % (job.file, type(error).__name__, error), file=sys.stderr)
+    finally:
+        for stage in stages:
+            if stage.executor is not None:
+                stage.executor.shutdown(cancel_futures=True)
+        if molecule_settings.PSI4_POOL is not None:
+            molecule_settings.PSI4_POOL.close()
+            molecule_settings.PSI4_POOL = None
+        if archive is not None:
+            archive.close()
+            print("Created: %s (%i files)" % (archive.path, len(archive.entries)))
+
+    elapsed = time.time() - start_time
+    if args.profile:
+        _write_profile(args.profile, file_reports, instrumentation.stop(), elapsed)
+    if len(args.input) > 1:
+        print("Processed %i files (%i failed), wrote %i input files in %.2f s (%.1f files/s)" %
+              (n_files, n_failed, n_outputs, elapsed, n_files / elapsed if elapsed > 0 else 0.0), file=sys.stderr)
+    return n_failed
+
+
+def _write_profile(destination, file_reports, library_report, elapsed):
+    aggregate = instrumentation.Profiler()
+    for report in file_reports:
+        aggregate.merge(report)
+    # Measurements made outside the work on any one file, such as shutting down the psi4 pool
+    aggregate.merge(library_report)
+    profile = {
+        "files": file_reports,
+        "aggregate": dict(aggregate.report(), files=len(file_reports), wall_seconds=elapsed),
+    }
+    if destination == "-":
+        json.dump(profile, sys.stderr, indent=2, sort_keys=True)
+        print(file=sys.stderr)
+    else:
+        with open(destination, "w") as f:
+            json.dump(profile, f, indent=2, sort_keys=True)
+
+
+def _configure(args):
+    molecule_settings.PSI4_MAX_WORKERS = args.psi4_workers
+    molecule_settings.PSI4_THREADS = args.psi4_threads
+    if args.no_charge_cache:
+        molecule_settings.CHARGE_CACHE = None
+    if args.no_charge_prescreen:
+        molecule_settings.CHARGE_PRESCREEN_WINDOW = None
+    molecule_settings.WRITE_BINARY_CACHE = args.binary_cache
+
+
+def _collecting(function, job, args):
+    """
+    Runs a stage function, keeping the measurements the library makes meanwhile on the job so that they are
+    reported for its file, even when the stage runs in a worker process
+    """
+    if not args.profile:
+        return function(job, args)
+    with instrumentation.collect() as profiler:
+        job = function(job, args)
+    job.add_report(profiler.report())
+    return job
+
+
+def _read(job, args):
+    # This and the other stage functions run in worker processes when there is more than one job
+    job.molecules = Molecule.from_file(job.file, psi4_path=args.path_to_psi4)
+    job.counters["atoms_parsed"] = len(job.molecules)
+    return job
+
+
+def _fragment(job, args):
+    job.molecules = job.molecules.fragment(args.n_frags)
+    return job
+
+
+def _psi4_process_limit(args):
+    return args.psi4_workers or max(1, (os.cpu_count() or 1) // (args.psi4_threads or 1))
+
+
+def _dedup(job, args):
+    job.mapping = deduplicate(job.molecules, tolerance=args.dedup_rmsd)[1]
+    job.counters["unique_fragments"] = sum(1 for i, (representative, _) in enumerate(job.mapping)
+                                           if i == representative)
+    return job
+
+
+def _charge_stage(args):
+    """
+    Guesses charges on the event loop, with psi4 running as asyncio subprocesses or on the warm worker pool. One
+    limit on the number of psi4 processes is shared by all files.
+    """
+    n_threads = args.psi4_threads
+    max_processes = _psi4_process_limit(args)
+    limit = asyncio.Semaphore(max_processes)
+
+    async def guess_charges(job):
+        molecules = job.molecules if isinstance(job.molecules, list) else [job.molecules]
+        if args.output_format.lower() == "gamess" and args.calc_type == "makefp":
+            # makefp inputs are padded before the charge is guessed
+            for molecule in molecules:
+                molecule.efp_pad_dummy_atoms()
+        if job.mapping is None:
+            await asyncio.gather(*[molecule.guess_charge_async(limit=limit, n_threads=n_threads)
+                                   for molecule in molecules])
+            return job
+        # Duplicates take the charge of their representative
+        await asyncio.gather(*[molecule.guess_charge_async(limit=limit, n_threads=n_threads)
+                               for i, molecule in enumerate(molecules) if job.mapping[i][0] == i])
+        for molecule, (representative, _) in zip(molecules, job.mapping):
+            molecule.charge = molecules[representative].charge
+            molecule.multiplicity = molecules[representative].multiplicity
+        return job
+
+    async def guess_charges_collecting(job):
+        # Like _collecting; the psi4 runs started here inherit the collecting context
+        if not args.profile:
+            return await guess_charges(job)
+        with instrumentation.collect() as profiler:
+            job = await guess_charges(job)
+        job.add_report(profiler.report())
+        return job
 
+    # Enough files in the stage at once to keep every allowed psi4 process busy
+    return Stage("guess_charge", guess_charges_collecting, workers=max_processes)
 
-def _output(content, input_file_name, output_ext, destination):
+
+def write_outputs(file, molecules, args, open_output, mapping=None):
+    """
+    Formats the inputs for one input file, streaming each to its output. Charges are guessed by an earlier stage,
+    not here.
+    :param open_output: a function taking an output file name and extension, and returning a context manager that
+    gives a file-like object open for writing text
+    :param mapping: for each molecule a (representative number, rmsd) tuple; only representatives are formatted
+    and the mapping is written alongside them
+    :return: the number of outputs written
+    """
+    # Psi4 calcs
+    if args.output_format.lower() == "psi4":
+        return Psi4JobFormatter.write_many([molecules], args.calc_type, args.calc_method,
+                                           lambda i, molecule: open_output(file, 'inp'),
+                                           basis_set=args.basis_set, memory=args.memory, memory_units="Gb")
+
+    # GAMESS calcs
+    elif args.output_format.lower() == "gamess":
+        selected = [i for i in range(len(molecules)) if mapping is None or mapping[i][0] == i]
+
+        def open_fragment(n, molecule):
+            if len(molecules) > 1:
+                return open_output("%i_%s" % (selected[n], file), 'inp')
+            return open_output(file, 'inp')
+
+        n_outputs = GamessJobFormatter.write_many([molecules[i] for i in selected], args.calc_type, args.calc_method,
+                                                  open_fragment, basis_set=args.basis_set,
+                                                  memory_replicated_gb=args.memory,
+                                                  memory_distributed_gb=args.memory_ddi)
+        if mapping is not None:
+            with open_output(file, 'map') as fp:
+                fp.write(format_mapping(mapping))
+            n_outputs += 1
+        return n_outputs
+
+    else:
+        raise NotImplemented("%s output format not yet implemented" % args.output_format)
+
+
+def _n_frags(value):
+    if value == AUTO_FRAGMENTS:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a number of fragments or '%s', got '%s'" % (AUTO_FRAGMENTS, value))
+
+
+def _output_file_name(input_file_name, output_ext):
     file_name_parts = input_file_name.rsplit('.', 1)
     if len(file_name_parts) > 1:
         ext_matcher = re.compile('\\.(%s)$' % file_name_parts[-1])
+        return ext_matcher.sub('.'+output_ext, input_file_name, count=1)
+    return "%s.%s" % (input_file_name, output_ext)
+
+
+class _CountingWriter(object):
+    """
+    Passes text on to a file, counting the bytes it takes in UTF-8
+    """
+
+    def __init__(self, fp):
+        self._file = fp
+        self.n_bytes = 0
+
+    def write(self, text):
+        self.n_bytes += len(text.encode('utf-8'))
+        return self._file.write(text)
+
+
+@contextmanager
+def _open_output(input_file_name, output_ext, destination, archive=None, source=None, counters=None):
+    """
+    Opens the output for one input, as chosen by --output_to, and adds the bytes written to it to counters
+    :param archive: the ArchiveWriter every output goes into, if any
+    :param source: the input file the output is generated from
+    """
+    if archive is not None:
+        with archive.open(_output_file_name(input_file_name, output_ext), source) as f:
+            fp = _CountingWriter(f)
+            yield fp
+    elif destination == "STDOUT":
+        fp = _CountingWriter(sys.stdout)
+        yield fp
+        # Each output is followed by an empty line
+        fp.write("\n")
     else:
-        ext_matcher = None
-    if destination == "STDOUT":
-        print(content)
-        return
-    elif destination == "AUTO":
-        if ext_matcher:
-            output_file_name = ext_matcher.sub('.'+output_ext, input_file_name, count=1)
+        if destination == "AUTO":
+            output_file_name = _output_file_name(input_file_name, output_ext)
+            print("Created: %s" % output_file_name)
         else:
-            output_file_name = "%s.%s" % (input_file_name, output_ext)
-        print("Created: %s" % output_file_name)
-    else:
-        output_file_name = destination
+            output_file_name = destination
+        with open(output_file_name, "w") as f:
+            fp = _CountingWriter(f)
+            yield fp
+    if counters is not None:
+        counters["bytes_written"] = counters.get("bytes_written", 0) + fp.n_bytes
 
-    with open(output_file_name, "w") as f:
-        f.write(content)
 
+# Library settings changed by _configure, put back after each request when serving
+_SETTINGS = ("PSI4_MAX_WORKERS", "PSI4_THREADS", "PSI4_POOL", "CHARGE_CACHE", "CHARGE_PRESCREEN_WINDOW",
+             "WRITE_BINARY_CACHE")
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("input", help="the input XYZ files to process", nargs="+", type=str)
+
+def serve(socket_path):
+    """
+    Keeps this process running and answers command lines sent by molutils_client.py on a Unix domain socket, so
+    that start-up is paid once rather than per file
+    """
+    defaults = {name: getattr(molecule_settings, name) for name in _SETTINGS}
+
+    def run(argv):
+        try:
+            parser = build_parser()
+            args = parser.parse_args(argv)
+            if args.serve:
+                parser.error("--serve cannot be sent to a server")
+            check_args(parser, args)
+            return 1 if main(args) else 0
+        finally:
+            for name, value in defaults.items():
+                setattr(molecule_settings, name, value)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    server = Daemon(socket_path, run)
+    # Stop the same way on SIGTERM as on Ctrl-C, removing the socket
+    signal.signal(signal.SIGTERM, terminate)
+    print("Listening on %s" % socket_path, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="molutils.py")
+    parser.add_argument("input", help="the input XYZ files to process", nargs="*", type=str)
     parser.add_argument("--output_format", help="the software for which an input file should be generated", type=str,
                         choices=['psi4', 'gamess'], default="psi4")
     parser.add_argument("--output_to", help="file name for output to be written,"
-                                            "'STDOUT' to print to screen, or 'AUTO' to autogenerate file names",
+                                            "'STDOUT' to print to screen, or 'AUTO' to autogenerate file names. "
+                                            "Names ending in .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz or .zip collect "
+                                            "every output in one archive under its AUTO name, listed and extracted "
+                                            "with 'python -m molutils.util.archive'",
                         type=str, default="STDOUT")
     parser.add_argument("--calc_type", help="the type of calculation to request", type=str,
                         choices=['energy', 'makefp'],
@@ -77,12 +396,70 @@ if __name__ == "__main__":
     parser.add_argument("--calc_method", help="the method of calculation (e.g. type=energy, method=mp2)", type=str,
                         default=None)
     parser.add_argument("--basis_set", help="the basis set to use", type=str, default=None)
-    parser.add_argument("--n_frags", help="the number of fragments the XYZ file should be split into", type=int,
-                        default=1)
+    parser.add_argument("--n_frags", help="the number of fragments the XYZ file should be split into, or 'auto' to "
+                                          "split it into its covalently bonded molecules", type=_n_frags, default=1)
+    parser.add_argument("--dedup", help="write one GAMESS input per group of identical fragments, and a .map file "
+                                        "giving the representative of every fragment; needs --output_format gamess "
+                                        "and --n_frags", action="store_true", default=False)
+    parser.add_argument("--dedup_rmsd", help="the largest RMSD in Angstrom between fragments merged by --dedup "
+                                             "(default: %(default)s)", type=float, default=DEFAULT_RMSD_TOLERANCE)
     parser.add_argument("--guess_charge", help="guess the charge", action="store_true", default=False)
     parser.add_argument("--memory", help="memory to use in calculation in GB", type=int, default=1)
     parser.add_argument("--memory_ddi", help="distributed memory to use in GAMESS calculations in GB", type=int,
                         default=1)
     parser.add_argument("--path_to_psi4", help="path to the psi4 executable", default="psi4")
+    parser.add_argument("--psi4_workers", help="the most psi4 processes to run at once when guessing charges "
+                                               "(default: one per CPU)", type=int, default=None)
+    parser.add_argument("--psi4_threads", help="the number of threads for each psi4 process", type=int, default=None)
+    parser.add_argument("--psi4_pool", help="keep psi4 running in worker processes that guess one charge after "
+                                            "another instead of starting psi4 for each calculation",
+                        action="store_true", default=False)
+    parser.add_argument("--psi4_python", help="the Python interpreter that can import psi4, for --psi4_pool "
+                                              "(default: the interpreter of the psi4 executable)", default=None)
+    parser.add_argument("--no_charge_cache", help="always run psi4 to guess charges instead of reusing results "
+                                                  "cached from earlier runs", action="store_true", default=False)
+    parser.add_argument("--no_charge_prescreen", help="run psi4 for every candidate charge of a fragment instead of "
+                                                      "ruling candidates out with a quick estimate first",
+                        action="store_true", default=False)
+    parser.add_argument("--binary_cache", help="save a binary copy of each input next to it, which later runs read "
+                                               "instead of the input while it is unchanged",
+                        action="store_true", default=False)
+    parser.add_argument("--jobs", help="the number of input files to process in parallel", type=int, default=1)
+    parser.add_argument("--unordered", help="write outputs as soon as each file is done rather than in input order",
+                        action="store_true", default=False)
+    parser.add_argument("--profile", help="write a JSON report of the time spent in each phase, per file and in "
+                                          "total, to the given file, or to stderr for '-'", metavar="FILE",
+                        type=str, default=None)
+    parser.add_argument("--serve", help="stay running and process the command lines sent by molutils_client.py to "
+                                        "the --socket Unix domain socket", action="store_true", default=False)
+    parser.add_argument("--socket", help="the Unix domain socket for --serve (default: %(default)s)", type=str,
+                        default=default_socket_path())
+    return parser
+
+
+def check_args(parser, args):
+    """
+    Rejects combinations of arguments that argparse cannot check on its own, exiting through parser.error
+    """
+    if not args.input:
+        parser.error("the following arguments are required: input")
+    if args.profile is not None and args.profile != "-" and args.profile in args.input:
+        parser.error("--profile would overwrite the input %s" % args.profile)
+    if args.dedup:
+        if args.output_format.lower() != "gamess":
+            parser.error("--dedup only applies to --output_format gamess, which writes one input per fragment")
+        if args.n_frags != AUTO_FRAGMENTS and args.n_frags <= 1:
+            parser.error("--dedup needs fragments to merge: use --n_frags auto or more than one fragment")
+
+
+if __name__ == "__main__":
+    parser = build_parser()
     args = parser.parse_args()
-    main(args)
+    if args.serve:
+        try:
+            serve(args.socket)
+        except ValueError as e:
+            parser.error(str(e))
+        sys.exit(0)
+    check_args(parser, args)
+    sys.exit(1 if main(args) else 0)
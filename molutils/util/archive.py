@@ -0,0 +1,240 @@
+import argparse
+import io
+import json
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from contextlib import contextmanager
+
+# Archive types chosen by the end of the file name, as (kind, compression) tuples
+ARCHIVE_SUFFIXES = [
+    (".tar", ("tar", "")),
+    (".tar.gz", ("tar", "gz")),
+    (".tgz", ("tar", "gz")),
+    (".tar.bz2", ("tar", "bz2")),
+    (".tar.xz", ("tar", "xz")),
+    (".zip", ("zip", None)),
+]
+
+# The member holding the index, written after every other member
+INDEX_NAME = "molutils_index.json"
+
+# Bytes buffered before each write to the archive file
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def archive_type(path):
+    """
+    :param path: a file name
+    :return: a (kind, compression) tuple, or None if the name does not end in an archive suffix
+    """
+    lower = path.lower()
+    for suffix, kind in sorted(ARCHIVE_SUFFIXES, key=lambda item: -len(item[0])):
+        if lower.endswith(suffix):
+            return kind
+    return None
+
+
+def member_name(name):
+    """
+    Makes a file name safe to store and extract: relative, without '..' components and with '/' separators
+    """
+    parts = [part for part in name.replace(os.sep, "/").split("/") if part not in ("", ".", "..")]
+    if not parts:
+        raise ValueError("Cannot store a file named %r in an archive" % name)
+    return "/".join(parts)
+
+
+class _Unseekable(object):
+    """
+    Hides seek from zipfile, which then writes each entry once followed by its sizes instead of going back to fill
+    them in
+    """
+
+    def __init__(self, f):
+        self._file = f
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def tell(self):
+        return self._file.tell()
+
+    def seek(self, *args):
+        raise io.UnsupportedOperation("seek")
+
+    def flush(self):
+        self._file.flush()
+
+
+class ArchiveWriter(object):
+    """
+    Streams generated files into one tar (optionally compressed) or zip archive, written front to back in a single
+    pass, and ends it with an index of every file and the input it came from
+    """
+
+    def __init__(self, path):
+        kind = archive_type(path)
+        if kind is None:
+            raise ValueError("%s does not end in an archive suffix: %s" %
+                             (path, ", ".join(suffix for suffix, _ in ARCHIVE_SUFFIXES)))
+        self.path = path
+        self.kind, compression = kind
+        self.entries = []
+        self._file = open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+        if self.kind == "tar":
+            # Stream mode never seeks, so the archive is one sequential write
+            self._archive = tarfile.open(fileobj=self._file, mode="w|" + compression)
+        else:
+            self._archive = zipfile.ZipFile(_Unseekable(self._file), "w", compression=zipfile.ZIP_DEFLATED)
+        self._mtime = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def add(self, name, content, source=None):
+        """
+        :param name: the file name in the archive
+        :param content: the file content as a string
+        :param source: the input file the content was generated from
+        :return: the number of bytes of content
+        """
+        with self.open(name, source) as fp:
+            fp.write(content)
+        return self.entries[-1]["size"]
+
+    @contextmanager
+    def open(self, name, source=None):
+        """
+        Opens a file in the archive for writing text, which is added when the block ends. Zip entries are streamed
+        into the archive; tar entries are held in memory until then, since a tar header gives the size of its file.
+        A file whose block raises is left out of the index, and out of tar archives.
+        :param name: the file name in the archive
+        :param source: the input file the content is generated from
+        :return: a file-like object open for writing text
+        """
+        name = member_name(name)
+        if self.kind == "tar":
+            data = io.BytesIO()
+        else:
+            info = zipfile.ZipInfo(name, time.localtime(self._mtime)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            data = self._archive.open(info, "w")
+        fp = io.TextIOWrapper(data, encoding="utf-8", newline="")
+        try:
+            yield fp
+            fp.flush()
+        finally:
+            # Otherwise the wrapper closes the tar buffer, before it is added, when it is garbage collected
+            fp.detach()
+            if self.kind != "tar":
+                data.close()
+        if self.kind == "tar":
+            content = data.getvalue()
+            self._write(name, content)
+            size = len(content)
+        else:
+            size = info.file_size
+        self.entries.append({"name": name, "size": size, "source": source})
+
+    def close(self):
+        if self._archive is None:
+            return
+        try:
+            index = {"entries": self.entries}
+            self._write(INDEX_NAME, (json.dumps(index, indent=1) + "\n").encode("utf-8"))
+            self._archive.close()
+        finally:
+            self._archive = None
+            self._file.close()
+
+    def _write(self, name, data):
+        if self.kind == "tar":
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = self._mtime
+            info.mode = 0o644
+            self._archive.addfile(info, io.BytesIO(data))
+        else:
+            self._archive.writestr(zipfile.ZipInfo(name, time.localtime(self._mtime)[:6]), data,
+                                   compress_type=zipfile.ZIP_DEFLATED)
+
+
+def iter_archive(path):
+    """
+    Reads an archive written by ArchiveWriter from front to back
+    :return: a generator of (name, content bytes) tuples, without the index
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.filename != INDEX_NAME and not info.is_dir():
+                    yield info.filename, archive.read(info)
+    else:
+        with tarfile.open(path, mode="r|*") as archive:
+            for info in archive:
+                if info.isfile() and info.name != INDEX_NAME:
+                    yield info.name, archive.extractfile(info).read()
+
+
+def read_index(path):
+    """
+    :return: the list of index entries of an archive written by ArchiveWriter, each a dictionary with the name,
+    size in bytes and source input file of a generated file
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return json.loads(archive.read(INDEX_NAME).decode("utf-8"))["entries"]
+    with tarfile.open(path, mode="r|*") as archive:
+        for info in archive:
+            if info.name == INDEX_NAME:
+                return json.loads(archive.extractfile(info).read().decode("utf-8"))["entries"]
+    raise ValueError("%s has no index" % path)
+
+
+def extract_archive(path, destination=".", names=None):
+    """
+    Writes the files of an archive written by ArchiveWriter under a directory
+    :param names: the names of the files to extract, or None for all of them
+    :return: the list of paths written
+    """
+    written = []
+    wanted = set(names) if names is not None else None
+    for name, data in iter_archive(path):
+        if wanted is not None and name not in wanted:
+            continue
+        output_path = os.path.join(destination, *member_name(name).split("/"))
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output_path, "wb") as f:
+            f.write(data)
+        written.append(output_path)
+    return written
+
+
+def _main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m molutils.util.archive",
+                                     description="List or extract an archive written by molutils.py --output_to")
+    parser.add_argument("command", choices=["list", "extract"])
+    parser.add_argument("archive", help="the archive file")
+    parser.add_argument("names", help="the files to extract (default: all)", nargs="*")
+    parser.add_argument("--to", help="the directory to extract into", default=".")
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        for entry in read_index(args.archive):
+            print("%10i  %s  %s" % (entry["size"], entry["name"], entry["source"] or ""))
+    else:
+        for output_path in extract_archive(args.archive, args.to, names=args.names or None):
+            print("Created: %s" % output_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,115 @@
+import json
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from .periodic_table import SYMBOLS, lookup_atomic_numbers
+
+MAGIC = b"MOLBIN01"
+SIDECAR_SUFFIX = ".molbin"
+
+# Array blocks start on this boundary so that they can be viewed in place
+ALIGNMENT = 64
+
+Frame = namedtuple("Frame", ["title", "labels", "coordinates", "charge", "multiplicity"])
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def source_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def write_frames(path, frames, source=None):
+    """
+    Writes one or more geometries to a binary file. All frames share one atomic number array, one float64
+    coordinate block and, only when the labels are not plain element symbols, one label array.
+    :param path: the file to write
+    :param frames: a sequence of Frame tuples
+    :param source: path of the file the frames were read from, recorded so that stale caches can be detected
+    :raises ValueError: if a label is not an element symbol
+    """
+    labels = np.concatenate([np.asarray(frame.labels, dtype=str).reshape(-1) for frame in frames]) \
+        if frames else np.empty(0, dtype=str)
+    coordinates = np.concatenate([np.asarray(frame.coordinates, dtype='<f8').reshape(-1, 3) for frame in frames]) \
+        if frames else np.empty((0, 3), dtype='<f8')
+    numbers = lookup_atomic_numbers(labels).astype('<i2')
+
+    label_width = 0
+    if len(labels) > 0 and not np.array_equal(SYMBOLS[numbers], labels):
+        label_width = max(1, int(np.char.str_len(labels).max()))
+
+    metadata = {
+        "n_atoms": len(labels),
+        "label_width": label_width,
+        "source": source_stamp(source) if source is not None else None,
+        "frames": [],
+    }
+    start = 0
+    for frame in frames:
+        n_atoms = len(np.asarray(frame.labels).reshape(-1))
+        metadata["frames"].append({"title": frame.title, "charge": frame.charge, "multiplicity": frame.multiplicity,
+                                   "start": start, "n_atoms": n_atoms})
+        start += n_atoms
+    header = json.dumps(metadata).encode('utf-8')
+
+    numbers_offset = _align(len(MAGIC) + 8 + len(header))
+    coordinates_offset = _align(numbers_offset + numbers.nbytes)
+    labels_offset = _align(coordinates_offset + coordinates.nbytes)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for offset, block in ((numbers_offset, numbers), (coordinates_offset, coordinates)):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(block.tobytes())
+        if label_width:
+            f.write(b'\0' * (labels_offset - f.tell()))
+            f.write(np.char.encode(labels, 'utf-8').astype('S%i' % label_width).tobytes())
+
+
+def read_frames(path, source=None):
+    """
+    Reads a binary file written by write_frames. Coordinates are read-only views on a memory map of the file,
+    so nothing is copied until they are changed.
+    :param path: the file to read
+    :param source: if given, the file the cache must have been made from in its current state
+    :return: a list of Frame tuples
+    :raises ValueError: if the file is not a binary molecule file or is out of date
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a binary molecule file" % path)
+        header_length = struct.unpack('<Q', f.read(8))[0]
+        metadata = json.loads(f.read(header_length).decode('utf-8'))
+    if source is not None and metadata["source"] != source_stamp(source):
+        raise ValueError("%s is out of date for %s" % (path, source))
+
+    n_atoms = metadata["n_atoms"]
+    numbers_offset = _align(len(MAGIC) + 8 + header_length)
+    coordinates_offset = _align(numbers_offset + 2 * n_atoms)
+    labels_offset = _align(coordinates_offset + 24 * n_atoms)
+    if n_atoms > 0:
+        numbers = np.memmap(path, dtype='<i2', mode='r', offset=numbers_offset, shape=(n_atoms,))
+        coordinates = np.memmap(path, dtype='<f8', mode='r', offset=coordinates_offset, shape=(n_atoms, 3))
+    else:
+        numbers = np.empty(0, dtype='<i2')
+        coordinates = np.empty((0, 3), dtype='<f8')
+    if metadata["label_width"]:
+        raw_labels = np.memmap(path, dtype='S%i' % metadata["label_width"], mode='r', offset=labels_offset,
+                               shape=(n_atoms,))
+        labels = np.char.decode(raw_labels, 'utf-8')
+    else:
+        labels = SYMBOLS[numbers]
+
+    frames = []
+    for frame in metadata["frames"]:
+        atoms = slice(frame["start"], frame["start"] + frame["n_atoms"])
+        frames.append(Frame(frame["title"], labels[atoms], coordinates[atoms], frame["charge"],
+                            frame["multiplicity"]))
+    return frames
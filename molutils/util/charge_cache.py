@@ -0,0 +1,141 @@
+import hashlib
+import os
+import sqlite3
+import time
+import warnings
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Share of entries dropped, oldest first, when the cache grows past its size limit
+EVICTION_FRACTION = 0.25
+
+
+def default_cache_path():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "molutils", "charges.sqlite")
+
+
+def geometry_hash(molecule):
+    """
+    A hash of the atom labels and coordinates, with coordinates at the precision written to psi4 inputs.
+    The title, charge and multiplicity are not part of it.
+    :param molecule: a Molecule object
+    :return: a hex digest
+    """
+    digest = hashlib.sha256()
+    for label, x, y, z in molecule:
+        digest.update(("%s %.10f %.10f %.10f\n" % (label, x, y, z)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ChargeCache(object):
+    """
+    A persistent SQLite cache of guess_charge results, shared between processes, with least-recently-used
+    eviction once the database grows past max_bytes. The cache is only an optimisation: if the database cannot be
+    opened or used, a warning is given once and every lookup after that is a miss.
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._initialised = False
+        self._failed = False
+
+    @staticmethod
+    def key(molecule, lower_range, upper_range, multiplicity, job_template, prescreen_window=None):
+        """
+        :param prescreen_window: the CHARGE_PRESCREEN_WINDOW the charge was guessed with, which can narrow the
+        candidates psi4 is run for
+        """
+        template_hash = hashlib.sha256(job_template.encode('utf-8')).hexdigest()
+        return "%s:%i:%i:%i:%s:%r" % (molecule.geometry_hash(), lower_range, upper_range, multiplicity, template_hash,
+                                      prescreen_window)
+
+    def _disable(self, error):
+        if not self._failed:
+            self._failed = True
+            warnings.warn("Not using the charge cache %s: %s" % (self.path, error), RuntimeWarning)
+
+    def _connect(self):
+        if self.path is None:
+            self.path = default_cache_path()
+        if not self._initialised:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialised:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS charges "
+                               "(key TEXT PRIMARY KEY, charge INTEGER NOT NULL, last_used REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS charges_last_used ON charges (last_used)")
+            connection.commit()
+            self._initialised = True
+        return connection
+
+    def get(self, key):
+        """
+        :param key: a key made by ChargeCache.key
+        :return: the cached charge, or None
+        """
+        if self._failed:
+            return None
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    row = connection.execute("SELECT charge FROM charges WHERE key = ?", (key,)).fetchone()
+                    if row is None:
+                        return None
+                    connection.execute("UPDATE charges SET last_used = ? WHERE key = ?", (time.time(), key))
+                    return row[0]
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error) as e:
+            self._disable(e)
+            return None
+
+    def put(self, key, charge):
+        """
+        :param key: a key made by ChargeCache.key
+        :param charge: the charge to store
+        """
+        if self._failed:
+            return
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute("INSERT OR REPLACE INTO charges (key, charge, last_used) VALUES (?, ?, ?)",
+                                       (key, charge, time.time()))
+                    self._evict(connection)
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error) as e:
+            self._disable(e)
+
+    def _evict(self, connection):
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        if (page_count - free_pages) * page_size <= self.max_bytes:
+            return
+        count = connection.execute("SELECT COUNT(*) FROM charges").fetchone()[0]
+        connection.execute("DELETE FROM charges WHERE key IN "
+                           "(SELECT key FROM charges ORDER BY last_used LIMIT ?)",
+                           (max(1, int(count * EVICTION_FRACTION)),))
+
+    def __len__(self):
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT COUNT(*) FROM charges").fetchone()[0]
+        finally:
+            connection.close()
+
+    def clear(self):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM charges")
+        finally:
+            connection.close()
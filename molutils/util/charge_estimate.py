@@ -0,0 +1,128 @@
+import numpy as np
+
+from .periodic_table import IONISATION_ENERGIES, ELECTRON_AFFINITIES, lookup_atomic_numbers
+from .spatial import SpatialIndex
+
+# e^2 / (4 pi epsilon_0) in eV Angstrom
+COULOMB_CONSTANT = 14.399645
+
+# Whole fragments with an atom this close to a fragment, in Angstrom, are its surroundings in a charge estimate
+ENVIRONMENT_RADIUS = 5.0
+
+# Largest neighbourhood estimated, in atoms. The estimate holds n x n matrices and solves them in O(n^3) time, so
+# bigger neighbourhoods are left to psi4.
+MAX_ENVIRONMENT_ATOMS = 1000
+
+
+class ChargeEnvironment(object):
+    """
+    The system a set of fragments was cut from. Charge estimates for a fragment let it exchange charge with the
+    fragments around it. One environment is shared by all fragments of a system, and nothing is worked out until
+    the first estimate.
+    """
+
+    def __init__(self, labels, coordinates, groups, charge=0):
+        """
+        :param labels: the atom labels of the whole system
+        :param coordinates: an (n, 3) array of the coordinates of the whole system
+        :param groups: a list of atom index arrays, one per fragment
+        :param charge: the charge of the whole system
+        """
+        self.labels = labels
+        self.coordinates = coordinates
+        self.groups = groups
+        self.charge = charge
+        self._atomic_numbers = None
+        self._labels_resolved = False
+        self._fragment_of = None
+        self._index = None
+
+    @property
+    def atomic_numbers(self):
+        """
+        The atomic numbers of the whole system, or None if a label is not an element symbol (e.g. OW or HW1)
+        """
+        if not self._labels_resolved:
+            try:
+                self._atomic_numbers = lookup_atomic_numbers(self.labels)
+            except ValueError:
+                pass
+            self._labels_resolved = True
+        return self._atomic_numbers
+
+    def neighbourhood(self, fragment, radius=ENVIRONMENT_RADIUS):
+        """
+        :param fragment: the number of a fragment
+        :return: a tuple of (atom index array, total charge): the atoms of the fragment followed by those of every
+        fragment within radius of it, and their total charge. Neighbourhoods smaller than the whole system are
+        taken to be neutral.
+        """
+        if self._index is None:
+            self._fragment_of = np.empty(len(self.coordinates), dtype=np.int64)
+            for k, group in enumerate(self.groups):
+                self._fragment_of[group] = k
+            self._index = SpatialIndex(self.coordinates)
+        members = self.groups[fragment]
+        _, near, _ = self._index.pairs_within(self.coordinates[members], radius)
+        neighbours = np.setdiff1d(self._fragment_of[near], [fragment])
+        atoms = np.concatenate([members] + [self.groups[k] for k in neighbours]).astype(np.int64)
+        return atoms, self.charge if len(neighbours) + 1 == len(self.groups) else 0
+
+    def candidate_energies(self, fragment, candidates):
+        """
+        Estimates the energy of the fragment's neighbourhood with the fragment holding each candidate charge, by
+        electronegativity equalisation with Ohno-Klopman screened Coulomb interactions
+        :param fragment: the number of a fragment
+        :param candidates: a sequence of charges
+        :return: an array of energies in eV, relative to the lowest, or None if a label is not an element, an
+        element has no parameters or the neighbourhood has more than MAX_ENVIRONMENT_ATOMS atoms
+        """
+        if self.atomic_numbers is None or len(self.groups[fragment]) > MAX_ENVIRONMENT_ATOMS:
+            return None
+        atoms, total_charge = self.neighbourhood(fragment)
+        if len(atoms) > MAX_ENVIRONMENT_ATOMS:
+            return None
+        in_fragment = np.zeros(len(atoms), dtype=bool)
+        in_fragment[:len(self.groups[fragment])] = True
+        # Dummy atoms carry no charge
+        real = self.atomic_numbers[atoms] > 0
+        atoms = atoms[real]
+        in_fragment = in_fragment[real]
+
+        z = self.atomic_numbers[atoms]
+        electronegativity = (IONISATION_ENERGIES[z] + ELECTRON_AFFINITIES[z]) / 2
+        hardness = IONISATION_ENERGIES[z] - ELECTRON_AFFINITIES[z]
+        if len(z) == 0 or np.isnan(hardness).any():
+            return None
+        if in_fragment.all():
+            # Nothing to exchange charge with
+            return None
+        coordinates = self.coordinates[atoms]
+        distances = np.sqrt(((coordinates[:, np.newaxis] - coordinates[np.newaxis]) ** 2).sum(axis=-1))
+        screening = 2 * COULOMB_CONSTANT / (hardness[:, np.newaxis] + hardness[np.newaxis])
+        interactions = COULOMB_CONSTANT / np.sqrt(distances ** 2 + screening ** 2)
+        np.fill_diagonal(interactions, hardness)
+
+        # Minimising chi.q + q.A.q / 2 with the fragment and the rest each holding a fixed charge b gives an energy
+        # of (b + u).G^-1.(b + u) / 2 plus a constant, where u = C.A^-1.chi and G = C.A^-1.C^T
+        constraints = np.stack([in_fragment, ~in_fragment]).astype(np.float64)
+        solved = np.linalg.solve(interactions, np.column_stack([electronegativity, constraints.T]))
+        u = constraints @ solved[:, 0]
+        g = constraints @ solved[:, 1:]
+        candidates = np.asarray(candidates, dtype=np.float64)
+        b = np.column_stack([candidates, total_charge - candidates]) + u
+        energies = 0.5 * np.einsum("ki,ij,kj->k", b, np.linalg.inv(g), b)
+        return energies - energies.min()
+
+
+def screen_charges(candidates, energies, window):
+    """
+    Drops the candidate charges whose estimated energy is more than window above the lowest
+    :param candidates: a list of charges
+    :param energies: their estimated energies, or None to keep them all
+    :param window: the energy window in eV
+    :return: a list of the remaining charges, in the original order
+    """
+    if energies is None:
+        return list(candidates)
+    return [q for q, energy in zip(candidates, energies) if energy <= window]
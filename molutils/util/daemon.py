@@ -0,0 +1,199 @@
+"""
+A Unix domain socket server that runs command lines inside one resident process, and the client side of it.
+Only the standard library is imported here, so that clients start quickly.
+
+Each request is one line of JSON holding the command line arguments and the client's working directory; each reply
+is one line of JSON holding the exit status and everything written to stdout and stderr.
+
+Only the user running the server may use it: the socket is created readable and writable by its owner alone, and
+where the platform reports the peer's credentials, connections from other users are refused.
+"""
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+from io import StringIO
+
+# Holds the default socket when there is no XDG_RUNTIME_DIR; created, and checked, to be private to the user
+FALLBACK_SOCKET_DIRECTORY = os.path.join("/tmp", "molutils-%i" % os.getuid())
+
+# The socket used when none is given, overridden by the MOLUTILS_SOCKET environment variable
+DEFAULT_SOCKET = (os.path.join(os.environ["XDG_RUNTIME_DIR"], "molutils-%i.sock" % os.getuid())
+                  if os.environ.get("XDG_RUNTIME_DIR") else os.path.join(FALLBACK_SOCKET_DIRECTORY, "molutils.sock"))
+
+# Largest request line accepted, in bytes
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+
+def default_socket_path():
+    return os.environ.get("MOLUTILS_SOCKET") or DEFAULT_SOCKET
+
+
+def private_directory(directory, create=True):
+    """
+    Makes sure a directory can only be used by the current user, so that nobody else can put a socket in it
+    :param directory: the directory
+    :param create: whether to create the directory with mode 0700 if it does not exist
+    :raise ValueError: if the directory is not a directory owned by the current user and closed to everyone else
+    """
+    if create:
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise ValueError("%s is not a directory private to this user" % directory)
+
+
+def _peer_uid(connection):
+    """
+    :return: the user id of the process at the other end of a Unix domain socket, or None if the platform does not
+    report it
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    pid, uid, gid = struct.unpack("3i", credentials)
+    return uid
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        peer_uid = _peer_uid(self.request)
+        if peer_uid is not None and peer_uid != self.server.uid:
+            reply = {"status": 1, "stdout": "", "stderr": "Permission denied: the server belongs to another user\n"}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            return
+        try:
+            request = json.loads(self.rfile.readline(MAX_REQUEST_SIZE).decode("utf-8"))
+            argv = [str(arg) for arg in request["argv"]]
+            cwd = request.get("cwd")
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {"status": 2, "stdout": "", "stderr": "Bad request: %s\n" % e}
+        else:
+            reply = self.server.run(argv, cwd)
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+
+class Daemon(socketserver.UnixStreamServer):
+    """
+    Answers requests one at a time, each run by the handle function in the client's working directory with stdout
+    and stderr captured. Requests are not run concurrently because the working directory and the standard streams
+    belong to the whole process.
+    """
+
+    def __init__(self, socket_path, handle):
+        """
+        :param socket_path: the path of the Unix domain socket to listen on
+        :param handle: a function taking a list of command line arguments and returning an exit status
+        """
+        if os.path.dirname(os.path.abspath(socket_path)) == FALLBACK_SOCKET_DIRECTORY:
+            private_directory(FALLBACK_SOCKET_DIRECTORY)
+        if os.path.lexists(socket_path):
+            if not _is_socket(socket_path):
+                raise ValueError("%s exists and is not a socket" % socket_path)
+            if _is_listening(socket_path):
+                raise ValueError("A server is already listening on %s" % socket_path)
+            # Left behind by a server that did not shut down cleanly
+            os.unlink(socket_path)
+        self.socket_path = socket_path
+        self.command = handle
+        # The only user whose requests are run
+        self.uid = os.getuid()
+        socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+        # Identifies the socket file, so that a file put in its place later is left alone
+        st = os.lstat(socket_path)
+        self._socket_id = (st.st_dev, st.st_ino)
+
+    def server_bind(self):
+        # Create the socket file closed to other users, rather than opening it up to them until a chmod
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            st = os.lstat(self.socket_path)
+        except FileNotFoundError:
+            return
+        if stat.S_ISSOCK(st.st_mode) and (st.st_dev, st.st_ino) == self._socket_id:
+            os.unlink(self.socket_path)
+
+    def run(self, argv, cwd=None):
+        """
+        :return: a reply dictionary with the exit status and the captured stdout and stderr
+        """
+        stdout = StringIO()
+        stderr = StringIO()
+        previous_cwd = os.getcwd()
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    if cwd is not None:
+                        os.chdir(cwd)
+                    status = self.command(argv)
+                except SystemExit as e:
+                    # Raised by argparse for bad arguments and --help
+                    status = e.code
+                    if not isinstance(status, int) and status is not None:
+                        print(status, file=stderr)
+                        status = 1
+                except Exception:
+                    traceback.print_exc()
+                    status = 1
+        finally:
+            os.chdir(previous_cwd)
+        return {"status": status or 0, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+
+def _is_socket(path):
+    return stat.S_ISSOCK(os.lstat(path).st_mode)
+
+
+def _is_listening(socket_path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        client.close()
+
+
+def request(argv, socket_path=None, cwd=None, timeout=None):
+    """
+    Runs a command line on a server
+    :param argv: the command line arguments, without the program name
+    :param socket_path: the server's socket, by default default_socket_path()
+    :param cwd: the working directory for the command, by default the current one
+    :param timeout: seconds to wait for the reply, or None to wait as long as it takes
+    :return: a tuple of (exit status, stdout, stderr)
+    :raise ValueError: if the default socket is in a directory that is not private to this user
+    """
+    socket_path = socket_path or default_socket_path()
+    if os.path.dirname(os.path.abspath(socket_path)) == FALLBACK_SOCKET_DIRECTORY:
+        # Do not send the command line to a socket someone else put there
+        private_directory(FALLBACK_SOCKET_DIRECTORY, create=False)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(socket_path)
+        message = {"argv": list(argv), "cwd": cwd if cwd is not None else os.getcwd()}
+        client.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        with client.makefile("rb") as f:
+            line = f.readline()
+    finally:
+        client.close()
+    if not line:
+        raise ConnectionError("The server closed the connection without replying")
+    reply = json.loads(line.decode("utf-8"))
+    return reply["status"], reply["stdout"], reply["stderr"]
@@ -0,0 +1,41 @@
+import mmap
+import warnings
+
+import numpy as np
+
+# Labels are parsed into fixed width strings; anything this long or longer is left to the line-by-line parser
+MAX_LABEL_LENGTH = 8
+
+_ATOM_DTYPE = [('label', 'U%i' % MAX_LABEL_LENGTH), ('x', 'f8'), ('y', 'f8'), ('z', 'f8')]
+
+
+def read_xyz_mmap(path):
+    """
+    Reads a single-frame XYZ file by memory-mapping it and converting all atom lines in bulk with NumPy. This
+    accepts the same input as Molecule.from_xyz_file, except that every line after the title must either be
+    blank or start with a label and three coordinates.
+    :param path: path to the XYZ file
+    :return: a tuple of (title, label array, (n, 3) coordinate array)
+    :raises ValueError: if the file cannot be read this way
+    """
+    with open(path, 'rb') as f:
+        # mmap refuses empty files with a ValueError, which sends them to the line-by-line parser too
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Ignore leading blank lines, then skip the atom count line
+            line = mm.readline()
+            while line and not line.strip():
+                line = mm.readline()
+            title = mm.readline().decode('utf-8').replace(" ", "_")
+
+            with warnings.catch_warnings():
+                # An empty body is fine, it just means there are no atoms
+                warnings.simplefilter("ignore", UserWarning)
+                atoms = np.loadtxt(iter(mm.readline, b''), dtype=_ATOM_DTYPE, comments=None, usecols=(0, 1, 2, 3),
+                                   encoding='utf-8', ndmin=1)
+
+    label_length = int(np.char.str_len(atoms['label']).max()) if len(atoms) > 0 else 1
+    if label_length >= MAX_LABEL_LENGTH:
+        raise ValueError("Atom labels are too long to be read in bulk")
+    labels = atoms['label'].astype('U%i' % label_length)
+    coordinates = np.column_stack((atoms['x'], atoms['y'], atoms['z']))
+    return title, labels, coordinates
@@ -0,0 +1,152 @@
+import itertools
+
+import numpy as np
+
+from . import instrumentation
+
+# Fragments whose atoms can be overlaid to within this root mean square distance, in Angstrom, are duplicates
+DEFAULT_RMSD_TOLERANCE = 0.1
+
+# Correspondence and alignment rounds when overlaying two fragments
+ALIGNMENT_ROUNDS = 3
+
+# The proper rotations that turn a principal axis frame into another one with the axis directions flipped in pairs
+_AXIS_FLIPS = np.array([[1, 1, 1], [1, -1, -1], [-1, 1, -1], [-1, -1, 1]], dtype=np.float64)
+
+
+class Fingerprint(object):
+    """
+    A rotation and translation invariant description of a fragment: its sorted composition plus its coordinates in
+    a frame fixed by the atoms themselves, with the origin at the centroid and the axes along the principal axes of
+    the atom spread. Dummy atoms are left out. Fragments with equal compositions are compared by overlaying them.
+    The root mean square spread along each principal axis is kept as well. It does not depend on atom order or
+    orientation, and it moves by no more than the RMSD between two fragments, so it rules out most pairs without an
+    overlay.
+    """
+
+    def __init__(self, atomic_numbers, coordinates):
+        """
+        :param atomic_numbers: the atomic number of each atom
+        :param coordinates: an (n, 3) array of coordinates
+        """
+        atomic_numbers = np.asarray(atomic_numbers)
+        real = atomic_numbers > 0
+        order = np.argsort(atomic_numbers[real], kind="stable")
+        self.atomic_numbers = atomic_numbers[real][order]
+        self.composition = tuple(self.atomic_numbers.tolist())
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)[real][order]
+        coordinates = coordinates - coordinates.mean(axis=0) if len(coordinates) else coordinates
+        moments, axes = np.linalg.eigh(coordinates.T @ coordinates)
+        # Point each axis towards the side on which the atoms reach further out, and keep the frame right handed
+        projected = coordinates @ axes
+        signs = np.where(np.sum(projected ** 3, axis=0) < 0, -1.0, 1.0)
+        axes = axes * signs
+        axes[:, 2] = np.cross(axes[:, 0], axes[:, 1])
+        self.moments = moments
+        self.spread = np.sqrt(np.maximum(moments, 0.0) / max(len(coordinates), 1))
+        self.coordinates = coordinates @ axes
+        # Atom ranges of each element, in the sorted order
+        _, starts = np.unique(self.atomic_numbers, return_index=True)
+        self._blocks = [slice(start, end) for start, end in zip(starts, list(starts[1:]) + [len(order)])]
+
+    def rmsd(self, other):
+        """
+        Overlays another fingerprint on this one, matching atoms of the same element to each other
+        :param other: a Fingerprint object
+        :return: the root mean square distance between matched atoms after the best rotation, or infinity if the
+        compositions differ. Any matching gives an upper bound, so a small value always means a real match;
+        highly symmetric fragments can be given a larger value than the true best.
+        """
+        if self.composition != other.composition:
+            return np.inf
+        if len(self.composition) == 0:
+            return 0.0
+        best = np.inf
+        # The principal axes are only fixed up to flips when the atoms are spread symmetrically, so try them all
+        for flip in _AXIS_FLIPS:
+            moved = other.coordinates * flip
+            for _ in range(ALIGNMENT_ROUNDS):
+                matched = self._match(moved)
+                rotation = _kabsch(matched, self.coordinates)
+                moved = moved @ rotation
+            best = min(best, float(np.sqrt(np.mean(np.sum((self._match(moved) - self.coordinates) ** 2, axis=1)))))
+        return best
+
+    def _match(self, coordinates):
+        # Greedily pairs each atom of this fragment with the nearest unpaired atom of the same element
+        matched = np.empty_like(coordinates)
+        for block in self._blocks:
+            ours = self.coordinates[block]
+            theirs = coordinates[block]
+            d2 = np.sum((ours[:, np.newaxis] - theirs[np.newaxis]) ** 2, axis=-1)
+            used_ours = np.zeros(len(ours), dtype=bool)
+            used_theirs = np.zeros(len(ours), dtype=bool)
+            target = matched[block]
+            for flat in np.argsort(d2, axis=None):
+                i, j = divmod(int(flat), len(ours))
+                if not used_ours[i] and not used_theirs[j]:
+                    used_ours[i] = used_theirs[j] = True
+                    target[i] = theirs[j]
+        return matched
+
+
+def _kabsch(moving, fixed):
+    """
+    :return: the proper rotation matrix R minimising the distance between moving @ R and fixed, both centred
+    """
+    u, _, vt = np.linalg.svd(moving.T @ fixed)
+    d = np.sign(np.linalg.det(u @ vt)) or 1.0
+    return u @ np.diag([1.0, 1.0, d]) @ vt
+
+
+def deduplicate(molecules, tolerance=DEFAULT_RMSD_TOLERANCE):
+    """
+    Groups molecules that are the same up to rotation and translation, with the same charge and multiplicity.
+    Molecules are only overlaid on representatives whose spreads are within tolerance of theirs, found through a
+    grid of spreads with cells of that size. Molecules that all have the same composition and spread but are not
+    duplicates still take one overlay per pair.
+    :param molecules: a list of Molecule objects
+    :param tolerance: the largest RMSD in Angstrom between duplicates
+    :return: a tuple of (representatives, mapping): the indices of the first molecule of each group, and for every
+    molecule a (representative index, rmsd) tuple
+    """
+    # Representatives by composition, charge and multiplicity, then by grid cell of their spread
+    groups = {}
+    representatives = []
+    mapping = []
+    cell_size = max(tolerance, 1e-9)
+    for i, molecule in enumerate(molecules):
+        fingerprint = molecule.fingerprint()
+        cells = groups.setdefault((fingerprint.composition, molecule.charge, molecule.multiplicity), {})
+        cell = tuple(np.floor(fingerprint.spread / cell_size).astype(np.int64).tolist())
+        # The spread moves by no more than the RMSD, so duplicates lie in this cell or a neighbouring one
+        candidates = []
+        for offset in itertools.product((-1, 0, 1), repeat=3):
+            for representative in cells.get(tuple(c + o for c, o in zip(cell, offset)), ()):
+                spread = molecules[representative].fingerprint().spread
+                if np.sqrt(np.sum((spread - fingerprint.spread) ** 2)) <= tolerance:
+                    candidates.append(representative)
+        match = None
+        # The earliest representative that matches wins, as if every one had been tried in turn
+        for representative in sorted(candidates):
+            instrumentation.count("dedup_overlays")
+            rmsd = molecules[representative].fingerprint().rmsd(fingerprint)
+            if rmsd <= tolerance:
+                match = (representative, rmsd)
+                break
+        if match is None:
+            cells.setdefault(cell, []).append(i)
+            representatives.append(i)
+            match = (i, 0.0)
+        mapping.append(match)
+    return representatives, mapping
+
+
+def format_mapping(mapping):
+    """
+    :param mapping: the mapping returned by deduplicate
+    :return: a text table of each fragment number, the number of its representative, and the RMSD between them
+    """
+    lines = ["# fragment representative rmsd"]
+    lines += ["%i %i %.4f" % (i, representative, rmsd) for i, (representative, rmsd) in enumerate(mapping)]
+    return "\n".join(lines) + "\n"
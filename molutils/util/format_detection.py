@@ -0,0 +1,103 @@
+import re
+
+# Amount of text read from the start of a file to decide its format
+SNIFF_SIZE = 8192
+
+XYZ_FORMAT = "xyz"
+PSI4_OUTPUT_FORMAT = "psi4"
+
+_PSI4_MARKERS = re.compile(r"Psi4|==> Geometry <==|^\s*Center\s+X\s+Y\s+Z\s+Mass\s*$", re.MULTILINE)
+
+
+def sniff_format(head):
+    """
+    Decides the format of a file from the text at its start
+    :param head: up to SNIFF_SIZE characters from the start of the file
+    :return: XYZ_FORMAT or PSI4_OUTPUT_FORMAT
+    """
+    for line in head.splitlines():
+        if line.strip():
+            try:
+                int(line.split()[0])
+                return XYZ_FORMAT
+            except ValueError:
+                break
+    if _PSI4_MARKERS.search(head):
+        return PSI4_OUTPUT_FORMAT
+    return XYZ_FORMAT
+
+
+def chain_lines(head, rest):
+    """
+    Iterates over the lines of a stream whose first part has already been read
+    :param head: the text already read
+    :param rest: the stream, positioned just after head
+    :return: a generator of lines
+    """
+    lines = head.splitlines(True)
+    partial = ''
+    if lines and not lines[-1].endswith('\n'):
+        partial = lines.pop()
+    for line in lines:
+        yield line
+    for line in rest:
+        if partial:
+            line = partial + line
+            partial = ''
+        yield line
+    if partial:
+        yield partial
+
+
+def read_head(fp):
+    """
+    Reads the start of a stream for sniffing, in a single bounded read
+    :param fp: a file-like object open in text mode
+    :return: a tuple of (head, stream) where stream gives all of the lines of fp, including those in head. Seekable
+    streams are rewound; others are wrapped so that nothing is read twice.
+    """
+    try:
+        seekable = fp.seekable()
+    except AttributeError:
+        seekable = False
+    if seekable:
+        position = fp.tell()
+        head = fp.read(SNIFF_SIZE)
+        fp.seek(position)
+        return head, fp
+    head = fp.read(SNIFF_SIZE)
+    return head, chain_lines(head, fp)
+
+
+def rereadable(fp):
+    """
+    Reads the start of a stream for sniffing, like read_head, and lets the whole stream be read again if the first
+    parser tried on it fails
+    :param fp: a file-like object open in text mode
+    :return: a tuple of (head, reopen) where reopen is a function giving all of the lines of fp each time it is
+    called. Seekable streams are rewound; the lines of others are kept as they are read, to be replayed.
+    """
+    head, stream = read_head(fp)
+    if stream is fp:
+        position = fp.tell()
+
+        def rewind():
+            fp.seek(position)
+            return fp
+
+        return head, rewind
+
+    kept = []
+
+    def replay():
+        i = 0
+        while True:
+            if i == len(kept):
+                line = next(stream, None)
+                if line is None:
+                    return
+                kept.append(line)
+            yield kept[i]
+            i += 1
+
+    return head, replay
@@ -0,0 +1,292 @@
+import heapq
+
+import numpy as np
+
+from .periodic_table import COVALENT_RADII
+from .spatial import SpatialIndex, BRUTE_FORCE_PAIR_LIMIT, brute_force_min_distance
+
+# Once no more than this many clusters remain, the distances between whole clusters are computed directly instead
+# of searching ever larger neighbourhoods around every atom
+CLUSTER_LINKAGE_LIMIT = 64
+
+# Two atoms are bonded if they are no further apart than the sum of their covalent radii plus this, in Angstrom
+BOND_TOLERANCE = 0.45
+
+
+class _Clusters(object):
+    """
+    Union-find over atom indices. Each cluster also records its atoms in the order the original pairwise merge
+    loop would have produced: when two clusters merge, the atoms of the cluster holding the lowest atom index come
+    first, followed by the atoms of the other cluster.
+    """
+
+    def __init__(self, n_atoms):
+        self.count = n_atoms
+        self._parent = list(range(n_atoms))
+        self._size = [1] * n_atoms
+        # first atom (which is also the lowest atom index) and last atom of each cluster, keyed by root
+        self._first = list(range(n_atoms))
+        self._last = list(range(n_atoms))
+        self._next = [-1] * n_atoms
+
+    def find(self, atom):
+        parent = self._parent
+        root = atom
+        while parent[root] != root:
+            root = parent[root]
+        while parent[atom] != root:
+            parent[atom], atom = root, parent[atom]
+        return root
+
+    def first(self, root):
+        return self._first[root]
+
+    def union(self, root_a, root_b):
+        """
+        Merges two clusters given by their roots
+        :return: the root of the merged cluster
+        """
+        if self._first[root_a] > self._first[root_b]:
+            root_a, root_b = root_b, root_a
+        self._next[self._last[root_a]] = self._first[root_b]
+        first, last = self._first[root_a], self._last[root_b]
+
+        if self._size[root_a] < self._size[root_b]:
+            root_a, root_b = root_b, root_a
+        self._parent[root_b] = root_a
+        self._size[root_a] += self._size[root_b]
+        self._first[root_a] = first
+        self._last[root_a] = last
+        self.count -= 1
+        return root_a
+
+    def roots(self):
+        return np.array([self.find(atom) for atom in range(len(self._parent))], dtype=np.int64)
+
+    def groups(self):
+        """
+        :return: the atom indices of each cluster, with clusters ordered by their lowest atom index
+        """
+        groups = []
+        for atom in range(len(self._parent)):
+            root = self.find(atom)
+            if self._first[root] != atom:
+                continue
+            group = []
+            while atom != -1:
+                group.append(atom)
+                atom = self._next[atom]
+            groups.append(group)
+        return groups
+
+
+def _cluster_key(clusters, root_a, root_b):
+    first_a = clusters.first(root_a)
+    first_b = clusters.first(root_b)
+    if first_a < first_b:
+        return first_a, first_b
+    return first_b, first_a
+
+
+def _merge_ties(clusters, atoms_a, atoms_b, n_clusters):
+    """
+    Merges clusters joined by a group of equally long edges. The original merge loop picks, among the equally
+    close pairs of clusters, the pair whose positions in its list of clusters come first; those positions follow
+    the lowest atom index of each cluster, so the same choice is made here with a heap keyed on those indices.
+    """
+    heap = []
+    incident = {}
+    for edge, (a, b) in enumerate(zip(atoms_a, atoms_b)):
+        root_a, root_b = clusters.find(a), clusters.find(b)
+        if root_a == root_b:
+            continue
+        heap.append(_cluster_key(clusters, root_a, root_b) + (edge,))
+        incident.setdefault(root_a, []).append(edge)
+        incident.setdefault(root_b, []).append(edge)
+    heapq.heapify(heap)
+
+    while heap and clusters.count > n_clusters:
+        first_a, first_b, edge = heapq.heappop(heap)
+        root_a, root_b = clusters.find(atoms_a[edge]), clusters.find(atoms_b[edge])
+        if root_a == root_b or _cluster_key(clusters, root_a, root_b) != (first_a, first_b):
+            continue
+
+        # The cluster starting at the higher atom index takes on the lower one, so its edges get new keys
+        absorbed = root_b if clusters.first(root_a) < clusters.first(root_b) else root_a
+        root = clusters.union(root_a, root_b)
+        absorbed_edges = incident.pop(absorbed, [])
+        for other in absorbed_edges:
+            other_a, other_b = clusters.find(atoms_a[other]), clusters.find(atoms_b[other])
+            if other_a != other_b:
+                heapq.heappush(heap, _cluster_key(clusters, other_a, other_b) + (other,))
+        kept_edges = incident.pop(root_a if absorbed == root_b else root_b, [])
+        if len(kept_edges) < len(absorbed_edges):
+            kept_edges, absorbed_edges = absorbed_edges, kept_edges
+        kept_edges.extend(absorbed_edges)
+        incident[root] = kept_edges
+
+
+def _link(clusters, atoms_a, atoms_b, distances, n_clusters):
+    """
+    Kruskal's algorithm over a set of candidate edges, stopping once n_clusters clusters remain
+    """
+    order = np.argsort(distances, kind='stable')
+    atoms_a = atoms_a[order].tolist()
+    atoms_b = atoms_b[order].tolist()
+    distances = distances[order].tolist()
+
+    i = 0
+    while i < len(distances) and clusters.count > n_clusters:
+        j = i + 1
+        while j < len(distances) and distances[j] == distances[i]:
+            j += 1
+        if j == i + 1:
+            root_a, root_b = clusters.find(atoms_a[i]), clusters.find(atoms_b[i])
+            if root_a != root_b:
+                clusters.union(root_a, root_b)
+        else:
+            _merge_ties(clusters, atoms_a[i:j], atoms_b[i:j], n_clusters)
+        i = j
+
+
+def _link_all_pairs(clusters, coordinates, n_clusters):
+    atoms_a, atoms_b = np.triu_indices(len(coordinates), k=1)
+    d = coordinates[atoms_a] - coordinates[atoms_b]
+    distances = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2])
+    _link(clusters, atoms_a, atoms_b, distances, n_clusters)
+
+
+def _link_neighbours(clusters, coordinates, index, radius, n_clusters):
+    # Only pairs that join two different clusters can cause a merge
+    roots = clusters.roots()
+    atoms_a = []
+    atoms_b = []
+    distances = []
+    for i, j, d2 in index.iter_pairs_within(coordinates, radius):
+        keep = (i < j) & (roots[i] != roots[j])
+        atoms_a.append(i[keep])
+        atoms_b.append(j[keep])
+        distances.append(np.sqrt(d2[keep]))
+    if atoms_a:
+        _link(clusters, np.concatenate(atoms_a), np.concatenate(atoms_b), np.concatenate(distances), n_clusters)
+
+
+def _link_clusters(clusters, coordinates, n_clusters):
+    # The single-linkage distance between each pair of clusters, represented by an edge between their first atoms
+    groups = clusters.groups()
+    points = [coordinates[group] for group in groups]
+    indexes = [None] * len(groups)
+    atoms_a = []
+    atoms_b = []
+    distances = []
+    for i in range(len(groups)):
+        for j in range(i + 1, len(groups)):
+            if len(points[i]) * len(points[j]) <= BRUTE_FORCE_PAIR_LIMIT:
+                distance = brute_force_min_distance(points[i], points[j])
+            else:
+                larger = i if len(points[i]) >= len(points[j]) else j
+                if indexes[larger] is None:
+                    indexes[larger] = SpatialIndex(points[larger])
+                distance = indexes[larger].min_distance(points[j if larger == i else i])
+            atoms_a.append(groups[i][0])
+            atoms_b.append(groups[j][0])
+            distances.append(distance)
+    _link(clusters, np.array(atoms_a, dtype=np.int64), np.array(atoms_b, dtype=np.int64),
+          np.array(distances, dtype=np.float64), n_clusters)
+
+
+def single_linkage_fragments(coordinates, n_frags):
+    """
+    Splits a set of atoms into fragments by single-linkage clustering, repeatedly joining the two fragments whose
+    nearest atoms are closest. The result, including the order of atoms within each fragment and the order of the
+    fragments, is the same as merging fragments one pair at a time.
+    :param coordinates: an (n, 3) array of atom coordinates
+    :param n_frags: number of fragments
+    :return: a list of lists of atom indices, one per fragment
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+    if n_frags < 1 or n_frags > len(coordinates):
+        raise ValueError("Cannot split %i atoms into %i fragments" % (len(coordinates), n_frags))
+
+    clusters = _Clusters(len(coordinates))
+    if len(coordinates) * (len(coordinates) - 1) // 2 <= BRUTE_FORCE_PAIR_LIMIT:
+        _link_all_pairs(clusters, coordinates, n_frags)
+        return clusters.groups()
+
+    # Merge along ever longer neighbour edges until few enough clusters remain to compare them all directly
+    index = SpatialIndex(coordinates)
+    radius = index.cell_size
+    while clusters.count > max(n_frags, CLUSTER_LINKAGE_LIMIT):
+        _link_neighbours(clusters, coordinates, index, radius, n_frags)
+        radius *= 2
+    if clusters.count > n_frags:
+        _link_clusters(clusters, coordinates, n_frags)
+    return clusters.groups()
+
+
+def covalent_bonds(atomic_numbers, coordinates, tolerance=BOND_TOLERANCE):
+    """
+    Finds the bonded pairs of atoms from their covalent radii, searching only the cells next to each atom
+    :param atomic_numbers: the atomic number of each atom
+    :param coordinates: an (n, 3) array of atom coordinates
+    :param tolerance: how much longer than the sum of the covalent radii a bond may be
+    :return: a tuple of two atom index arrays, with the lower index of each bond first
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+    radii = COVALENT_RADII[np.asarray(atomic_numbers, dtype=np.int64).reshape(-1)]
+    atoms_a = []
+    atoms_b = []
+    if len(coordinates) > 1 and not np.all(np.isnan(radii)):
+        # Cells just wider than the longest possible bond keep the candidates down to the atoms close to each atom
+        radius = 2 * np.nanmax(radii) + tolerance
+        index = SpatialIndex(coordinates, cell_size=radius * 1.001)
+        for i, j, d2 in index.iter_pairs_within(coordinates, radius):
+            cutoff = radii[i] + radii[j] + tolerance
+            # NaN cut-offs compare false, so atoms without a radius are left unbonded
+            bonded = (i < j) & (d2 <= cutoff * cutoff)
+            atoms_a.append(i[bonded])
+            atoms_b.append(j[bonded])
+    if not atoms_a:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(atoms_a).astype(np.int64), np.concatenate(atoms_b).astype(np.int64)
+
+
+def connected_components(n_atoms, atoms_a, atoms_b):
+    """
+    Labels the connected components of a graph by repeatedly hooking each root onto the lowest root it is joined
+    to and then flattening the trees. The number of clusters at least halves every round.
+    :param n_atoms: the number of atoms
+    :param atoms_a: the first atom of each edge
+    :param atoms_b: the second atom of each edge
+    :return: an array giving, for each atom, the lowest atom index in its component
+    """
+    parent = np.arange(n_atoms)
+    while True:
+        root_a = parent[atoms_a]
+        root_b = parent[atoms_b]
+        joined = root_a != root_b
+        if not np.any(joined):
+            return parent
+        low = np.minimum(root_a[joined], root_b[joined])
+        high = np.maximum(root_a[joined], root_b[joined])
+        np.minimum.at(parent, high, low)
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+
+def covalent_fragments(atomic_numbers, coordinates, tolerance=BOND_TOLERANCE):
+    """
+    Splits a set of atoms into its separate molecules, i.e. the connected components of the covalent bond graph
+    :param atomic_numbers: the atomic number of each atom
+    :param coordinates: an (n, 3) array of atom coordinates
+    :param tolerance: how much longer than the sum of the covalent radii a bond may be
+    :return: a list of atom index arrays, one per fragment, ordered by their lowest atom index
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+    components = connected_components(len(coordinates), *covalent_bonds(atomic_numbers, coordinates, tolerance))
+    order = np.argsort(components, kind='stable')
+    boundaries = np.flatnonzero(np.diff(components[order])) + 1
+    return [group for group in np.split(order, boundaries) if len(group) > 0]
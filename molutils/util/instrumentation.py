@@ -0,0 +1,142 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Profiler(object):
+    """
+    Collects named timers and counters. Updates may come from several threads at once.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            total, calls = self.timers.get(name, (0.0, 0))
+            self.timers[name] = (total + seconds, calls + 1)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        """
+        :return: the timers and counters as a JSON-serialisable dictionary
+        """
+        with self._lock:
+            return {
+                "timers": {name: {"seconds": total, "calls": calls} for name, (total, calls) in self.timers.items()},
+                "counters": dict(self.counters),
+            }
+
+    def merge(self, report):
+        """
+        Adds the timers and counters of a report made by another profiler
+        """
+        with self._lock:
+            for name, timer in report["timers"].items():
+                total, calls = self.timers.get(name, (0.0, 0))
+                self.timers[name] = (total + timer["seconds"], calls + timer["calls"])
+            for name, n in report["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+
+class _Timer(object):
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profiler.add_time(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+# The profiler receiving measurements, or None when profiling is off
+_active_profiler = None
+
+# A profiler for the work of one thread or asyncio task, which takes its measurements instead of the active one
+_collecting_profiler = contextvars.ContextVar("collecting_profiler", default=None)
+
+
+def start():
+    """
+    Starts collecting measurements in a new profiler
+    :return: the new Profiler
+    """
+    global _active_profiler
+    _active_profiler = Profiler()
+    return _active_profiler
+
+
+def stop():
+    """
+    Stops collecting measurements
+    :return: the report of the profiler that was active, or None
+    """
+    global _active_profiler
+    profiler, _active_profiler = _active_profiler, None
+    return profiler.report() if profiler is not None else None
+
+
+def is_active():
+    return _current_profiler() is not None
+
+
+def _current_profiler():
+    profiler = _collecting_profiler.get()
+    return profiler if profiler is not None else _active_profiler
+
+
+@contextmanager
+def collect():
+    """
+    Collects the measurements made inside the block in a profiler of their own, even when profiling has not been
+    started, e.g. in a worker process. Threads and tasks started inside the block only report to it if they run in
+    a copy of its context (contextvars.copy_context).
+    :return: the new Profiler
+    """
+    profiler = Profiler()
+    token = _collecting_profiler.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _collecting_profiler.reset(token)
+
+
+def timer(name):
+    """
+    A context manager that adds the time spent inside it to the named timer. Timers may be nested, so the time
+    of an inner timer is also part of the outer one. Does nothing when profiling is off.
+    """
+    profiler = _current_profiler()
+    if profiler is None:
+        return _NULL_TIMER
+    return _Timer(profiler, name)
+
+
+def count(name, n=1):
+    """
+    Adds n to the named counter. Does nothing when profiling is off.
+    """
+    profiler = _current_profiler()
+    if profiler is not None:
+        profiler.count(name, n)
@@ -1,3 +1,6 @@
+from io import StringIO
+
+
 class Formatter(object):
     def format(self, type, method, guess_charge=False):
         """
@@ -7,4 +10,77 @@ class Formatter(object):
         :param method: calculation method (e.g. MP2)
         :return: the formatted result
         """
-        raise NotImplemented("All formatters must implement the format method")
\ No newline at end of file
+        raise NotImplemented("All formatters must implement the format method")
+
+    def write(self, fp, type, method, guess_charge=False):
+        """
+        Writes the formatted result to a file-like object, streaming the coordinates. Nothing is written if the
+        charge cannot be guessed or the calculation type is not supported.
+        :param fp: a file-like object open for writing text
+        :param type: calculation type (e.g. energy)
+        :param method: calculation method (e.g. MP2)
+        """
+        header, footer = self._header_footer(type, method)
+        molecule = self._prepare(self.molecule, guess_charge=guess_charge)
+        self._write_input(fp, header, footer, molecule)
+
+    def _header_footer(self, type, method):
+        """
+        :return: a tuple of the text before and after the molecule in an input, which is the same for every
+        molecule with these settings
+        """
+        raise NotImplementedError("%s cannot write %s inputs" % (self.__class__.__name__, type))
+
+    def _prepare(self, molecule, guess_charge=False):
+        """
+        Does everything that can fail before an input is written, such as guessing the charge
+        :return: the molecule or molecule group to write
+        """
+        return molecule
+
+    def _write_molecule(self, fp, molecule):
+        raise NotImplementedError("%s cannot write molecules" % self.__class__.__name__)
+
+    def _write_input(self, fp, header, footer, molecule):
+        fp.write(header)
+        self._write_molecule(fp, molecule)
+        fp.write(footer)
+
+    @classmethod
+    def format_many(cls, molecules, type, method, guess_charge=False, **settings):
+        """
+        Formats one input for each of many molecules with the same settings. The parts of the input that are the
+        same for every molecule are rendered once, and only the molecule is formatted for each input.
+        :param molecules: an iterable of molecules or molecule groups, such as a MoleculeBatch, read lazily
+        :param type: calculation type (e.g. energy)
+        :param method: calculation method (e.g. MP2)
+        :param settings: the other keyword arguments of the formatter's constructor (e.g. basis_set)
+        :return: a generator of formatted inputs, one per molecule
+        """
+        formatter = cls(None, **settings)
+        header, footer = formatter._header_footer(type, method)
+        for molecule in molecules:
+            molecule = formatter._prepare(molecule, guess_charge=guess_charge)
+            fp = StringIO()
+            formatter._write_input(fp, header, footer, molecule)
+            yield fp.getvalue()
+
+    @classmethod
+    def write_many(cls, molecules, type, method, open_output, guess_charge=False, **settings):
+        """
+        Writes one input for each of many molecules, like format_many, streaming each to its own file. A file is
+        only opened once its molecule is ready to write, so a failed charge guess leaves no partial input behind.
+        :param molecules: an iterable of molecules or molecule groups, read lazily
+        :param open_output: a function taking the number of a molecule and the molecule, and returning a file-like
+        object open for writing text, which is closed once the input is written
+        :return: the number of inputs written
+        """
+        formatter = cls(None, **settings)
+        header, footer = formatter._header_footer(type, method)
+        n = 0
+        for i, molecule in enumerate(molecules):
+            prepared = formatter._prepare(molecule, guess_charge=guess_charge)
+            with open_output(i, molecule) as fp:
+                formatter._write_input(fp, header, footer, prepared)
+            n += 1
+        return n
@@ -1,3 +1,5 @@
+from io import StringIO
+
 from ..molecule import Molecule
 from .formatter import Formatter
 
@@ -28,20 +30,33 @@ class GamessJobFormatter(Formatter):
             raise NotImplementedError("Calculation type %s not implemented for GAMESS calculations" % type)
 
     def makefp(self, guess_charge=False):
-        if isinstance(self.molecule, Molecule):
-            molecule_text = self.molecule.efp_pad_dummy_atoms().format_gamess(guess_charge=guess_charge)
-        elif len(self.molecule) == 1:
-            molecule_text = self.molecule[0].efp_pad_dummy_atoms().format_gamess(guess_charge=guess_charge)
-        else:
-            raise ValueError("makefp cannot format a molecule group")
-
-        template = (
-            " {memory}\n"
-            " $CONTRL RUNTYP=MAKEFP $END\n"
-            " {basis_set}\n"
-            "{molecule}\n"
-        )
-
-        return template.format(memory=self._format_memory(),
-                               basis_set=self._format_basis_set(),
-                               molecule=molecule_text)
\ No newline at end of file
+        fp = StringIO()
+        self.write_makefp(fp, guess_charge=guess_charge)
+        return fp.getvalue()
+
+    def write_makefp(self, fp, guess_charge=False):
+        """
+        Writes a MAKEFP calculation input to a file-like object, streaming the coordinates
+        """
+        self.write(fp, "makefp", None, guess_charge=guess_charge)
+
+    def _header_footer(self, type, method):
+        if type != "makefp":
+            raise NotImplementedError("Calculation type %s not implemented for GAMESS calculations" % type)
+        return (" %s\n"
+                " $CONTRL RUNTYP=MAKEFP $END\n"
+                " %s\n" % (self._format_memory(), self._format_basis_set())), "\n"
+
+    def _prepare(self, molecule, guess_charge=False):
+        if not isinstance(molecule, Molecule):
+            if len(molecule) != 1:
+                raise ValueError("makefp cannot format a molecule group")
+            molecule = molecule[0]
+        # The charge is guessed for the padded molecule that is written
+        molecule.efp_pad_dummy_atoms()
+        if guess_charge:
+            molecule.guess_charge()
+        return molecule
+
+    def _write_molecule(self, fp, molecule):
+        molecule.write_gamess(fp)
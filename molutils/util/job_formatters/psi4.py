@@ -1,6 +1,20 @@
+from io import StringIO
+
 from ..molecule import Molecule
 from .formatter import Formatter
 
+ENERGY_FOOTER_TEMPLATE = (
+    "\n"
+    "set {{\n"
+    "  guess sad\n"
+    "  basis_guess 3-21G\n"
+    "  basis {basis_set}\n"
+    "  scf_type DF\n"
+    "  freeze_core True\n"
+    "}}\n"
+    "energy('{type}')\n"
+)
+
 
 class Psi4JobFormatter(Formatter):
 
@@ -21,29 +35,33 @@ class Psi4JobFormatter(Formatter):
             raise NotImplemented("Calculation type %s not implemented for Psi4 calculations" % type)
 
     def energy(self, type="scf", guess_charge=False):
-        if isinstance(self.molecule, Molecule):
-            molecule_text = self.molecule.format_psi4(guess_charge=guess_charge)
-        elif len(self.molecule) == 1:
-            molecule_text = self.molecule[0].format_psi4(guess_charge=guess_charge)
+        fp = StringIO()
+        self.write_energy(fp, type=type, guess_charge=guess_charge)
+        return fp.getvalue()
+
+    def write_energy(self, fp, type="scf", guess_charge=False):
+        """
+        Writes an energy calculation input to a file-like object, streaming the coordinates
+        """
+        self.write(fp, "energy", type, guess_charge=guess_charge)
+
+    def _header_footer(self, type, method):
+        if type != "energy":
+            raise NotImplementedError("Calculation type %s not implemented for Psi4 calculations" % type)
+        if method is None:
+            method = "mp2"
+        return ("memory %s %s\n" % (self.memory, self.memory_units),
+                ENERGY_FOOTER_TEMPLATE.format(basis_set=self.basis_set, type=method))
+
+    def _prepare(self, molecule, guess_charge=False):
+        molecules = [molecule] if isinstance(molecule, Molecule) else list(molecule)
+        if guess_charge:
+            for m in molecules:
+                m.guess_charge()
+        return molecules
+
+    def _write_molecule(self, fp, molecules):
+        if len(molecules) == 1:
+            molecules[0].write_psi4(fp)
         else:
-            molecule_text = Molecule.format_psi4_group(self.molecule, guess_charge=guess_charge)
-
-        template = (
-            "memory {memory} {memory_units}\n"
-            "{molecule}\n"
-            "set {{\n"
-            "  guess sad\n"
-            "  basis_guess 3-21G\n"
-            "  basis {basis_set}\n"
-            "  scf_type DF\n"
-            "  freeze_core True\n"
-            "}}\n"
-            "energy('{type}')\n"
-        )
-        return template.format(
-            memory=self.memory,
-            memory_units=self.memory_units,
-            molecule=molecule_text,
-            basis_set=self.basis_set,
-            type=type
-        )
\ No newline at end of file
+            Molecule.write_psi4_group(molecules, fp)
@@ -1,24 +1,105 @@
-import math
+import asyncio
+import contextvars
 import os
 import re
 import subprocess
 import random
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+
+from . import instrumentation
+from .binary_cache import SIDECAR_SUFFIX, Frame, read_frames, write_frames
+from .charge_cache import ChargeCache, geometry_hash
+from .charge_estimate import ChargeEnvironment, screen_charges
+from .fingerprint import Fingerprint
 from .molecule_formatters import MoleculeFormatterMixin
-from .periodic_table import lookup_element_by_symbol
+from .periodic_table import SYMBOLS, lookup_atomic_numbers
+from .fast_xyz import read_xyz_mmap
+from .format_detection import SNIFF_SIZE, PSI4_OUTPUT_FORMAT, XYZ_FORMAT, rereadable, sniff_format
+from .fragmentation import covalent_fragments, single_linkage_fragments
+from .psi4_output import parse_psi4_output, read_last_psi4_geometry
+from .spatial import SpatialIndex, BRUTE_FORCE_PAIR_LIMIT, brute_force_min_distance
 
 DEFAULT_PSI4_EXECUTABLE = "psi4"
 
+# Defaults for the psi4 runs made by Molecule.guess_charge. None lets the number of concurrent runs follow the
+# number of CPUs, and lets psi4 pick its own thread count.
+PSI4_MAX_WORKERS = None
+PSI4_THREADS = None
+
+# A Psi4WorkerPool that guess_charge sends its jobs to instead of starting a psi4 process for each one
+PSI4_POOL = None
+
+# Candidate charges that the in-process estimate of guess_charge puts more than this many eV above the best candidate
+# are not run through psi4, and when one candidate is left psi4 is not run at all. None runs psi4 on them all.
+CHARGE_PRESCREEN_WINDOW = 2.0
+
+# Persistent cache of guess_charge results; set to None to always run psi4
+CHARGE_CACHE = ChargeCache()
+
+# Geometry selections for Molecule.from_psi4_output
+FIRST_GEOMETRY = "first"
+LAST_GEOMETRY = "last"
+
+# Passed to Molecule.fragment in place of a number to split a system into its covalently bonded molecules
+AUTO_FRAGMENTS = "auto"
+
+# Whether Molecule.from_file writes a binary sidecar cache next to each text file it parses
+WRITE_BINARY_CACHE = False
+
+TOTAL_ENERGY_PATTERN = re.compile(r'Total Energy\s+=\s+([-0-9\.]+)')
+
+# The psi4 job run for each candidate charge by Molecule.guess_charge
+CHARGE_JOB_TEMPLATE = (
+    "{molecule}"
+    "set basis STO-3G\n"
+    "set reference {reference}\n"
+    "set guess sad\n"
+    "energy('scf')"
+)
+
+
+def _counting(method):
+    def counted(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+    counted.__name__ = method.__name__
+    return counted
+
+
+class _AtomList(list):
+    """
+    A list of atoms that counts the changes made to it, so that a Molecule notices when its atom list is edited
+    directly
+    """
+
+    # A class attribute, so that the counter also exists while an unpickled list is being filled
+    version = 0
+
+    append = _counting(list.append)
+    extend = _counting(list.extend)
+    insert = _counting(list.insert)
+    pop = _counting(list.pop)
+    remove = _counting(list.remove)
+    clear = _counting(list.clear)
+    sort = _counting(list.sort)
+    reverse = _counting(list.reverse)
+    __setitem__ = _counting(list.__setitem__)
+    __delitem__ = _counting(list.__delitem__)
+    __iadd__ = _counting(list.__iadd__)
+    __imul__ = _counting(list.__imul__)
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
 
 class Molecule(MoleculeFormatterMixin):
     def __init__(self, title, atom_list=None, charge=0, multiplicity=1, psi4_path=None):
 
-        if psi4_path is not None:
-            self.psi4_path = psi4_path
-        elif os.path.isfile(DEFAULT_PSI4_EXECUTABLE) and os.access(DEFAULT_PSI4_EXECUTABLE, os.X_OK):
-            self.psi4_path = DEFAULT_PSI4_EXECUTABLE
-        else:
-            self.psi4_path = None
+        self.psi4_path = find_psi4(psi4_path)
 
         self.charge = charge
         self.multiplicity = multiplicity
@@ -27,38 +108,326 @@ class Molecule(MoleculeFormatterMixin):
         if not self.title:
             self.title = "input_molecule"
 
-        if atom_list is not None:
-            self.atom_list = list(atom_list)
-        else:
-            self.atom_list = []
+        # Atoms are stored either as a list of (label, x, y, z) tuples or, in array-backed mode, as a label array
+        # and an (n, 3) coordinate array. Exactly one of the two representations is populated at any time.
+        self._labels = None
+        self._coordinates = None
+        self._n_atoms = 0
+        self._atom_list = _AtomList(atom_list) if atom_list is not None else _AtomList()
+
+        # Properties derived from the atoms, kept until the atoms change
+        self._version = 0
+        self._cache = {}
+        self._cache_version = 0
+
+        # The system this molecule was cut from, as a (ChargeEnvironment, fragment number) tuple
+        self._charge_environment = None
 
     def __iter__(self):
-        return self.atom_list.__iter__()
+        if self._atom_list is not None:
+            return self._atom_list.__iter__()
+        return zip(self.labels.tolist(), *self.coordinates.T.tolist())
 
     def __len__(self):
-        return self.atom_list.__len__()
+        if self._atom_list is not None:
+            return self._atom_list.__len__()
+        return self._n_atoms
+
+    @property
+    def atom_list(self):
+        """
+        The atoms as a list of (label, x, y, z) tuples. Array-backed molecules are converted back to tuple
+        storage on access so that changes made to the returned list are kept
+        """
+        if self._atom_list is None:
+            self.to_tuples()
+        return self._atom_list
+
+    @atom_list.setter
+    def atom_list(self, atom_list):
+        self._atoms_replaced()
+        self._atom_list = _AtomList(atom_list)
+        self._labels = None
+        self._coordinates = None
+        self._n_atoms = 0
+
+    @property
+    def version(self):
+        """
+        A counter that moves on whenever atoms are added, removed or replaced, including by editing atom_list
+        directly. Changes made in place to the coordinates array are not seen; call invalidate_cache after them.
+        """
+        if self._atom_list is not None:
+            return self._version + self._atom_list.version
+        return self._version
+
+    def _atoms_replaced(self):
+        # Keep the changes counted by the old list so that the version never goes back to an earlier value
+        if self._atom_list is not None:
+            self._version += self._atom_list.version
+        self._version += 1
+
+    def invalidate_cache(self):
+        """
+        Forgets all derived properties, for use after the coordinates array has been changed in place
+        """
+        self._version += 1
+
+    def _cached(self, name, compute):
+        version = self.version
+        if self._cache_version != version:
+            self._cache = {}
+            self._cache_version = version
+        try:
+            return self._cache[name]
+        except KeyError:
+            value = self._cache[name] = compute()
+            return value
+
+    @property
+    def is_array_backed(self):
+        return self._atom_list is None
+
+    @property
+    def labels(self):
+        """
+        The atom labels as a NumPy string array
+        """
+        if self._atom_list is not None:
+            return np.array([atom[0] for atom in self._atom_list], dtype=str)
+        return self._labels[:self._n_atoms]
+
+    @property
+    def coordinates(self):
+        """
+        The atom coordinates as an (n, 3) float64 array. For array-backed molecules this is a view on the
+        underlying storage, not a copy
+        """
+        if self._atom_list is not None:
+            return np.array([atom[1:4] for atom in self._atom_list], dtype=np.float64).reshape(-1, 3)
+        return self._coordinates[:self._n_atoms]
+
+    @property
+    def atomic_numbers(self):
+        """
+        The atomic number of each atom as a read-only integer array
+        """
+        return self._cached("atomic_numbers", lambda: _read_only(lookup_atomic_numbers(self.labels)))
+
+    @property
+    def formula(self):
+        """
+        The composition in Hill order: C and H first if there is any carbon, then the other elements alphabetically.
+        Dummy atoms are left out.
+        """
+        return self._cached("formula", self._hill_formula)
+
+    def _hill_formula(self):
+        counts = np.bincount(self.atomic_numbers, minlength=len(SYMBOLS))
+        elements = [(SYMBOLS[z], counts[z]) for z in np.flatnonzero(counts) if z > 0]
+        if counts[6] > 0:
+            elements.sort(key=lambda element: (element[0] != 'C', element[0] != 'H', element[0]))
+        else:
+            elements.sort()
+        return ''.join(symbol + (str(n) if n > 1 else '') for symbol, n in elements)
+
+    @property
+    def centroid(self):
+        """
+        The mean position of the atoms as a read-only array, or None for an empty molecule
+        """
+        return self._cached("centroid", lambda: _read_only(self.coordinates.mean(axis=0)) if len(self) else None)
+
+    @property
+    def bounding_box(self):
+        """
+        The lowest and highest coordinates along each axis as a pair of read-only arrays, or None for an empty
+        molecule
+        """
+        def compute():
+            if len(self) == 0:
+                return None
+            coordinates = self.coordinates
+            return _read_only(coordinates.min(axis=0)), _read_only(coordinates.max(axis=0))
+        return self._cached("bounding_box", compute)
+
+    def geometry_hash(self):
+        """
+        A hash of the atom labels and coordinates; see charge_cache.geometry_hash
+        """
+        return self._cached("geometry_hash", lambda: geometry_hash(self))
+
+    def fingerprint(self):
+        """
+        A rotation and translation invariant fingerprint, for finding duplicate fragments; see fingerprint.Fingerprint
+        """
+        return self._cached("fingerprint", lambda: Fingerprint(self.atomic_numbers, self.coordinates))
+
+    def to_arrays(self):
+        """
+        Switches this molecule to array-backed storage
+        :return: self
+        """
+        if self._atom_list is not None:
+            self._set_arrays(self.labels, self.coordinates)
+        return self
+
+    def to_tuples(self):
+        """
+        Switches this molecule to storage as a list of (label, x, y, z) tuples
+        :return: self
+        """
+        if self._atom_list is None:
+            self.atom_list = list(self)
+        return self
+
+    def _set_arrays(self, labels, coordinates, copy=True):
+        # Without copying, the arrays given are used as the storage itself, e.g. read-only views on a memory map.
+        # Adding atoms then moves the molecule to new storage, since the capacity is used up.
+        convert = np.array if copy else np.asarray
+        self._labels = convert(labels, dtype=str).reshape(-1)
+        self._coordinates = convert(coordinates, dtype=np.float64).reshape(-1, 3)
+        if len(self._labels) != len(self._coordinates):
+            raise ValueError("There must be exactly one label for each set of coordinates")
+        self._n_atoms = len(self._labels)
+        self._atoms_replaced()
+        self._atom_list = None
+
+    def _reserve(self, n_atoms):
+        # Grows the array storage geometrically so that repeated calls to add_atom are amortised O(1)
+        capacity = len(self._coordinates)
+        if n_atoms <= capacity:
+            return
+        capacity = max(n_atoms, 2 * capacity, 16)
+        coordinates = np.empty((capacity, 3), dtype=np.float64)
+        coordinates[:self._n_atoms] = self._coordinates[:self._n_atoms]
+        labels = np.empty(capacity, dtype=self._labels.dtype)
+        labels[:self._n_atoms] = self._labels[:self._n_atoms]
+        self._coordinates = coordinates
+        self._labels = labels
+
+    def _append_arrays(self, labels, coordinates):
+        labels = np.asarray(labels, dtype=str).reshape(-1)
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+        if len(labels) == 0:
+            return
+        start = self._n_atoms
+        self._reserve(start + len(labels))
+        if labels.dtype.itemsize > self._labels.dtype.itemsize:
+            self._labels = self._labels.astype(labels.dtype)
+        self._labels[start:start + len(labels)] = labels
+        self._coordinates[start:start + len(labels)] = coordinates
+        self._n_atoms = start + len(labels)
+        self._version += 1
 
     @staticmethod
-    def from_file(file, psi4_path=None):
+    def from_arrays(title, labels, coordinates, charge=0, multiplicity=1, psi4_path=None):
         """
-        Tries all file formats to detect the correct one
+        Creates an array-backed Molecule object
+        :param title: the molecule title
+        :param labels: a sequence of atom labels
+        :param coordinates: an (n, 3) array of coordinates
+        :param charge: the molecular charge
+        :param multiplicity: the spin multiplicity
+        :param psi4_path: the path to the psi4 executable
+        :return: a Molecule object
+        """
+        molecule = Molecule(title, charge=charge, multiplicity=multiplicity, psi4_path=psi4_path)
+        molecule._set_arrays(labels, coordinates)
+        return molecule
+
+    @staticmethod
+    def from_binary(path, psi4_path=None, frame=0):
+        """
+        Creates an array-backed Molecule object from a binary molecule file. The coordinates are read-only views on
+        a memory map of the file rather than copies.
+        :param path: path to the binary file
+        :param psi4_path: the path to the psi4 executable
+        :param frame: which geometry to read from a multi-frame file
+        :return: a Molecule object
+        """
+        return Molecule._from_frame(read_frames(path)[frame], psi4_path=psi4_path)
+
+    @staticmethod
+    def _from_frame(frame, psi4_path=None):
+        molecule = Molecule(frame.title, charge=frame.charge, multiplicity=frame.multiplicity, psi4_path=psi4_path)
+        molecule._set_arrays(frame.labels, frame.coordinates, copy=False)
+        return molecule
+
+    def _to_frame(self):
+        return Frame(self.title, self.labels, self.coordinates, self.charge, self.multiplicity)
+
+    def save_binary(self, path, source=None):
+        """
+        Writes the molecule to a binary molecule file
+        :param path: the file to write
+        :param source: path of the file the molecule was read from, so that the binary file can serve as its cache
+        """
+        write_frames(path, [self._to_frame()], source=source)
+
+    @staticmethod
+    def from_file(file, psi4_path=None, use_cache=True):
+        """
+        Detects the file format from the start of the file and reads it with the matching parser, falling back to
+        the other parser if that one fails. The file is opened once, so FIFOs and /dev/stdin can be read too.
         :param file: file as path or file-like object
         :param psi4_path: path to psi4 execitable
+        :param use_cache: for paths, read the binary sidecar cache instead of the file if the cache was made from
+        the file as it is now
         :return: a Molecule object
         """
-        try:
-            molecule = Molecule.from_xyz_file(file, psi4_path=psi4_path)
-            if len(molecule) > 0:
-                return molecule
-        except:
-            pass
+        if isinstance(file, str):
+            if file.endswith(SIDECAR_SUFFIX):
+                return Molecule.from_binary(file, psi4_path=psi4_path)
+            sidecar = file + SIDECAR_SUFFIX
+            if use_cache and os.path.exists(sidecar):
+                try:
+                    return Molecule._from_frame(read_frames(sidecar, source=file)[0], psi4_path=psi4_path)
+                except (IOError, ValueError, IndexError):
+                    pass
+            if not os.path.isfile(file):
+                # FIFOs and devices such as /dev/stdin can only be read once, so they are read as a stream
+                with open(file, 'r') as f:
+                    return Molecule._from_sniffed_file(f, psi4_path)
+            with open(file, 'r') as f:
+                head = f.read(SNIFF_SIZE)
+            # Regular files are parsed by path, which lets each parser take its fast path
+            molecule = Molecule._parse_sniffed(head, lambda: file, psi4_path)
+            if WRITE_BINARY_CACHE:
+                try:
+                    molecule.save_binary(file + SIDECAR_SUFFIX, source=file)
+                except (IOError, ValueError):
+                    # Labels that are not element symbols cannot be cached, and neither can read-only directories
+                    pass
+            return molecule
+        return Molecule._from_sniffed_file(file, psi4_path)
 
-        try:
-            molecule = Molecule.from_psi4_output(file, psi4_path=psi4_path)
+    @staticmethod
+    def _from_sniffed_file(fp, psi4_path=None):
+        head, reopen = rereadable(fp)
+        return Molecule._parse_sniffed(head, reopen, psi4_path)
+
+    @staticmethod
+    def _parse_sniffed(head, reopen, psi4_path=None):
+        """
+        Parses a file with the parser for the format sniffed from its start, and with the other parser if that one
+        fails or finds no atoms
+        :param head: the start of the file
+        :param reopen: a function giving the file, as a path or lines from its start, each time it is called
+        :return: a Molecule object
+        """
+        file_format = sniff_format(head)
+        other_format = XYZ_FORMAT if file_format == PSI4_OUTPUT_FORMAT else PSI4_OUTPUT_FORMAT
+        for parse_format in (file_format, other_format):
+            try:
+                if parse_format == PSI4_OUTPUT_FORMAT:
+                    molecule = Molecule.from_psi4_output(reopen(), psi4_path=psi4_path)
+                else:
+                    molecule = Molecule.from_xyz_file(reopen(), psi4_path=psi4_path)
+            except (ValueError, IndexError):
+                continue
             if len(molecule) > 0:
                 return molecule
-        except:
-            pass
 
         raise ValueError("Unsupported file type")
 
@@ -88,45 +457,46 @@ class Molecule(MoleculeFormatterMixin):
             return Molecule(title, atom_list, psi4_path=psi4_path)
 
         if isinstance(xyz_file, str):
+            # Try the bulk parser first; it produces an array-backed molecule without going through tuples
+            try:
+                title, labels, coordinates = read_xyz_mmap(xyz_file)
+                return Molecule.from_arrays(title, labels, coordinates, psi4_path=psi4_path)
+            except ValueError:
+                pass
             with open(xyz_file, 'r') as f:
                 return read_xyz_file(f)
         else:
             return read_xyz_file(xyz_file)
 
     @staticmethod
-    def from_psi4_output(output_file, psi4_path=None):
+    def from_psi4_output(output_file, psi4_path=None, geometry=FIRST_GEOMETRY):
         """
-        Creates a molecule object from the coordinates in the output file of a Psi4 calculation
+        Creates a molecule object from the coordinates in the output file of a Psi4 calculation. Coordinates are
+        converted to Angstrom when the output gives them in Bohr, and the charge and multiplicity are those of the
+        geometry header.
         :param output_file: the output file as a file-like object or path
         :param psi4_path: the path to the psi4 executable
+        :param geometry: FIRST_GEOMETRY for the input geometry, or LAST_GEOMETRY for the final geometry of an
+        optimisation; for paths the last geometry is found by reading only the end of the file
         :return: a Molecule object
         """
-
-        def read_psi4_output(fp):
-            start_line = "Center              X                  Y                   Z               Mass"
-            title = ''
-            atom_list = []
-            line_number = 0
-            for line in fp:
-                # Keep ignore all lines until the start_line
-                if line.strip() != start_line and line_number == 0:
-                    continue
-                else:
-                    line_number += 1
-
-                if line_number > 2 and len(line.strip()) > 0:
-                    xyz_parts = line.split()
-                    atom_list.append((xyz_parts[0], float(xyz_parts[1]), float(xyz_parts[2]), float(xyz_parts[3])))
-                elif line_number > 2:
-                    break
-            return Molecule(title, atom_list, psi4_path=psi4_path)
-
-        if isinstance(output_file, str):
-            with open(output_file, 'r') as f:
-                return read_psi4_output(f)
+        if geometry == FIRST_GEOMETRY:
+            psi4_geometry = parse_psi4_output(output_file, first_geometry_only=True).last_geometry
+        elif geometry == LAST_GEOMETRY:
+            if isinstance(output_file, str):
+                psi4_geometry = read_last_psi4_geometry(output_file)
+            else:
+                psi4_geometry = parse_psi4_output(output_file).last_geometry
         else:
-            return read_psi4_output(output_file)
+            raise ValueError("Unknown geometry selection: %s" % geometry)
 
+        if psi4_geometry is None:
+            return Molecule('', psi4_path=psi4_path)
+        molecule = Molecule('', psi4_geometry.atom_list, psi4_path=psi4_path)
+        if psi4_geometry.charge is not None:
+            molecule.charge = psi4_geometry.charge
+            molecule.multiplicity = psi4_geometry.multiplicity
+        return molecule
 
     def add_atom(self, label, x, y, z):
         """
@@ -136,60 +506,74 @@ class Molecule(MoleculeFormatterMixin):
         :param y: y coordinate
         :param z: z coordinate
         """
-        self.atom_list.append((label, float(x), float(y), float(z)))
+        if self._atom_list is not None:
+            self._atom_list.append((label, float(x), float(y), float(z)))
+        else:
+            self._append_arrays([label], [(float(x), float(y), float(z))])
 
     def merge(self, molecule):
         """
         Merges all atoms from another molecule into this one
         :param molecule: a second molecule
         """
+        if self._atom_list is None and isinstance(molecule, Molecule):
+            self._append_arrays(molecule.labels, molecule.coordinates)
+            return
         for atom in molecule:
             self.add_atom(*atom)
 
+    def spatial_index(self):
+        """
+        Returns a spatial index over the atom coordinates. The index is built on first use and reused until the
+        molecule is changed
+        :return: a SpatialIndex object
+        """
+        return self._cached("spatial_index", lambda: SpatialIndex(self.coordinates))
+
     def distance_from(self, molecule):
         """
         Calculates the distance between the two nearest atoms of this and another molecule
         :param molecule: a second molecule
         """
-        distance = None
-        for a1 in self:
-            for a2 in molecule:
-                d = math.sqrt(math.pow(a1[1] - a2[1], 2) + math.pow(a1[2] - a2[2], 2) + math.pow(a1[3] - a2[3], 2))
-                if distance is None:
-                    distance = d
-                elif d < distance:
-                    distance = d
-        return distance
+        if len(self) == 0 or len(molecule) == 0:
+            return None
+        if len(self) * len(molecule) <= BRUTE_FORCE_PAIR_LIMIT:
+            return brute_force_min_distance(self.coordinates, molecule.coordinates)
+
+        # Search the index of the larger molecule with the atoms of the smaller one
+        if len(self) >= len(molecule):
+            return self.spatial_index().min_distance(molecule.coordinates)
+        else:
+            return molecule.spatial_index().min_distance(self.coordinates)
 
     def fragment(self, n_frags):
         """
         Fragments a molecule based on nearest neighbor classification
-        :param n_frags: number of fragments
-        """
-
-        # start off with each atom as a separate molecule
-        fragments = [Molecule(self.title, [atom], psi4_path=self.psi4_path) for atom in self]
-
-        while len(fragments) > n_frags:
-            distance = None
-            i = None
-            j = None
-            for _i in range(len(fragments)):
-                for _j in range(_i + 1, len(fragments)):
-                    d = fragments[_i].distance_from(fragments[_j])
-                    if distance is None:
-                        distance = d
-                        i = _i
-                        j = _j
-                    elif d < distance:
-                        distance = d
-                        i = _i
-                        j = _j
-            fragments[i].merge(fragments[j])
-            del fragments[j]
-
-        for i in range(n_frags):
-            fragments[i].title += str(n_frags)
+        :param n_frags: number of fragments, or AUTO_FRAGMENTS to split the molecule into its covalently bonded parts
+        """
+
+        if n_frags == AUTO_FRAGMENTS:
+            groups = covalent_fragments(self.atomic_numbers, self.coordinates)
+            n_frags = len(groups)
+        else:
+            groups = single_linkage_fragments(self.coordinates, n_frags)
+
+        fragments = []
+        if self.is_array_backed:
+            labels = self.labels
+            coordinates = self.coordinates
+            for group in groups:
+                fragments.append(Molecule.from_arrays(self.title, labels[group], coordinates[group],
+                                                      psi4_path=self.psi4_path))
+        else:
+            for group in groups:
+                fragments.append(Molecule(self.title, [self._atom_list[i] for i in group], psi4_path=self.psi4_path))
+
+        # Only kept for charge estimates, which work out the rest when first asked
+        environment = ChargeEnvironment(self.labels, self.coordinates, groups, charge=self.charge)
+        for k, fragment in enumerate(fragments):
+            fragment.title += str(n_frags)
+            fragment._charge_environment = (environment, k)
 
         return fragments
 
@@ -199,64 +583,219 @@ class Molecule(MoleculeFormatterMixin):
         :return: self
         """
         for i in range(len(self), 3):
-            self.atom_list.append(('X', random.uniform(0.5, 1.5), random.uniform(0.5, 1.5), random.uniform(0.5, 1.5)))
+            self.add_atom('X', random.uniform(0.5, 1.5), random.uniform(0.5, 1.5), random.uniform(0.5, 1.5))
 
         return self
 
     def get_z_sum(self):
-        return sum([lookup_element_by_symbol(atom[0])[0] for atom in self])
+        return self._cached("z_sum", lambda: int(self.atomic_numbers.sum()))
 
     def electron_count(self):
         return self.get_z_sum() + self.charge
 
     def get_possible_charges(self, lower_range=-1, upper_range=1, multiplicity=1):
-        if multiplicity % 2 > 0:
-            return [q for q in range(lower_range, upper_range + 1) if (self.get_z_sum() + q) % 2 == 0]
-        else:
-            return [q for q in range(lower_range, upper_range + 1) if (self.get_z_sum() + q) % 2 > 0]
+        return possible_charges(self.get_z_sum(), lower_range=lower_range, upper_range=upper_range,
+                                multiplicity=multiplicity)
 
-    def guess_charge(self, lower_range=-1, upper_range=1, multiplicity=1):
-        if self.psi4_path is None:
+    def guess_charge(self, lower_range=-1, upper_range=1, multiplicity=1, max_workers=None, n_threads=None):
+        """
+        Guesses the charge by running a psi4 SCF calculation for each possible charge and picking the one with the
+        lowest energy. The calculations run concurrently; if energies are equal the lowest candidate charge wins.
+        Fragments first get an electronegativity equalisation estimate with the fragments around them, which rules
+        out candidates by CHARGE_PRESCREEN_WINDOW and skips psi4 when only one is left.
+        When PSI4_POOL is set the calculations go to its workers instead of new psi4 processes.
+        :param lower_range: lowest charge to consider
+        :param upper_range: highest charge to consider
+        :param multiplicity: the spin multiplicity
+        :param max_workers: the most psi4 processes to run at once, by default PSI4_MAX_WORKERS
+        :param n_threads: threads for each psi4 process, by default PSI4_THREADS
+        :return: the charge, or None if no calculation produced an energy
+        """
+        charge, possible_charges, jobs, cache_key = self._prepare_charge_guess(lower_range, upper_range, multiplicity)
+        if jobs is None:
+            return charge
+
+        if n_threads is None:
+            n_threads = PSI4_THREADS
+        if max_workers is None:
+            max_workers = PSI4_MAX_WORKERS
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 1) // (n_threads or 1))
+        max_workers = min(max_workers, len(possible_charges))
+
+        if PSI4_POOL is not None:
+            run = PSI4_POOL.energy
+        else:
+            run = lambda job: run_psi4_energy(self.psi4_path, job, n_threads=n_threads)
+        with instrumentation.timer("guess_charge"), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Each run gets a copy of this thread's context, so that its measurements go where this call's do
+            futures = [executor.submit(contextvars.copy_context().run, run, job) for job in jobs]
+            energies = [future.result() for future in futures]
+        return self._finish_charge_guess(possible_charges, energies, cache_key)
+
+    async def guess_charge_async(self, lower_range=-1, upper_range=1, multiplicity=1, limit=None, n_threads=None):
+        """
+        Does the same as guess_charge, running psi4 as asyncio subprocesses so that many molecules can be
+        handled by one thread
+        :param limit: an asyncio.Semaphore bounding the number of psi4 processes, shared between molecules
+        :param n_threads: threads for each psi4 process, by default PSI4_THREADS
+        :return: the charge, or None if no calculation produced an energy
+        """
+        # The cache lookup and the charge estimate block, so they run in a thread to keep other molecules going
+        charge, possible_charges, jobs, cache_key = await asyncio.to_thread(
+            self._prepare_charge_guess, lower_range, upper_range, multiplicity)
+        if jobs is None:
+            return charge
+
+        if n_threads is None:
+            n_threads = PSI4_THREADS
+
+        async def run_one(job):
+            if PSI4_POOL is not None:
+                return await PSI4_POOL.energy_async(job)
+            return await run_psi4_energy_async(self.psi4_path, job, n_threads=n_threads)
+
+        async def run(job):
+            if limit is None:
+                return await run_one(job)
+            async with limit:
+                return await run_one(job)
+
+        energies = await asyncio.gather(*[run(job) for job in jobs])
+        return await asyncio.to_thread(self._finish_charge_guess, possible_charges, energies, cache_key)
+
+    def _prepare_charge_guess(self, lower_range, upper_range, multiplicity):
+        """
+        Works out the psi4 jobs needed to guess the charge
+        :return: a tuple of (charge, possible charges, jobs, cache key); jobs is None if the charge is already known
+        """
+        if self.psi4_path is None and PSI4_POOL is None:
             raise ValueError("Psi4 path must be provided for this method to work")
 
         possible_charges = self.get_possible_charges(lower_range=lower_range, upper_range=upper_range, multiplicity=multiplicity)
         if len(possible_charges) == 1:
-            return possible_charges[0]
-
-        job_template = (
-            "{molecule}"
-            "set basis STO-3G\n"
-            "set reference {reference}\n"
-            "set guess sad\n"
-            "energy('scf')"
-        )
-
-        p = re.compile(r'Total Energy\s+=\s+([-0-9\.]+)')
+            return possible_charges[0], possible_charges, None, None
+
+        cache_key = None
+        if CHARGE_CACHE is not None:
+            cache_key = ChargeCache.key(self, lower_range, upper_range, multiplicity, CHARGE_JOB_TEMPLATE,
+                                        CHARGE_PRESCREEN_WINDOW)
+            charge = CHARGE_CACHE.get(cache_key)
+            if charge is not None:
+                instrumentation.count("charge_cache_hits")
+                self.multiplicity = multiplicity
+                self.charge = charge
+                return charge, possible_charges, None, cache_key
 
         self.multiplicity = multiplicity
+        if CHARGE_PRESCREEN_WINDOW is not None:
+            screened = screen_charges(possible_charges, self.estimate_charge_energies(possible_charges),
+                                      CHARGE_PRESCREEN_WINDOW)
+            if len(screened) == 1:
+                instrumentation.count("charge_prescreen_hits")
+                self.charge = screened[0]
+                return screened[0], screened, None, None
+            if len(screened) < len(possible_charges):
+                instrumentation.count("charge_prescreen_narrowed")
+                possible_charges = screened
+        jobs = [CHARGE_JOB_TEMPLATE.format(molecule=self._format_psi4_molecule(q, multiplicity),
+                                           reference='rhf' if multiplicity == 1 else 'uhf') for q in possible_charges]
+        return None, possible_charges, jobs, cache_key
+
+    def estimate_charge_energies(self, candidates):
+        """
+        Estimates the energy of each candidate charge of a fragment without running psi4, by electronegativity
+        equalisation over the fragment and the fragments around it
+        :param candidates: a list of charges
+        :return: an array of energies in eV relative to the lowest, or None if this is not a fragment, its atoms
+        have changed since it was made, or an atom is not an element with parameters
+        """
+        if self._charge_environment is None:
+            return None
+        environment, fragment = self._charge_environment
+        if environment.atomic_numbers is None:
+            return None
+        real = self.atomic_numbers > 0
+        if not np.array_equal(self.coordinates[real], environment.coordinates[environment.groups[fragment]]):
+            return None
+        return environment.candidate_energies(fragment, candidates)
+
+    def _finish_charge_guess(self, possible_charges, energies, cache_key):
+        # Scan in candidate order with a strict comparison so that ties go to the first candidate
         lowest_energy_and_charge = None
-        for q in possible_charges:
-            proc = subprocess.Popen([self.psi4_path, '-i', 'stdin', '-o', 'stdout'], stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE)
-            self.charge = q
-            proc.stdin.write(
-                str.encode(
-                    job_template.format(
-                        molecule=self.format_psi4(),
-                        reference='rhf' if multiplicity == 1 else 'uhf'
-                    )
-                )
-            )
-            proc.stdin.close()
-            result = proc.stdout.read().decode('utf-8')
-            energy_search = p.search(result)
-            if energy_search is not None:
-                energy = float(energy_search.group(1))
+        for q, energy in zip(possible_charges, energies):
+            if energy is not None:
                 if lowest_energy_and_charge is None or energy < lowest_energy_and_charge[1]:
                     lowest_energy_and_charge = (q, energy)
-            proc.wait()
         if lowest_energy_and_charge:
             self.charge = lowest_energy_and_charge[0]
+            if cache_key is not None:
+                CHARGE_CACHE.put(cache_key, self.charge)
             return lowest_energy_and_charge[0]
         else:
             return None
+
+
+def find_psi4(psi4_path=None):
+    """
+    :param psi4_path: the path to the psi4 executable, if known
+    :return: psi4_path, or DEFAULT_PSI4_EXECUTABLE if it was not given and is executable, otherwise None
+    """
+    if psi4_path is not None:
+        return psi4_path
+    if os.path.isfile(DEFAULT_PSI4_EXECUTABLE) and os.access(DEFAULT_PSI4_EXECUTABLE, os.X_OK):
+        return DEFAULT_PSI4_EXECUTABLE
+    return None
+
+
+def possible_charges(z_sum, lower_range=-1, upper_range=1, multiplicity=1):
+    """
+    Lists the charges in a range that are consistent with a spin multiplicity
+    :param z_sum: the sum of the atomic numbers
+    :return: a list of charges
+    """
+    if multiplicity % 2 > 0:
+        return [q for q in range(lower_range, upper_range + 1) if (z_sum + q) % 2 == 0]
+    else:
+        return [q for q in range(lower_range, upper_range + 1) if (z_sum + q) % 2 > 0]
+
+
+def run_psi4_energy(psi4_path, job, n_threads=None):
+    """
+    Runs a psi4 job read from stdin and returns the total energy it prints
+    :param psi4_path: the path to the psi4 executable
+    :param job: the psi4 input
+    :param n_threads: the number of threads psi4 should use, or None for the psi4 default
+    :return: the energy, or None if psi4 did not print one
+    """
+    instrumentation.count("psi4_processes")
+    with instrumentation.timer("psi4_wait"):
+        proc = subprocess.Popen(_psi4_command(psi4_path, n_threads), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        result = proc.communicate(str.encode(job))[0].decode('utf-8')
+    return _parse_total_energy(result)
+
+
+async def run_psi4_energy_async(psi4_path, job, n_threads=None):
+    """
+    Does the same as run_psi4_energy as an asyncio subprocess
+    """
+    instrumentation.count("psi4_processes")
+    with instrumentation.timer("psi4_wait"):
+        proc = await asyncio.create_subprocess_exec(*_psi4_command(psi4_path, n_threads), stdin=subprocess.PIPE,
+                                                    stdout=subprocess.PIPE)
+        result = (await proc.communicate(str.encode(job)))[0].decode('utf-8')
+    return _parse_total_energy(result)
+
+
+def _psi4_command(psi4_path, n_threads):
+    command = [psi4_path, '-i', 'stdin', '-o', 'stdout']
+    if n_threads is not None:
+        command += ['-n', str(n_threads)]
+    return command
+
+
+def _parse_total_energy(result):
+    energy_search = TOTAL_ENERGY_PATTERN.search(result)
+    if energy_search is not None:
+        return float(energy_search.group(1))
+    return None
@@ -0,0 +1,210 @@
+from io import StringIO
+
+import numpy as np
+
+from .molecule import Molecule, find_psi4, possible_charges
+from .molecule_formatters import PSI4_COORDINATE_FORMAT, GAMESS_COORDINATE_FORMAT, write_coordinate_lines, \
+    write_gamess_header
+from .periodic_table import lookup_atomic_numbers
+from .spatial import squared_distances
+from .trajectory import iter_xyz_frames
+
+# Upper bound on the number of atom pair distances held in memory at once by MoleculeBatch.min_distances
+DISTANCE_CHUNK_SIZE = 1 << 20
+
+
+class MoleculeBatch(object):
+    """
+    Many geometries of the same molecule, such as conformers or trajectory frames, stored as one label array and
+    one (n_frames, n_atoms, 3) coordinate array. Everything that only depends on the atoms is worked out once for
+    the whole batch.
+    """
+
+    def __init__(self, title, labels, coordinates, charge=0, multiplicity=1, psi4_path=None, titles=None):
+        """
+        :param title: the title shared by all frames
+        :param labels: a sequence of n_atoms atom labels
+        :param coordinates: an (n_frames, n_atoms, 3) array of coordinates
+        :param charge: the molecular charge
+        :param multiplicity: the spin multiplicity
+        :param psi4_path: the path to the psi4 executable
+        :param titles: a title for each frame, overriding the shared title
+        """
+        self.labels = np.array(labels, dtype=str).reshape(-1)
+        self.coordinates = np.asarray(coordinates, dtype=np.float64)
+        if self.coordinates.ndim != 3 or self.coordinates.shape[1:] != (len(self.labels), 3):
+            raise ValueError("Expected coordinates of shape (n_frames, %i, 3), got %s" %
+                             (len(self.labels), self.coordinates.shape))
+        if titles is not None and len(titles) != len(self.coordinates):
+            raise ValueError("There must be exactly one title for each frame")
+        self.title = title.strip() or "input_molecule"
+        self.titles = titles
+        self.charge = charge
+        self.multiplicity = multiplicity
+        self.psi4_path = find_psi4(psi4_path)
+        self._atomic_numbers = None
+        # Plain lists for formatting, made once for all frames
+        self._label_list = self.labels.tolist()
+        self._atomic_number_list = None
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def __iter__(self):
+        for frame in range(len(self)):
+            yield self.molecule(frame)
+
+    def __getitem__(self, frame):
+        return self.molecule(frame)
+
+    @property
+    def n_atoms(self):
+        return len(self.labels)
+
+    @property
+    def atomic_numbers(self):
+        if self._atomic_numbers is None:
+            self._atomic_numbers = lookup_atomic_numbers(self.labels)
+        return self._atomic_numbers
+
+    @staticmethod
+    def from_molecules(molecules, title=None):
+        """
+        Stacks molecules that have the same atoms in the same order into a batch
+        :param molecules: a sequence of Molecule objects
+        :param title: the shared title, by default that of the first molecule
+        :return: a MoleculeBatch object
+        """
+        molecules = list(molecules)
+        if not molecules:
+            raise ValueError("Cannot make a batch of no molecules")
+        first = molecules[0]
+        labels = first.labels
+        coordinates = np.empty((len(molecules), len(labels), 3), dtype=np.float64)
+        for frame, molecule in enumerate(molecules):
+            if not np.array_equal(molecule.labels, labels):
+                raise ValueError("Molecule %i of the batch has different atoms to the first" % frame)
+            coordinates[frame] = molecule.coordinates
+        return MoleculeBatch(first.title if title is None else title, labels, coordinates, charge=first.charge,
+                             multiplicity=first.multiplicity, psi4_path=first.psi4_path,
+                             titles=[molecule.title for molecule in molecules])
+
+    @staticmethod
+    def from_xyz_frames(xyz_file, psi4_path=None):
+        """
+        Reads every frame of a multi-frame XYZ file into a batch
+        :param xyz_file: the xyz file as a file-like object or path
+        :param psi4_path: the path to the psi4 executable
+        :return: a MoleculeBatch object
+        """
+        return MoleculeBatch.from_molecules(iter_xyz_frames(xyz_file, psi4_path=psi4_path))
+
+    def frame_title(self, frame):
+        return self.titles[frame] if self.titles is not None else self.title
+
+    def molecule(self, frame):
+        """
+        Returns one frame as an array-backed Molecule whose storage is a view on the batch, so that changes to its
+        coordinates are changes to the batch. Adding atoms moves the molecule to storage of its own. After changing
+        the batch coordinates in place, call invalidate_cache on views made earlier.
+        :param frame: the frame number, counting from zero
+        :return: a Molecule object
+        """
+        # The batch has already looked for psi4; passing a placeholder path stops the molecule looking again
+        molecule = Molecule(self.frame_title(frame), charge=self.charge, multiplicity=self.multiplicity,
+                            psi4_path=self.psi4_path or '')
+        molecule.psi4_path = self.psi4_path
+        molecule._set_arrays(self.labels, self.coordinates[frame], copy=False)
+        return molecule
+
+    def get_z_sum(self):
+        return int(self.atomic_numbers.sum())
+
+    def get_possible_charges(self, lower_range=-1, upper_range=1, multiplicity=1):
+        return possible_charges(self.get_z_sum(), lower_range=lower_range, upper_range=upper_range,
+                                multiplicity=multiplicity)
+
+    def centroids(self):
+        """
+        :return: an (n_frames, 3) array of the mean position of the atoms in each frame
+        """
+        return self.coordinates.mean(axis=1)
+
+    def min_distances(self, other=None):
+        """
+        Finds the distance between the two nearest atoms in every frame at once
+        :param other: None to compare the atoms of each frame with each other; a MoleculeBatch with as many frames
+        to compare each frame with the matching frame of other; or a Molecule to compare every frame with it
+        :return: an array with one distance per frame, NaN where there is no pair of atoms
+        """
+        if other is None:
+            atoms_a, atoms_b = np.triu_indices(self.n_atoms, 1)
+            other_coordinates = self.coordinates
+        else:
+            if isinstance(other, MoleculeBatch):
+                if len(other) != len(self):
+                    raise ValueError("Cannot compare batches of %i and %i frames" % (len(self), len(other)))
+                other_coordinates = other.coordinates
+            else:
+                other_coordinates = other.coordinates[np.newaxis]
+            n_other = other_coordinates.shape[1]
+            atoms_a = np.repeat(np.arange(self.n_atoms), n_other)
+            atoms_b = np.tile(np.arange(n_other), self.n_atoms)
+
+        n_frames = len(self)
+        best = np.full(n_frames, np.inf)
+        if len(atoms_a) == 0 or n_frames == 0:
+            return np.full(n_frames, np.nan)
+        frame_step = max(1, min(n_frames, DISTANCE_CHUNK_SIZE // len(atoms_a)))
+        pair_step = max(1, DISTANCE_CHUNK_SIZE // frame_step)
+        for pair_start in range(0, len(atoms_a), pair_step):
+            pair_a = atoms_a[pair_start:pair_start + pair_step]
+            pair_b = atoms_b[pair_start:pair_start + pair_step]
+            for frame_start in range(0, n_frames, frame_step):
+                frames = slice(frame_start, frame_start + frame_step)
+                b = other_coordinates if len(other_coordinates) == 1 else other_coordinates[frames]
+                d2 = squared_distances(self.coordinates[frames][:, pair_a], b[:, pair_b])
+                best[frames] = np.minimum(best[frames], d2.min(axis=1))
+        return np.sqrt(best)
+
+    def _coordinate_columns(self, frame, with_atomic_numbers=False):
+        columns = [self._label_list] + self.coordinates[frame].T.tolist()
+        if with_atomic_numbers:
+            if self._atomic_number_list is None:
+                self._atomic_number_list = self.atomic_numbers.tolist()
+            columns.insert(1, self._atomic_number_list)
+        return columns
+
+    def write_psi4(self, fp, frame):
+        """
+        Writes one frame in a format suitable for psi4, exactly as Molecule.write_psi4 would
+        """
+        fp.write("molecule %s {\n%s %s\n" % (self.frame_title(frame), self.charge, self.multiplicity))
+        write_coordinate_lines(fp, PSI4_COORDINATE_FORMAT, self._coordinate_columns(frame))
+        fp.write("}\n")
+
+    def write_gamess(self, fp, frame):
+        """
+        Writes one frame in a format suitable for GAMESS, exactly as Molecule.write_gamess would
+        """
+        write_gamess_header(fp, self.frame_title(frame), self.charge, self.multiplicity)
+        write_coordinate_lines(fp, GAMESS_COORDINATE_FORMAT, self._coordinate_columns(frame, True))
+        fp.write(" $END\n")
+
+    def iter_psi4(self):
+        """
+        :return: a generator of the psi4 molecule block of each frame
+        """
+        return self._iter_formatted(self.write_psi4)
+
+    def iter_gamess(self):
+        """
+        :return: a generator of the GAMESS $DATA deck of each frame
+        """
+        return self._iter_formatted(self.write_gamess)
+
+    def _iter_formatted(self, write):
+        for frame in range(len(self)):
+            fp = StringIO()
+            write(fp, frame)
+            yield fp.getvalue()
@@ -1,78 +1,129 @@
-from .periodic_table import lookup_element_by_symbol
+from io import StringIO
+
+# Number of atoms rendered by a single string formatting operation when writing coordinate blocks
+COORDINATE_CHUNK_SIZE = 4096
+
+PSI4_COORDINATE_FORMAT = "  %s %.10f %.10f %.10f\n"
+GAMESS_COORDINATE_FORMAT = "%s   %.1f   %.10f %.10f %.10f\n"
+
+
+def write_coordinate_lines(fp, line_format, columns):
+    """
+    Writes one formatted line per atom, rendering the lines in chunks rather than one at a time
+    :param fp: a file-like object open for writing text
+    :param line_format: the %-format of one line
+    :param columns: one list per value in the line, each with one entry per atom
+    """
+    n_columns = len(columns)
+    for start in range(0, len(columns[0]), COORDINATE_CHUNK_SIZE):
+        chunk = [column[start:start + COORDINATE_CHUNK_SIZE] for column in columns]
+        values = [None] * (n_columns * len(chunk[0]))
+        for i, column in enumerate(chunk):
+            values[i::n_columns] = column
+        fp.write((line_format * len(chunk[0])) % tuple(values))
+
+
+def write_gamess_header(fp, title, charge, multiplicity):
+    scf_type = "RHF"
+    if multiplicity != 1:
+        scf_type = "UHF"
+
+    fp.write(" $CONTRL ICHARG=%s MULT=%s SCFTYP=%s $END\n"
+             " $CONTRL ISPHER=1 $END\n"
+             " $SCF DIRSCF=.TRUE. DIIS=.TRUE. $END\n"
+             " $DATA\n"
+             "%s\n"
+             "C1\n" % (charge, multiplicity, scf_type, title))
 
 
 class MoleculeFormatterMixin(object):
+    def _coordinate_columns(self, with_atomic_numbers=False):
+        """
+        Returns the atom data as plain Python lists, one per column, for bulk rendering
+        """
+        if self.is_array_backed:
+            columns = [self.labels.tolist()] + self.coordinates.T.tolist()
+        else:
+            columns = [list(column) for column in zip(*[atom[:4] for atom in self])] or [[], [], [], []]
+        if with_atomic_numbers:
+            columns.insert(1, self.atomic_numbers.tolist())
+        return columns
+
+    def _write_coordinates(self, fp, line_format, with_atomic_numbers=False):
+        """
+        Writes one formatted line per atom, rendering the lines in chunks rather than one at a time
+        """
+        write_coordinate_lines(fp, line_format, self._coordinate_columns(with_atomic_numbers=with_atomic_numbers))
+
     def format_psi4(self, guess_charge=False):
         """
         Formats a molecule in a format suitable for psi4
         """
+        fp = StringIO()
+        self.write_psi4(fp, guess_charge=guess_charge)
+        return fp.getvalue()
+
+    def write_psi4(self, fp, guess_charge=False):
+        """
+        Writes a molecule in a format suitable for psi4 to a file-like object
+        """
 
         if guess_charge:
             self.guess_charge()
 
-        template = ("molecule {title} {{\n"
-                    "{charge} {multiplicity}\n"
-                    "{coordinates}"
-                    "}}\n")
-        coordinate_template = "  {label} {x:.10f} {y:.10f} {z:.10f}\n"
+        self._write_psi4_molecule(fp, self.charge, self.multiplicity)
 
-        coordinate_block = ""
-        for atom in self:
-            coordinate_block += coordinate_template.format(label=atom[0], x=atom[1], y=atom[2], z=atom[3])
+    def _format_psi4_molecule(self, charge, multiplicity):
+        fp = StringIO()
+        self._write_psi4_molecule(fp, charge, multiplicity)
+        return fp.getvalue()
 
-        return template.format(title=self.title, charge=self.charge, multiplicity=self.multiplicity,
-                               coordinates=coordinate_block)
+    def _write_psi4_molecule(self, fp, charge, multiplicity):
+        fp.write("molecule %s {\n%s %s\n" % (self.title, charge, multiplicity))
+        self._write_coordinates(fp, PSI4_COORDINATE_FORMAT)
+        fp.write("}\n")
 
     @staticmethod
     def format_psi4_group(molecule_list, guess_charge=False):
+        fp = StringIO()
+        MoleculeFormatterMixin.write_psi4_group(molecule_list, fp, guess_charge=guess_charge)
+        return fp.getvalue()
+
+    @staticmethod
+    def write_psi4_group(molecule_list, fp, guess_charge=False):
+        """
+        Writes a group of molecules as the fragments of a single psi4 molecule to a file-like object
+        """
 
         for molecule in molecule_list:
             if guess_charge:
                 molecule.guess_charge()
 
-        coordinate_template = "  {label} {x:.10f} {y:.10f} {z:.10f}\n"
-        molecule_inner_template = (
-            "{charge} {multiplicity}\n"
-            "{coordinates}"
-        )
         divider = '--\n'
-        molecule_outer_template = ("molecule {title} {{\n"
-                          "{molecule_inner}"
-                          "}}\n")
-
-        molecule_inners = divider.join([molecule_inner_template.format(
-            charge=m.charge,
-            multiplicity=m.multiplicity,
-            coordinates=''.join([coordinate_template.format(label=atom[0], x=atom[1], y=atom[2], z=atom[3]) for atom in m])
-        ) for m in molecule_list])
-        return molecule_outer_template.format(title=molecule_list[0].title, molecule_inner=molecule_inners)
+        fp.write("molecule %s {\n" % molecule_list[0].title)
+        for i, m in enumerate(molecule_list):
+            if i > 0:
+                fp.write(divider)
+            fp.write("%s %s\n" % (m.charge, m.multiplicity))
+            m._write_coordinates(fp, PSI4_COORDINATE_FORMAT)
+        fp.write("}\n")
 
     def format_gamess(self, guess_charge=False):
         """
         Formats a molecule in a format sutiable for GAMESS
         """
+        fp = StringIO()
+        self.write_gamess(fp, guess_charge=guess_charge)
+        return fp.getvalue()
+
+    def write_gamess(self, fp, guess_charge=False):
+        """
+        Writes a molecule in a format suitable for GAMESS to a file-like object
+        """
 
         if guess_charge:
             self.guess_charge()
 
-        scf_type = "RHF"
-        if self.multiplicity != 1:
-            scf_type = "UHF"
-
-        template = (" $CONTRL ICHARG={charge} MULT={multiplicity} SCFTYP={scf_type} $END\n"
-                    " $CONTRL ISPHER=1 $END\n"
-                    " $SCF DIRSCF=.TRUE. DIIS=.TRUE. $END\n"
-                    " $DATA\n"
-                    "{title}\n"
-                    "C1\n"
-                    "{coordinates}"
-                    " $END\n")
-        coordinate_template = "{label}   {z_number:.1f}   {x:.10f} {y:.10f} {z:.10f}\n"
-
-        coordinate_block = ""
-        for atom in self:
-            coordinate_block += coordinate_template.format(label=atom[0], z_number=lookup_element_by_symbol(atom[0])[0],
-                                                           x=atom[1], y=atom[2], z=atom[3])
-
-        return template.format(title=self.title, charge=self.charge, multiplicity=self.multiplicity, scf_type=scf_type,
-                               coordinates=coordinate_block)
+        write_gamess_header(fp, self.title, self.charge, self.multiplicity)
+        self._write_coordinates(fp, GAMESS_COORDINATE_FORMAT, with_atomic_numbers=True)
+        fp.write(" $END\n")
@@ -1,3 +1,5 @@
+import numpy as np
+
 ELEMENTS = [
     (0, 'X', 'Dummy'),
     (1, 'H', 'Hydrogen'),
@@ -111,5 +113,73 @@ ELEMENTS = [
     (109, 'Mt', 'Meitnerium')]
 
 
+# Indexes built once at import time. ELEMENTS is ordered by atomic number, so the dense arrays below can be indexed
+# directly by Z.
+ELEMENTS_BY_SYMBOL = {e[1].lower(): e for e in ELEMENTS}
+ELEMENTS_BY_Z = {e[0]: e for e in ELEMENTS}
+ATOMIC_NUMBERS = np.array([e[0] for e in ELEMENTS], dtype=np.int16)
+SYMBOLS = np.array([e[1] for e in ELEMENTS])
+NAMES = np.array([e[2] for e in ELEMENTS])
+
+# Single-bond covalent radii in Angstrom, indexed by Z, from Cordero et al., Dalton Trans. 2832 (2008). Low-spin
+# values are used for Mn, Fe and Co and the sp3 value for C. Dummy atoms and the elements past Cm, for which there
+# is no data, have NaN so that they never bond.
+COVALENT_RADII = np.full(len(ELEMENTS), np.nan)
+COVALENT_RADII[1:97] = [
+    0.31, 0.28,
+    1.28, 0.96, 0.84, 0.76, 0.71, 0.66, 0.57, 0.58,
+    1.66, 1.41, 1.21, 1.11, 1.07, 1.05, 1.02, 1.06,
+    2.03, 1.76, 1.70, 1.60, 1.53, 1.39, 1.39, 1.32, 1.26, 1.24, 1.32, 1.22, 1.22, 1.20, 1.19, 1.20, 1.20, 1.16,
+    2.20, 1.95, 1.90, 1.75, 1.64, 1.54, 1.47, 1.46, 1.42, 1.39, 1.45, 1.44, 1.42, 1.39, 1.39, 1.38, 1.39, 1.40,
+    2.44, 2.15, 2.07, 2.04, 2.03, 2.01, 1.99, 1.98, 1.98, 1.96, 1.94, 1.92, 1.92, 1.89, 1.90, 1.87, 1.87,
+    1.75, 1.70, 1.62, 1.51, 1.44, 1.41, 1.36, 1.36, 1.32, 1.45, 1.46, 1.48, 1.40, 1.50, 1.50,
+    2.60, 2.21, 2.15, 2.06, 2.00, 1.96, 1.90, 1.87, 1.80, 1.69]
+
+
+# First ionisation energies and electron affinities in eV, indexed by Z, from the CRC Handbook of Chemistry and
+# Physics. Elements whose anion is unbound have an electron affinity of 0. Elements past Ba and dummy atoms have NaN.
+IONISATION_ENERGIES = np.full(len(ELEMENTS), np.nan)
+IONISATION_ENERGIES[1:57] = [
+    13.598, 24.587,
+    5.392, 9.323, 8.298, 11.260, 14.534, 13.618, 17.423, 21.565,
+    5.139, 7.646, 5.986, 8.152, 10.487, 10.360, 12.968, 15.760,
+    4.341, 6.113, 6.561, 6.828, 6.746, 6.767, 7.434, 7.902, 7.881, 7.640, 7.726, 9.394, 5.999, 7.900, 9.789, 9.752,
+    11.814, 14.000,
+    4.177, 5.695, 6.217, 6.634, 6.759, 7.092, 7.280, 7.361, 7.459, 8.337, 7.576, 8.994, 5.786, 7.344, 8.608, 9.010,
+    10.451, 12.130,
+    3.894, 5.212]
+ELECTRON_AFFINITIES = np.full(len(ELEMENTS), np.nan)
+ELECTRON_AFFINITIES[1:57] = [
+    0.754, 0.0,
+    0.618, 0.0, 0.277, 1.262, 0.0, 1.461, 3.401, 0.0,
+    0.548, 0.0, 0.433, 1.390, 0.746, 2.077, 3.613, 0.0,
+    0.501, 0.025, 0.188, 0.079, 0.525, 0.666, 0.0, 0.151, 0.662, 1.156, 1.236, 0.0, 0.430, 1.233, 0.804, 2.021,
+    3.364, 0.0,
+    0.486, 0.048, 0.307, 0.426, 0.893, 0.748, 0.550, 1.050, 1.137, 0.562, 1.302, 0.0, 0.384, 1.112, 1.047, 1.971,
+    3.059, 0.0,
+    0.472, 0.145]
+
+
 def lookup_element_by_symbol(symbol):
-    return next((e for e in ELEMENTS if e[1].lower() == symbol.lower()), None)
\ No newline at end of file
+    return ELEMENTS_BY_SYMBOL.get(symbol.lower())
+
+
+def lookup_element_by_z(z):
+    return ELEMENTS_BY_Z.get(z)
+
+
+def lookup_atomic_numbers(symbols):
+    """
+    Maps an array of element symbols to atomic numbers in one call
+    :param symbols: a sequence or array of element symbols (case insensitive)
+    :return: an integer array of atomic numbers
+    """
+    symbols = np.asarray(symbols, dtype=str).reshape(-1)
+    unique_symbols, inverse = np.unique(symbols, return_inverse=True)
+    numbers = np.empty(len(unique_symbols), dtype=np.int16)
+    for i, symbol in enumerate(unique_symbols.tolist()):
+        element = lookup_element_by_symbol(symbol)
+        if element is None:
+            raise ValueError("Unknown element symbol: %s" % symbol)
+        numbers[i] = element[0]
+    return numbers[inverse.reshape(-1)]
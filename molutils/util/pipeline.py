@@ -0,0 +1,169 @@
+import asyncio
+import queue
+import threading
+import time
+
+# Number of items that may wait in the queue in front of each stage, per worker of the stage
+QUEUE_SIZE_PER_WORKER = 2
+
+_DONE = object()
+
+
+class Stage(object):
+    """
+    One step of a Pipeline, applied to every item in turn
+    """
+
+    def __init__(self, name, function, workers=1, executor=None):
+        """
+        :param name: the name under which the time spent in the stage is reported
+        :param function: takes an item's value and returns its new value. Coroutine functions run on the event
+        loop; other functions run in executor.
+        :param workers: the number of items the stage works on at once
+        :param executor: a concurrent.futures executor, or None for the event loop's default thread pool. Process
+        pools need a function and values that can be pickled.
+        """
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.executor = executor
+
+
+class PipelineItem(object):
+    """
+    A value moving through a pipeline, with the error that stopped it, if any, and the time spent in each stage
+    """
+
+    def __init__(self, index, value):
+        self.index = index
+        self.value = value
+        self.error = None
+        self.timings = {}
+
+
+class Pipeline(object):
+    """
+    Runs items through a sequence of stages, with a bounded queue between each pair of stages so that a slow stage
+    holds back the stages before it instead of letting work pile up. The number of items between entering the
+    pipeline and being taken by the caller is bounded too, so memory use does not grow with the number of items
+    even when results are returned in input order.
+    """
+
+    def __init__(self, stages, max_in_flight=None, ordered=True):
+        """
+        :param stages: a list of Stage objects
+        :param max_in_flight: the most items inside the pipeline at once, by default enough to keep every stage
+        busy with a full queue
+        :param ordered: return items in input order rather than as they finish
+        """
+        self.stages = stages
+        if max_in_flight is None:
+            max_in_flight = sum(stage.workers * (1 + QUEUE_SIZE_PER_WORKER) for stage in stages) + 1
+        self.max_in_flight = max_in_flight
+        self.ordered = ordered
+
+    def run(self, values):
+        """
+        Runs the pipeline on an event loop in a background thread
+        :param values: an iterable of input values, consumed lazily
+        :return: a generator of finished PipelineItem objects. Errors raised by a stage are kept on the item, which
+        then skips the remaining stages.
+        """
+        finished = queue.Queue()
+        loop = asyncio.new_event_loop()
+        slots = asyncio.Semaphore(self.max_in_flight)
+        task = loop.create_task(self._run(values, slots, finished))
+        # Exceptions that escape the event loop thread, raised again in the caller
+        failure = []
+
+        def run_loop():
+            try:
+                loop.run_until_complete(task)
+            except BaseException as e:
+                failure.append(e)
+                finished.put(_DONE)
+            finally:
+                loop.run_until_complete(loop.shutdown_default_executor())
+                loop.close()
+
+        thread = threading.Thread(target=run_loop, name="pipeline", daemon=True)
+        thread.start()
+        try:
+            for item in self._collect(finished):
+                yield item
+                try:
+                    loop.call_soon_threadsafe(slots.release)
+                except RuntimeError:
+                    # Every item has been taken in and the loop has finished
+                    pass
+            thread.join()
+            if failure:
+                raise failure[0]
+        finally:
+            if thread.is_alive():
+                # The caller stopped early
+                try:
+                    loop.call_soon_threadsafe(task.cancel)
+                except RuntimeError:
+                    pass
+                thread.join()
+
+    def _collect(self, finished):
+        waiting = {}
+        next_index = 0
+        while True:
+            item = finished.get()
+            if item is _DONE:
+                return
+            if not self.ordered:
+                yield item
+                continue
+            waiting[item.index] = item
+            while next_index in waiting:
+                yield waiting.pop(next_index)
+                next_index += 1
+
+    async def _run(self, values, slots, finished):
+        queues = [asyncio.Queue(maxsize=stage.workers * QUEUE_SIZE_PER_WORKER) for stage in self.stages]
+        workers = []
+        for i, stage in enumerate(self.stages):
+            output = queues[i + 1] if i + 1 < len(queues) else None
+            workers.append([asyncio.ensure_future(self._work(stage, queues[i], output, finished))
+                            for _ in range(stage.workers)])
+
+        try:
+            for index, value in enumerate(values):
+                await slots.acquire()
+                await queues[0].put(PipelineItem(index, value))
+
+            # Shut the stages down in order, once the stage before has passed on all of its items
+            for stage_queue, stage_workers in zip(queues, workers):
+                for _ in stage_workers:
+                    await stage_queue.put(_DONE)
+                await asyncio.gather(*stage_workers)
+            finished.put(_DONE)
+        finally:
+            for stage_workers in workers:
+                for worker in stage_workers:
+                    worker.cancel()
+
+    async def _work(self, stage, input_queue, output_queue, finished):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await input_queue.get()
+            if item is _DONE:
+                return
+            if item.error is None:
+                start = time.perf_counter()
+                try:
+                    if asyncio.iscoroutinefunction(stage.function):
+                        item.value = await stage.function(item.value)
+                    else:
+                        item.value = await loop.run_in_executor(stage.executor, stage.function, item.value)
+                except Exception as e:
+                    item.error = e
+                item.timings[stage.name] = item.timings.get(stage.name, 0.0) + time.perf_counter() - start
+            if output_queue is not None:
+                await output_queue.put(item)
+            else:
+                finished.put(item)
@@ -0,0 +1,202 @@
+import os
+import re
+from collections import namedtuple
+
+BOHR_TO_ANGSTROM = 0.52917721067
+
+# Size of the blocks read backwards from the end of a file when looking for the last geometry
+TAIL_BLOCK_SIZE = 65536
+
+GEOMETRY_HEADER = re.compile(r"^\s*Geometry \(in (Angstrom|Bohr)\), charge = (-?\d+), multiplicity = (\d+):")
+CENTER_HEADER = re.compile(r"^\s*Center\s+X\s+Y\s+Z\s+Mass\s*$")
+CENTER_HEADER_LINE = re.compile(r"^[ \t]*Center[ \t]+X[ \t]+Y[ \t]+Z[ \t]+Mass[ \t]*\r?$", re.MULTILINE)
+SCF_FINAL_ENERGY = re.compile(r"^\s*@\S+ Final Energy:\s+(-?\d+\.\d+)")
+MP2_SECTION = re.compile(r">\s*(?:DF-)?MP2 Energies\s*<")
+ENERGY_SECTION = re.compile(r"Energies\s*<")
+TOTAL_ENERGY = re.compile(r"^\s*Total Energy\s+=\s+(-?\d+\.\d+)")
+MP2_TOTAL_ENERGY = re.compile(r"^\s*(?:DF-)?MP2 Total Energy(?: \(a\.u\.\))?\s*[:=]\s*(-?\d+\.\d+)")
+OPTIMIZATION_FINAL_ENERGY = re.compile(r"Final energy is\s+(-?\d+\.\d+)")
+
+Psi4Geometry = namedtuple("Psi4Geometry", ["atom_list", "charge", "multiplicity"])
+
+
+class Psi4Output(object):
+    """
+    Everything collected from a psi4 output file
+    """
+
+    def __init__(self):
+        self.geometries = []
+        self.scf_energies = []
+        self.mp2_energies = []
+        self.final_energy = None
+
+    @property
+    def last_geometry(self):
+        return self.geometries[-1] if self.geometries else None
+
+    @property
+    def energy(self):
+        """
+        The optimised energy if the job was an optimisation, otherwise the last MP2 or SCF energy found
+        """
+        if self.final_energy is not None:
+            return self.final_energy
+        if self.mp2_energies:
+            return self.mp2_energies[-1]
+        if self.scf_energies:
+            return self.scf_energies[-1]
+        return None
+
+
+class Psi4OutputParser(object):
+    """
+    A streaming parser for psi4 output, fed one line at a time
+    """
+
+    def __init__(self):
+        self.output = Psi4Output()
+        self._charge = None
+        self._multiplicity = None
+        self._scale = 1.0
+        self._geometry_line = 0
+        self._atom_list = None
+        self._in_mp2_section = False
+
+    def feed(self, line):
+        """
+        Parses the next line
+        :return: True if the line completed a geometry block
+        """
+        if self._geometry_line > 0:
+            return self._feed_geometry(line)
+
+        # Cheap substring tests keep the regular expressions off most lines
+        if "Center" in line and CENTER_HEADER.match(line):
+            self._geometry_line = 1
+            self._atom_list = []
+        elif "Geometry (in" in line:
+            match = GEOMETRY_HEADER.match(line)
+            if match:
+                self._scale = BOHR_TO_ANGSTROM if match.group(1) == "Bohr" else 1.0
+                self._charge = int(match.group(2))
+                self._multiplicity = int(match.group(3))
+        elif "nerg" in line:
+            self._feed_energy(line)
+        return False
+
+    def _feed_geometry(self, line):
+        self._geometry_line += 1
+        # The line after the header is a row of dashes; atoms follow until a blank line
+        if self._geometry_line == 2:
+            return False
+        xyz_parts = line.split()
+        if xyz_parts:
+            scale = self._scale
+            self._atom_list.append((xyz_parts[0], float(xyz_parts[1]) * scale, float(xyz_parts[2]) * scale,
+                                    float(xyz_parts[3]) * scale))
+            return False
+        self._end_geometry()
+        return True
+
+    def _end_geometry(self):
+        self.output.geometries.append(Psi4Geometry(self._atom_list, self._charge, self._multiplicity))
+        self._geometry_line = 0
+        self._atom_list = None
+
+    def _feed_energy(self, line):
+        match = SCF_FINAL_ENERGY.match(line)
+        if match:
+            self.output.scf_energies.append(float(match.group(1)))
+            return
+        match = MP2_TOTAL_ENERGY.match(line)
+        if match:
+            self.output.mp2_energies.append(float(match.group(1)))
+            return
+        if ENERGY_SECTION.search(line):
+            self._in_mp2_section = MP2_SECTION.search(line) is not None
+            return
+        if self._in_mp2_section:
+            match = TOTAL_ENERGY.match(line)
+            if match:
+                self.output.mp2_energies.append(float(match.group(1)))
+                self._in_mp2_section = False
+            return
+        match = OPTIMIZATION_FINAL_ENERGY.search(line)
+        if match:
+            self.output.final_energy = float(match.group(1))
+
+    def close(self):
+        """
+        Finishes parsing, keeping a geometry block cut short by the end of the file
+        :return: a Psi4Output object
+        """
+        if self._geometry_line > 2:
+            self._end_geometry()
+        return self.output
+
+
+def parse_psi4_output(output_file, first_geometry_only=False):
+    """
+    Parses a psi4 output file in a single pass
+    :param output_file: the output file as a file-like object, path or iterable of lines
+    :param first_geometry_only: stop reading after the first geometry block
+    :return: a Psi4Output object
+    """
+    if isinstance(output_file, str):
+        with open(output_file, 'r') as f:
+            return parse_psi4_output(f, first_geometry_only=first_geometry_only)
+
+    parser = Psi4OutputParser()
+    for line in output_file:
+        if parser.feed(line) and first_geometry_only:
+            break
+    return parser.close()
+
+
+def read_last_psi4_geometry(path):
+    """
+    Finds the last geometry in a psi4 output file by reading backwards from the end, so that only the tail of
+    the file is read
+    :param path: path to the output file
+    :return: a Psi4Geometry, or None if the file has no geometry
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        start = f.tell()
+        tail = b''
+        block_size = TAIL_BLOCK_SIZE
+        while start > 0:
+            # Double the step each time so that the total work stays proportional to the size of the tail
+            step = min(block_size, start)
+            block_size *= 2
+            start -= step
+            f.seek(start)
+            tail = f.read(step) + tail
+
+            text = tail.decode('utf-8', errors='replace')
+            headers = list(CENTER_HEADER_LINE.finditer(text))
+            if not headers:
+                continue
+            header = headers[-1].start()
+            # Unless the whole file has been read, the first line in the buffer may be incomplete
+            first_newline = text.find("\n") if start > 0 else -1
+            if header <= first_newline:
+                continue
+
+            # Start from the charge and multiplicity line a couple of lines above the header if there is one
+            geometry_line = text.rfind("Geometry (in", max(0, header - 1024), header)
+            if geometry_line < 0:
+                if start > 0 and header < 1024:
+                    continue
+                geometry_line = header
+            elif geometry_line <= first_newline:
+                continue
+            line_start = text.rfind("\n", 0, geometry_line) + 1
+
+            parser = Psi4OutputParser()
+            for line in text[line_start:].splitlines(True):
+                if parser.feed(line):
+                    break
+            return parser.close().last_geometry
+    return None
@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import json
+import os
+import queue
+import shlex
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from . import instrumentation
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "psi4_worker.py")
+
+# A worker is replaced after this many jobs, or once its memory has grown by this many bytes since its first job
+MAX_JOBS_PER_WORKER = 500
+MAX_MEMORY_GROWTH = 512 * 1024 * 1024
+
+# Seconds a worker is given to exit once its input is closed before it is killed
+WORKER_STOP_TIMEOUT = 10
+
+
+def psi4_python(psi4_path):
+    """
+    Finds the Python interpreter that runs a psi4 executable script, from its #! line
+    :param psi4_path: the path to the psi4 executable
+    :return: the interpreter command as a list, or [sys.executable] if psi4_path is not a Python script
+    """
+    path = None
+    if psi4_path:
+        path = psi4_path if os.path.isfile(psi4_path) else shutil.which(psi4_path)
+    if path is not None:
+        try:
+            with open(path, "rb") as f:
+                first_line = f.readline().decode("utf-8", "replace").strip()
+        except OSError:
+            first_line = ""
+        if first_line.startswith("#!") and "python" in first_line:
+            return shlex.split(first_line[2:])
+    return [sys.executable]
+
+
+class _Worker(object):
+    def __init__(self, command):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        universal_newlines=True)
+        self.jobs = 0
+        self.first_memory = None
+
+    def run(self, job):
+        self.process.stdin.write(json.dumps({"job": job}) + "\n")
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            raise EOFError("psi4 worker exited with status %s" % self.process.wait())
+        self.jobs += 1
+        return json.loads(line)
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=WORKER_STOP_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class Psi4WorkerPool(object):
+    """
+    Long-lived psi4 worker processes that run one SCF job after another, so that starting psi4 is paid once per
+    worker instead of once per calculation. Workers are started when first needed. A worker is replaced after a job
+    fails, after max_jobs jobs, or once its memory has grown by more than max_memory_growth bytes. Safe to use from
+    several threads at once.
+    """
+
+    def __init__(self, size, psi4_path=None, python=None, n_threads=None, max_jobs=MAX_JOBS_PER_WORKER,
+                 max_memory_growth=MAX_MEMORY_GROWTH, worker_script=WORKER_SCRIPT):
+        """
+        :param size: the number of workers
+        :param psi4_path: the psi4 executable, whose interpreter runs the workers when python is not given
+        :param python: the Python interpreter to run the workers, as a path or a command list
+        :param n_threads: threads for each worker, or None for the psi4 default
+        :param max_jobs: the most jobs a worker runs before it is replaced
+        :param max_memory_growth: the most a worker's memory may grow, in bytes, before it is replaced
+        :param worker_script: the worker program, which must follow the protocol of psi4_worker.py
+        """
+        if size < 1:
+            raise ValueError("A psi4 worker pool needs at least one worker")
+        if python is None:
+            python = psi4_python(psi4_path)
+        elif isinstance(python, str):
+            python = [python]
+        self.command = list(python) + [worker_script] + ([str(n_threads)] if n_threads is not None else [])
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_memory_growth = max_memory_growth
+        self.workers_started = 0
+        # Last in, first out, so that the same warm workers are used when there is little work
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(None)
+        self._executor = ThreadPoolExecutor(max_workers=size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def energy(self, job):
+        """
+        Runs a psi4 job on the next free worker, waiting for one if they are all busy
+        :param job: the psi4 input
+        :return: the total energy, or None if the job failed
+        """
+        worker = self._idle.get()
+        try:
+            if worker is None:
+                worker = _Worker(self.command)
+                self.workers_started += 1
+                instrumentation.count("psi4_worker_starts")
+            instrumentation.count("psi4_pool_jobs")
+            try:
+                with instrumentation.timer("psi4_wait"):
+                    reply = worker.run(job)
+            except (OSError, EOFError, ValueError):
+                # The worker died or garbled its reply
+                self._retire(worker)
+                worker = None
+                return None
+            if reply.get("error") is not None:
+                # The worker may have been left in a bad state
+                self._retire(worker)
+                worker = None
+                return None
+            if self._worn_out(worker, reply.get("memory")):
+                self._retire(worker)
+                worker = None
+            return reply.get("energy")
+        finally:
+            self._idle.put(worker)
+
+    async def energy_async(self, job):
+        """
+        Does the same as energy without blocking the event loop
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, contextvars.copy_context().run,
+                                                                self.energy, job)
+
+    def close(self):
+        """
+        Waits for running jobs to finish and stops every worker
+        """
+        workers = [self._idle.get() for _ in range(self.size)]
+        for worker in workers:
+            if worker is not None:
+                worker.stop()
+            # Workers start again if the pool is used after all
+            self._idle.put(None)
+        self._executor.shutdown()
+
+    def _worn_out(self, worker, memory):
+        if memory is not None:
+            if worker.first_memory is None:
+                worker.first_memory = memory
+            elif memory - worker.first_memory > self.max_memory_growth:
+                return True
+        return worker.jobs >= self.max_jobs
+
+    def _retire(self, worker):
+        instrumentation.count("psi4_worker_restarts")
+        worker.stop()
@@ -0,0 +1,79 @@
+"""
+A long-lived psi4 worker. Reads one JSON request per line on stdin, each holding a psi4 input in "job", and answers
+each with one JSON line on stdout holding the total energy (or null), an error message (or null) and the resident
+memory of the worker in bytes. psi4 is imported once, so its start-up cost is paid once for many jobs.
+
+Started by molutils.util.psi4_pool.Psi4WorkerPool with a Python interpreter that can import psi4. This file must
+not import anything from molutils, as that interpreter may not have it.
+
+Usage: python psi4_worker.py [n_threads]
+"""
+import json
+import os
+import sys
+
+
+def resident_memory():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        # Peak rather than current memory; good enough to notice growth
+        return max_rss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def max_rss_bytes(max_rss, platform=None):
+    """
+    :param max_rss: ru_maxrss from getrusage, which is in bytes on macOS and in kilobytes on Linux and the BSDs
+    :param platform: a sys.platform value, by default this one
+    :return: the same size in bytes
+    """
+    if (platform or sys.platform) == "darwin":
+        return max_rss
+    return max_rss * 1024
+
+
+def run_job(psi4, job):
+    namespace = {"psi4": psi4}
+    exec("from psi4 import *\nfrom psi4.core import *", namespace)
+    exec(psi4.process_input(job), namespace)
+    variable = getattr(psi4, "variable", None) or psi4.core.get_variable
+    return float(variable("CURRENT ENERGY"))
+
+
+def reset(psi4):
+    psi4.core.clean()
+    psi4.core.clean_options()
+    psi4.core.clean_variables()
+
+
+def main():
+    # Replies go to a private copy of stdout; anything psi4 prints goes to stderr instead
+    replies = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+
+    import psi4
+    psi4.core.set_output_file(os.devnull, False)
+    if len(sys.argv) > 1:
+        psi4.set_num_threads(int(sys.argv[1]))
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        energy = None
+        error = None
+        try:
+            energy = run_job(psi4, json.loads(line)["job"])
+        except Exception as e:
+            error = "%s: %s" % (type(e).__name__, e)
+        try:
+            reset(psi4)
+        except Exception as e:
+            error = error or "%s: %s" % (type(e).__name__, e)
+        replies.write(json.dumps({"energy": energy, "error": error, "memory": resident_memory()}) + "\n")
+        replies.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+import math
+
+import numpy as np
+
+# Number of query points processed at once when enumerating neighbour pairs; bounds the size of temporary arrays
+QUERY_CHUNK_SIZE = 16384
+
+# Below this many atom pairs a direct all-pairs comparison is faster than building and searching a grid
+BRUTE_FORCE_PAIR_LIMIT = 65536
+
+# Grids with no more than this many cells per point keep a table of where each cell starts, so that looking up a cell
+# is a direct index instead of a binary search
+DENSE_CELLS_PER_POINT = 8
+
+_NEIGHBOUR_OFFSETS = np.array([(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)],
+                              dtype=np.int64)
+
+
+def squared_distances(a, b):
+    """
+    Squared distances between matching rows of two (..., 3) arrays, summed in the same order as Molecule has always
+    used so that results are bitwise reproducible
+    :param a: an (..., 3) array
+    :param b: an (..., 3) array
+    :return: an array of squared distances, with the last axis of a and b removed
+    """
+    d = a - b
+    return d[..., 0] * d[..., 0] + d[..., 1] * d[..., 1] + d[..., 2] * d[..., 2]
+
+
+def brute_force_min_distance(a, b):
+    """
+    Finds the smallest distance between any point in a and any point in b by checking every pair
+    :param a: an (n, 3) array
+    :param b: an (m, 3) array
+    :return: the smallest distance, or None if either array is empty
+    """
+    if len(a) == 0 or len(b) == 0:
+        return None
+    i = np.repeat(np.arange(len(a)), len(b))
+    j = np.tile(np.arange(len(b)), len(a))
+    return math.sqrt(squared_distances(a[i], b[j]).min())
+
+
+class _Grid(object):
+    """
+    A uniform grid of cubic cells over a set of points, stored as the point indices sorted by cell
+    """
+
+    def __init__(self, coordinates, cell_size):
+        self.cell_size = cell_size
+        self.origin = coordinates.min(axis=0)
+        cells = np.floor((coordinates - self.origin) / cell_size).astype(np.int64)
+        self.shape = cells.max(axis=0) + 1
+        keys = self.cell_keys(cells)
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+        n_cells = int(np.prod(self.shape))
+        self.cell_starts = None
+        if n_cells <= DENSE_CELLS_PER_POINT * len(coordinates):
+            self.cell_starts = np.searchsorted(self.sorted_keys, np.arange(n_cells + 1))
+
+    def cells_of(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def cell_keys(self, cells):
+        return cells[:, 0] + self.shape[0] * (cells[:, 1] + self.shape[1] * cells[:, 2])
+
+    def candidates(self, cells):
+        """
+        Finds the points in the 27 cells surrounding each of the given cells
+        :param cells: an (n, 3) array of integer cell coordinates
+        :return: a pair of arrays (row in cells, point index)
+        """
+        rows = []
+        points = []
+        for offset in _NEIGHBOUR_OFFSETS:
+            neighbours = cells + offset
+            inside = np.all((neighbours >= 0) & (neighbours < self.shape), axis=1)
+            if not inside.any():
+                continue
+            row = np.nonzero(inside)[0]
+            keys = self.cell_keys(neighbours[inside])
+            if self.cell_starts is not None:
+                start = self.cell_starts[keys]
+                end = self.cell_starts[keys + 1]
+            else:
+                start = np.searchsorted(self.sorted_keys, keys, side='left')
+                end = np.searchsorted(self.sorted_keys, keys, side='right')
+            counts = end - start
+            total = counts.sum()
+            if total == 0:
+                continue
+            first = np.cumsum(counts) - counts
+            position = np.repeat(start - first, counts) + np.arange(total)
+            rows.append(np.repeat(row, counts))
+            points.append(self.order[position])
+        if not rows:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        return np.concatenate(rows), np.concatenate(points)
+
+
+class SpatialIndex(object):
+    """
+    A cell-list spatial index over a fixed set of points, used for neighbour and nearest-distance queries.
+    Grids are built lazily for each cell size that is needed and kept for reuse by later queries.
+    """
+
+    def __init__(self, coordinates, cell_size=None):
+        """
+        :param coordinates: an (n, 3) array of coordinates
+        :param cell_size: the edge length of the smallest grid cells; by default this is picked so that each cell
+        holds a handful of points
+        """
+        self.coordinates = np.ascontiguousarray(coordinates, dtype=np.float64).reshape(-1, 3)
+        if len(self.coordinates) > 0:
+            self.lower = self.coordinates.min(axis=0)
+            self.upper = self.coordinates.max(axis=0)
+        else:
+            self.lower = self.upper = np.zeros(3)
+        if cell_size is None:
+            extent = np.maximum(self.upper - self.lower, 1.0)
+            cell_size = max(float(np.cbrt(np.prod(extent) * 4.0 / max(len(self.coordinates), 1))), 1.0)
+        self.cell_size = float(cell_size)
+        self._grids = {}
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def _grid(self, radius):
+        # Reuse grids whose cell size is a power-of-two multiple of the base size
+        level = 0
+        if radius > self.cell_size:
+            level = int(math.ceil(math.log2(radius / self.cell_size)))
+            while self.cell_size * 2 ** level < radius:
+                level += 1
+        grid = self._grids.get(level)
+        if grid is None:
+            grid = _Grid(self.coordinates, self.cell_size * 2 ** level)
+            self._grids[level] = grid
+        return grid
+
+    def iter_pairs_within(self, points, radius):
+        """
+        Yields all pairs of query points and indexed points that are no further apart than radius, in chunks
+        :param points: an (n, 3) array of query points
+        :param radius: the cut-off distance
+        :return: a generator of (query index array, indexed point array, squared distance array) tuples
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if len(points) == 0 or len(self.coordinates) == 0:
+            return
+        # The small margin keeps pairs lying exactly on the cut-off inside the searched cells despite rounding
+        grid = self._grid(radius * (1 + 1e-9))
+        cutoff = radius * radius
+        for chunk_start in range(0, len(points), QUERY_CHUNK_SIZE):
+            chunk = points[chunk_start:chunk_start + QUERY_CHUNK_SIZE]
+            i, j = grid.candidates(grid.cells_of(chunk))
+            d2 = squared_distances(chunk[i], self.coordinates[j])
+            close = d2 <= cutoff
+            yield i[close] + chunk_start, j[close], d2[close]
+
+    def pairs_within(self, points, radius):
+        """
+        Finds all pairs of query points and indexed points that are no further apart than radius
+        :param points: an (n, 3) array of query points
+        :param radius: the cut-off distance
+        :return: a tuple of (query index array, indexed point array, squared distance array)
+        """
+        chunks = list(self.iter_pairs_within(points, radius))
+        if not chunks:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return tuple(np.concatenate(parts) for parts in zip(*chunks))
+
+    def min_distance(self, points):
+        """
+        Finds the smallest distance between any query point and any indexed point
+        :param points: an (n, 3) array of query points
+        :return: the smallest distance, or None if there are no points
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if len(points) == 0 or len(self.coordinates) == 0:
+            return None
+
+        # No pair can be closer than the gap between the two bounding boxes, so start searching just beyond it
+        gap = np.maximum(np.maximum(self.lower - points.max(axis=0), points.min(axis=0) - self.upper), 0.0)
+        gap = float(np.sqrt(np.dot(gap, gap)))
+        step = self.cell_size
+        while True:
+            radius = gap + step
+            best = None
+            for _, _, d2 in self.iter_pairs_within(points, radius):
+                if len(d2) > 0:
+                    chunk_best = d2.min()
+                    if best is None or chunk_best < best:
+                        best = chunk_best
+            if best is not None:
+                return math.sqrt(best)
+            step *= 2
@@ -0,0 +1,185 @@
+import io
+import os
+
+import numpy as np
+
+from .binary_cache import read_frames, write_frames
+from .molecule import Molecule
+
+FRAME_INDEX_SUFFIX = ".frames.npz"
+
+
+def read_xyz_frame(fp, psi4_path=None):
+    """
+    Reads the next frame of a (possibly multi-frame) XYZ file, using the atom count on its first line to find
+    where the frame ends
+    :param fp: a file-like object open in text mode, positioned at the start of a frame
+    :param psi4_path: the path to the psi4 executable
+    :return: a Molecule object, or None if there are no more frames
+    """
+    line = fp.readline()
+    # Ignore blank lines before and between frames
+    while line and not line.strip():
+        line = fp.readline()
+    if not line:
+        return None
+
+    try:
+        n_atoms = int(line.split()[0])
+    except ValueError:
+        raise ValueError("Expected the number of atoms at the start of an XYZ frame, found: %s" % line.strip())
+
+    title = fp.readline()
+    atom_list = []
+    for _ in range(n_atoms):
+        xyz_parts = fp.readline().split()
+        if len(xyz_parts) < 4:
+            raise ValueError("XYZ frame ended after %i of %i atoms" % (len(atom_list), n_atoms))
+        atom_list.append((xyz_parts[0], float(xyz_parts[1]), float(xyz_parts[2]), float(xyz_parts[3])))
+    return Molecule(title.replace(" ", "_"), atom_list, psi4_path=psi4_path)
+
+
+def iter_xyz_frames(xyz_file, psi4_path=None):
+    """
+    Yields one Molecule per frame of a multi-frame XYZ file, reading one frame at a time
+    :param xyz_file: the xyz file as a file-like object or path
+    :param psi4_path: the path to the psi4 executable
+    :return: a generator of Molecule objects
+    """
+    if isinstance(xyz_file, str):
+        with open(xyz_file, 'r') as f:
+            for molecule in iter_xyz_frames(f, psi4_path=psi4_path):
+                yield molecule
+        return
+
+    while True:
+        molecule = read_xyz_frame(xyz_file, psi4_path=psi4_path)
+        if molecule is None:
+            return
+        yield molecule
+
+
+def save_binary_frames(path, molecules, source=None):
+    """
+    Writes a collection of molecules, such as the frames of a trajectory, to one binary molecule file
+    :param path: the file to write
+    :param molecules: a sequence of Molecule objects
+    :param source: path of the file the molecules were read from
+    """
+    write_frames(path, [molecule._to_frame() for molecule in molecules], source=source)
+
+
+def load_binary_frames(path, psi4_path=None, source=None):
+    """
+    Reads every molecule in a binary molecule file. All of them share a single memory map of the file.
+    :param path: path to the binary file
+    :param psi4_path: the path to the psi4 executable
+    :param source: if given, the file the binary file must have been made from in its current state
+    :return: a list of array-backed Molecule objects
+    """
+    return [Molecule._from_frame(frame, psi4_path=psi4_path) for frame in read_frames(path, source=source)]
+
+
+class XYZFrameIndex(object):
+    """
+    The byte offset of every frame in a multi-frame XYZ file, so that any frame can be read with a single seek
+    """
+
+    def __init__(self, path, offsets, atom_counts):
+        self.path = path
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.atom_counts = np.asarray(atom_counts, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, frame):
+        return self.read_frame(frame)
+
+    @staticmethod
+    def build(path):
+        """
+        Scans an XYZ file once and records where each frame starts
+        :param path: path to the XYZ file
+        :return: an XYZFrameIndex object
+        """
+        offsets = []
+        atom_counts = []
+        with open(path, 'rb') as f:
+            offset = 0
+            line = f.readline()
+            while line:
+                if line.strip():
+                    try:
+                        n_atoms = int(line.split()[0])
+                    except ValueError:
+                        raise ValueError("Expected the number of atoms at byte %i of %s" % (offset, path))
+                    offsets.append(offset)
+                    atom_counts.append(n_atoms)
+                    offset += len(line)
+                    # Skip the title line and the atoms
+                    for _ in range(n_atoms + 1):
+                        offset += len(f.readline())
+                else:
+                    offset += len(line)
+                line = f.readline()
+        return XYZFrameIndex(path, offsets, atom_counts)
+
+    @staticmethod
+    def _source_stamp(path):
+        stat = os.stat(path)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def save(self, index_path=None):
+        """
+        Writes the index to disk
+        :param index_path: where to write the index, by default next to the XYZ file
+        :return: the path the index was written to
+        """
+        if index_path is None:
+            index_path = self.path + FRAME_INDEX_SUFFIX
+        with open(index_path, 'wb') as f:
+            np.savez(f, offsets=self.offsets, atom_counts=self.atom_counts, source=self._source_stamp(self.path))
+        return index_path
+
+    @staticmethod
+    def load(path, index_path=None):
+        """
+        Reads a saved index
+        :param path: path to the XYZ file
+        :param index_path: path to the saved index, by default next to the XYZ file
+        :return: an XYZFrameIndex object
+        :raises ValueError: if the XYZ file has changed since the index was saved
+        """
+        if index_path is None:
+            index_path = path + FRAME_INDEX_SUFFIX
+        with np.load(index_path) as data:
+            if not np.array_equal(data['source'], XYZFrameIndex._source_stamp(path)):
+                raise ValueError("Frame index %s is out of date for %s" % (index_path, path))
+            return XYZFrameIndex(path, data['offsets'], data['atom_counts'])
+
+    @staticmethod
+    def open(path, index_path=None):
+        """
+        Loads the saved index for an XYZ file, building and saving a new one if it is missing or out of date
+        :param path: path to the XYZ file
+        :param index_path: path to the saved index, by default next to the XYZ file
+        :return: an XYZFrameIndex object
+        """
+        try:
+            return XYZFrameIndex.load(path, index_path)
+        except (IOError, ValueError):
+            index = XYZFrameIndex.build(path)
+            index.save(index_path)
+            return index
+
+    def read_frame(self, frame, psi4_path=None):
+        """
+        Reads a single frame
+        :param frame: the frame number, counting from zero
+        :param psi4_path: the path to the psi4 executable
+        :return: a Molecule object
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(int(self.offsets[frame]))
+            return read_xyz_frame(io.TextIOWrapper(f), psi4_path=psi4_path)
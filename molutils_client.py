@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Sends a molutils.py command line to a server started with "molutils.py --serve", and prints its output.
+Takes the same arguments as molutils.py. The socket is given by the MOLUTILS_SOCKET environment variable, or the
+default socket of molutils.py --serve.
+"""
+import sys
+
+from molutils.util.daemon import request
+
+if __name__ == "__main__":
+    try:
+        status, stdout, stderr = request(sys.argv[1:])
+    except (OSError, ValueError) as e:
+        print("Could not reach the molutils server: %s" % e, file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    sys.exit(status)
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from molutils.util.archive import ArchiveWriter, archive_type, extract_archive, iter_archive, member_name, read_index
+
+FILES = [("water.inp", "molecule water {\n0 1\n}\n", "water.xyz"),
+         ("0_dimer.inp", " $CONTRL RUNTYP=MAKEFP $END\n" * 100, "dimer.xyz"),
+         ("dimer.map", "# fragment representative rmsd\n0 0 0.0000\n", "dimer.xyz")]
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name):
+        path = os.path.join(self.directory, name)
+        with ArchiveWriter(path) as archive:
+            for file_name, content, source in FILES:
+                self.assertEqual(archive.add(file_name, content, source), len(content))
+        return path
+
+    def test_round_trip(self):
+        for name in ("jobs.tar", "jobs.tar.gz", "jobs.tgz", "jobs.tar.bz2", "jobs.tar.xz", "jobs.zip"):
+            path = self.write(name)
+            self.assertEqual([(entry["name"], entry["size"], entry["source"]) for entry in read_index(path)],
+                             [(file_name, len(content), source) for file_name, content, source in FILES])
+            self.assertEqual(list(iter_archive(path)),
+                             [(file_name, content.encode("utf-8")) for file_name, content, _ in FILES])
+
+        # Zip entries are written once, with their sizes after the data, rather than patched afterwards
+        with zipfile.ZipFile(os.path.join(self.directory, "jobs.zip")) as archive:
+            self.assertTrue(all(info.flag_bits & 0x08 for info in archive.infolist()))
+
+        self.assertIsNone(archive_type("jobs.inp"))
+        self.assertRaises(ValueError, ArchiveWriter, os.path.join(self.directory, "jobs.inp"))
+
+    def test_open(self):
+        for name in ("jobs.tar.gz", "jobs.zip"):
+            path = os.path.join(self.directory, name)
+            with ArchiveWriter(path) as archive:
+                with archive.open("water.inp", "water.xyz") as fp:
+                    for line in FILES[1][1].splitlines(True):
+                        fp.write(line)
+                try:
+                    with archive.open("failed.inp") as fp:
+                        fp.write("partial")
+                        raise ValueError()
+                except ValueError:
+                    pass
+            self.assertEqual([(entry["name"], entry["size"], entry["source"]) for entry in read_index(path)],
+                             [("water.inp", len(FILES[1][1]), "water.xyz")])
+            self.assertEqual(dict(iter_archive(path))["water.inp"], FILES[1][1].encode("utf-8"))
+
+    def test_extract(self):
+        path = self.write("jobs.tar.gz")
+        destination = os.path.join(self.directory, "out")
+        self.assertEqual(extract_archive(path, destination, names=["dimer.map"]),
+                         [os.path.join(destination, "dimer.map")])
+        self.assertEqual(sorted(os.listdir(destination)), ["dimer.map"])
+        extract_archive(path, destination)
+        with open(os.path.join(destination, "water.inp")) as f:
+            self.assertEqual(f.read(), FILES[0][1])
+
+    def test_member_names(self):
+        self.assertEqual(member_name("/scratch/run/../water.inp"), "scratch/run/water.inp")
+        self.assertEqual(member_name("./0_data/water.inp"), "0_data/water.inp")
+        self.assertRaises(ValueError, member_name, "/")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import molutils.util.molecule as molecule_module
+from molutils.util.binary_cache import SIDECAR_SUFFIX
+from molutils.util.molecule import Molecule
+from molutils.util.trajectory import iter_xyz_frames, load_binary_frames, save_binary_frames
+from tests.molecule_tests import DIMER_XYZ_FILE
+from tests.trajectory_tests import TRAJECTORY_XYZ_FILE
+
+
+class BinaryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.xyz_path = os.path.join(self.directory, "dimer.xyz")
+        with open(self.xyz_path, "w") as f:
+            f.write(DIMER_XYZ_FILE)
+
+    def tearDown(self):
+        molecule_module.WRITE_BINARY_CACHE = False
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        molecule = Molecule.from_file(self.xyz_path)
+        molecule.charge = -1
+        binary_path = os.path.join(self.directory, "dimer.molbin")
+        molecule.save_binary(binary_path)
+
+        loaded = Molecule.from_binary(binary_path)
+        self.assertEqual(list(loaded), list(molecule))
+        self.assertEqual((loaded.title, loaded.charge, loaded.multiplicity), ("molecule_title", -1, 1))
+        self.assertTrue(loaded.is_array_backed)
+        # The coordinates are a view on the file, not a copy
+        self.assertFalse(loaded.coordinates.flags.owndata)
+        self.assertFalse(loaded.coordinates.flags.writeable)
+        self.assertEqual(list(Molecule.from_file(binary_path)), list(molecule))
+
+        # Adding atoms moves the molecule off the read-only map
+        loaded.add_atom("He", 1.0, 2.0, 3.0)
+        self.assertEqual(list(loaded), list(molecule) + [("He", 1.0, 2.0, 3.0)])
+
+        # Labels that differ from the element symbols are stored as they are
+        labelled = Molecule("labels", [("c", 0.0, 0.0, 0.0), ("X", 1.0, 0.0, 0.0), ("CL", 0.0, 1.0, 0.0)])
+        labelled.save_binary(binary_path)
+        self.assertEqual(list(Molecule.from_binary(binary_path)), labelled.atom_list)
+
+        labelled.atom_list = [("H1", 0.0, 0.0, 0.0)]
+        self.assertRaises(ValueError, labelled.save_binary, binary_path)
+
+    def test_multiple_frames(self):
+        trajectory_path = os.path.join(self.directory, "trajectory.xyz")
+        with open(trajectory_path, "w") as f:
+            f.write(TRAJECTORY_XYZ_FILE)
+        frames = list(iter_xyz_frames(trajectory_path))
+        binary_path = trajectory_path + SIDECAR_SUFFIX
+        save_binary_frames(binary_path, frames, source=trajectory_path)
+
+        loaded = load_binary_frames(binary_path, source=trajectory_path)
+        self.assertEqual([m.title for m in loaded], [m.title for m in frames])
+        self.assertEqual([list(m) for m in loaded], [list(m) for m in frames])
+        self.assertEqual(list(Molecule.from_binary(binary_path, frame=2)), list(frames[2]))
+
+    def test_sidecar(self):
+        sidecar = self.xyz_path + SIDECAR_SUFFIX
+        Molecule.from_file(self.xyz_path)
+        self.assertFalse(os.path.exists(sidecar))
+
+        molecule_module.WRITE_BINARY_CACHE = True
+        molecule = Molecule.from_file(self.xyz_path)
+        self.assertTrue(os.path.exists(sidecar))
+        cached = Molecule.from_file(self.xyz_path)
+        self.assertFalse(cached.coordinates.flags.writeable)
+        self.assertEqual(list(cached), list(molecule))
+        self.assertTrue(Molecule.from_file(self.xyz_path, use_cache=False).coordinates.flags.writeable)
+
+        # Changing the source makes the sidecar stale, so the text is parsed again and the sidecar replaced
+        with open(self.xyz_path, "w") as f:
+            f.write(DIMER_XYZ_FILE.replace("molecule_title", "changed title"))
+        self.assertEqual(Molecule.from_file(self.xyz_path).title, "changed_title")
+        self.assertEqual(Molecule.from_file(self.xyz_path).title, "changed_title")
+        self.assertFalse(Molecule.from_file(self.xyz_path).coordinates.flags.writeable)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from molutils.util.archive import iter_archive, read_index
+from tests.molecule_tests import WATER_XYZ_FILE
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_PATH = os.path.join(REPOSITORY_ROOT, "molutils.py")
+
+
+# Three copies of a water molecule, 5 Angstrom apart, which --dedup merges into one
+WATERS_XYZ_FILE = "9\nthree waters\n" + "".join(
+    "%s %.3f %.3f 0.000\n" % (label, x + shift, y)
+    for shift in (0.0, 5.0, 10.0)
+    for label, x, y in [("O", 0.0, 0.0), ("H", 0.757, 0.586), ("H", -0.757, 0.586)])
+
+
+def run_cli(*args, cwd=None):
+    # Runs molutils.py the way the benchmarks do, as a separate process
+    return subprocess.run([sys.executable, CLI_PATH] + list(args), cwd=cwd or REPOSITORY_ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+class CliTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.input = os.path.join(self.directory, "water.xyz")
+        with open(self.input, "w") as f:
+            f.write(WATER_XYZ_FILE)
+
+    def write_input(self, name, content):
+        with open(os.path.join(self.directory, name), "w") as f:
+            f.write(content)
+
+    def read_output(self, name):
+        with open(os.path.join(self.directory, name)) as f:
+            return f.read()
+
+    def test_jobs(self):
+        self.write_input("other.xyz", WATER_XYZ_FILE)
+        self.write_input("bad.xyz", "not a molecule\n")
+        outputs = {}
+        for jobs in ("1", "3"):
+            result = run_cli("water.xyz", "bad.xyz", "other.xyz", "--jobs", jobs, "--output_to", "AUTO",
+                             cwd=self.directory)
+            # A file that fails does not stop the others, but makes the exit status 1
+            self.assertEqual(result.returncode, 1)
+            self.assertIn("Failed: bad.xyz (ValueError: Unsupported file type)", result.stderr)
+            self.assertIn("Processed 3 files (1 failed), wrote 2 input files", result.stderr)
+            self.assertEqual(result.stdout, "Created: water.inp\nCreated: other.inp\n")
+            self.assertFalse(os.path.exists(os.path.join(self.directory, "bad.inp")))
+            outputs[jobs] = (self.read_output("water.inp"), self.read_output("other.inp"))
+        self.assertEqual(outputs["1"], outputs["3"])
+        self.assertTrue(outputs["1"][0].startswith("memory 1 Gb\nmolecule input_molecule {\n0 1\n  O "))
+
+        result = run_cli("water.xyz", "other.xyz", "--jobs", "2", cwd=self.directory)
+        self.assertEqual(result.returncode, 0)
+        # Each output is printed in input order, followed by an empty line
+        self.assertEqual(result.stdout, "".join(content + "\n" for content in outputs["1"]))
+
+    def test_dedup(self):
+        self.write_input("waters.xyz", WATERS_XYZ_FILE)
+        result = run_cli("waters.xyz", "--output_format", "gamess", "--calc_type", "makefp", "--n_frags", "auto",
+                         "--dedup", "--output_to", "AUTO", cwd=self.directory)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout, "Created: 0_waters.inp\nCreated: waters.map\n")
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "1_waters.inp")))
+        mapping = self.read_output("waters.map").splitlines()
+        self.assertEqual(mapping[0], "# fragment representative rmsd")
+        self.assertEqual([line.split()[:2] for line in mapping[1:]], [["0", "0"], ["1", "0"], ["2", "0"]])
+        self.assertTrue(self.read_output("0_waters.inp").startswith(" $SYSTEM MWORDS=125 MEMDDI=125 $END\n"))
+
+        # --dedup is refused where it would be ignored
+        result = run_cli("waters.xyz", "--n_frags", "auto", "--dedup", cwd=self.directory)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("--dedup only applies to --output_format gamess", result.stderr)
+
+    def test_archive(self):
+        self.write_input("waters.xyz", WATERS_XYZ_FILE)
+        self.write_input("more.xyz", WATERS_XYZ_FILE)
+        arguments = ["waters.xyz", "more.xyz", "--output_format", "gamess", "--calc_type", "makefp",
+                     "--n_frags", "auto"]
+        result = run_cli(*arguments + ["--output_to", "AUTO"], cwd=self.directory)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        names = ["%i_%s.inp" % (i, name) for name in ("waters", "more") for i in range(3)]
+        for archive_name in ("jobs.tar.gz", "jobs.zip"):
+            result = run_cli(*arguments + ["--output_to", archive_name], cwd=self.directory)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertEqual(result.stdout, "Created: %s (6 files)\n" % archive_name)
+            path = os.path.join(self.directory, archive_name)
+            self.assertEqual([(entry["name"], entry["source"]) for entry in read_index(path)],
+                             list(zip(names, ["waters.xyz"] * 3 + ["more.xyz"] * 3)))
+            contents = dict(iter_archive(path))
+            self.assertEqual(sorted(contents), sorted(names))
+            for name in names:
+                self.assertEqual(contents[name].decode("utf-8"), self.read_output(name))
+
+    def test_profile_argument(self):
+        with open(self.input) as f:
+            content = f.read()
+        # --profile always takes a value, so it never swallows an input file
+        result = run_cli("--profile", self.input, self.input)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("--profile would overwrite", result.stderr)
+        with open(self.input) as f:
+            self.assertEqual(f.read(), content)
+        result = run_cli(self.input, "--profile")
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("expected one argument", result.stderr)
+
+        result = run_cli("--profile", "-", self.input)
+        self.assertEqual(result.returncode, 0)
+        self.assertIn('"files"', result.stderr)
+
+    def test_profile(self):
+        self.write_input("waters.xyz", WATERS_XYZ_FILE)
+        result = run_cli("water.xyz", "waters.xyz", "--n_frags", "auto", "--profile", "profile.json",
+                         "--output_to", "jobs.tar", cwd=self.directory)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        with open(os.path.join(self.directory, "profile.json")) as f:
+            profile = json.load(f)
+        self.assertEqual([(report["file"], report["failed"]) for report in profile["files"]],
+                         [("water.xyz", False), ("waters.xyz", False)])
+        self.assertEqual([report["counters"]["atoms_parsed"] for report in profile["files"]], [3, 9])
+        for report in profile["files"]:
+            self.assertTrue({"parse", "fragment", "write"} <= set(report["timers"]))
+            self.assertGreater(report["counters"]["bytes_written"], 0)
+        aggregate = profile["aggregate"]
+        self.assertEqual(aggregate["files"], 2)
+        self.assertEqual(aggregate["counters"]["atoms_parsed"], 12)
+        self.assertEqual(aggregate["counters"]["bytes_written"],
+                         sum(entry["size"] for entry in read_index(os.path.join(self.directory, "jobs.tar"))))
+        self.assertGreater(aggregate["wall_seconds"], 0)
+
+    def test_serve_argument(self):
+        # --serve is a flag, so a following input is not taken as the socket
+        result = run_cli("--serve", "--socket", os.path.join(self.directory, "x"), "--help")
+        self.assertEqual(result.returncode, 0)
+        result = run_cli("--serve", self.input, "--socket", self.input)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("is not a socket", result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from molutils.util.daemon import Daemon, private_directory, request
+
+
+def handle(argv):
+    # Stands in for molutils.py: reports its arguments and working directory
+    if argv == ["--help"]:
+        sys.exit(0)
+    if argv == ["--bad"]:
+        print("bad argument", file=sys.stderr)
+        sys.exit(2)
+    if argv == ["--crash"]:
+        raise RuntimeError("crashed")
+    print(" ".join(argv))
+    print(os.path.basename(os.getcwd()), file=sys.stderr)
+    return len(argv)
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, "molutils.sock")
+        self.server = Daemon(self.socket_path, handle)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def test_requests(self):
+        work = os.path.join(self.directory, "work")
+        os.mkdir(work)
+        cwd = os.getcwd()
+        self.assertEqual(request(["a.xyz", "--n_frags", "2"], self.socket_path, cwd=work),
+                         (3, "a.xyz --n_frags 2\n", "work\n"))
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(request(["--help"], self.socket_path), (0, "", ""))
+        self.assertEqual(request(["--bad"], self.socket_path), (2, "", "bad argument\n"))
+        status, stdout, stderr = request(["--crash"], self.socket_path)
+        self.assertEqual(status, 1)
+        self.assertIn("RuntimeError: crashed", stderr)
+
+        # The server keeps going after a failed request
+        self.assertEqual(request([], self.socket_path, cwd=work), (0, "\n", "work\n"))
+
+    def test_permissions(self):
+        # The socket is closed to other users, and requests from another user are refused
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o077, 0)
+        self.server.uid = os.getuid() + 1
+        status, stdout, stderr = request(["a.xyz"], self.socket_path)
+        self.assertEqual(status, 1)
+        self.assertIn("Permission denied", stderr)
+        self.assertEqual(stdout, "")
+
+        private = os.path.join(self.directory, "private")
+        private_directory(private)
+        self.assertEqual(os.stat(private).st_mode & 0o777, 0o700)
+        private_directory(private)
+        self.assertRaises(FileNotFoundError, private_directory, os.path.join(self.directory, "missing"), create=False)
+        os.chmod(private, 0o755)
+        self.assertRaises(ValueError, private_directory, private)
+        link = os.path.join(self.directory, "link")
+        os.symlink(self.directory, link)
+        self.assertRaises(ValueError, private_directory, link)
+
+    def test_socket_file(self):
+        self.assertRaises(ValueError, Daemon, self.socket_path, handle)
+
+        # Only a socket without a server is replaced, never another kind of file
+        stale = os.path.join(self.directory, "stale.sock")
+        server = Daemon(stale, handle)
+        server.socket.close()
+        self.assertTrue(os.path.exists(stale))
+        server = Daemon(stale, handle)
+        server.server_close()
+        self.assertFalse(os.path.exists(stale))
+
+        data = os.path.join(self.directory, "data.xyz")
+        with open(data, "w") as f:
+            f.write("1\n\nH 0 0 0\n")
+        self.assertRaises(ValueError, Daemon, data, handle)
+        self.assertTrue(os.path.exists(data))
+
+        # A file put in place of the socket while the server ran is left alone
+        moved = os.path.join(self.directory, "moved.sock")
+        server = Daemon(moved, handle)
+        os.unlink(moved)
+        os.rename(data, moved)
+        server.server_close()
+        self.assertTrue(os.path.exists(moved))
+
+
+if __name__ == '__main__':
+    unittest.main()
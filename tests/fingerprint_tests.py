@@ -0,0 +1,85 @@
+import unittest
+from io import StringIO
+
+import numpy as np
+
+from molutils.util import instrumentation
+from molutils.util.fingerprint import deduplicate, format_mapping
+from molutils.util.molecule import Molecule, AUTO_FRAGMENTS
+from tests.molecule_tests import DIMER_XYZ_FILE
+
+# Bromochlorofluoromethane, which is chiral
+CHIRAL_LABELS = np.array(["C", "H", "F", "Cl", "Br"])
+CHIRAL_COORDINATES = np.array([[0.0, 0.0, 0.0], [0.63, 0.63, 0.63], [-0.8, -0.8, 0.8], [-0.9, 0.9, -0.9],
+                               [1.1, -1.1, -1.1]])
+
+
+def random_rotation(rng):
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    return q if np.linalg.det(q) > 0 else -q
+
+
+class FingerprintTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(7)
+        self.cation, self.anion = Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE)).fragment(AUTO_FRAGMENTS)
+
+    def moved_copy(self, molecule, noise=0.0):
+        order = self.rng.permutation(len(molecule))
+        coordinates = molecule.coordinates[order] @ random_rotation(self.rng).T + self.rng.normal(size=3) * 10
+        coordinates += self.rng.normal(scale=noise, size=coordinates.shape)
+        return Molecule.from_arrays(molecule.title, molecule.labels[order], coordinates)
+
+    def test_invariance(self):
+        for molecule in (self.cation, self.anion):
+            for _ in range(5):
+                self.assertLess(molecule.fingerprint().rmsd(self.moved_copy(molecule).fingerprint()), 1e-6)
+            noisy = self.moved_copy(molecule, noise=0.02).fingerprint()
+            self.assertTrue(0.005 < molecule.fingerprint().rmsd(noisy) < 0.05)
+        self.assertEqual(self.cation.fingerprint().rmsd(self.anion.fingerprint()), np.inf)
+
+        # Mirror images are different fragments
+        molecule = Molecule.from_arrays("chiral", CHIRAL_LABELS, CHIRAL_COORDINATES)
+        mirror = Molecule.from_arrays("chiral", CHIRAL_LABELS, CHIRAL_COORDINATES * [1.0, 1.0, -1.0])
+        self.assertLess(molecule.fingerprint().rmsd(self.moved_copy(molecule).fingerprint()), 1e-6)
+        self.assertGreater(molecule.fingerprint().rmsd(mirror.fingerprint()), 0.5)
+
+        # Dummy atoms are left out
+        padded = self.moved_copy(self.anion)
+        padded.add_atom("X", 1.0, 2.0, 3.0)
+        self.assertLess(self.anion.fingerprint().rmsd(padded.fingerprint()), 1e-6)
+
+    def test_deduplicate(self):
+        molecules = [self.cation, self.moved_copy(self.anion), self.moved_copy(self.cation, noise=0.01),
+                     self.moved_copy(self.cation, noise=0.5), self.anion, self.moved_copy(self.anion)]
+        molecules[5].charge = -1
+        representatives, mapping = deduplicate(molecules)
+        self.assertEqual(representatives, [0, 1, 3, 5])
+        self.assertEqual([representative for representative, _ in mapping], [0, 1, 0, 3, 1, 5])
+        self.assertEqual(deduplicate(molecules, tolerance=1.0)[0], [0, 1, 5])
+
+        lines = format_mapping(mapping).splitlines()
+        self.assertEqual(lines[0], "# fragment representative rmsd")
+        self.assertEqual(lines[1], "0 0 0.0000")
+        self.assertTrue(lines[3].startswith("2 0 0.0"))
+
+        # Waters with different bond lengths are told apart by their spreads, mostly without overlaying them
+        waters = []
+        for i in range(40):
+            length = 0.8 + 0.05 * i
+            coordinates = np.array([[0.0, 0.0, 0.0], [length, 0.0, 0.0], [-0.25 * length, 0.97 * length, 0.0]])
+            waters.append(self.moved_copy(Molecule.from_arrays("water", np.array(["O", "H", "H"]), coordinates)))
+        waters.append(self.moved_copy(waters[7], noise=0.002))
+        instrumentation.start()
+        try:
+            representatives, mapping = deduplicate(waters, tolerance=0.02)
+        finally:
+            report = instrumentation.stop()
+        self.assertEqual(representatives, list(range(40)))
+        self.assertEqual(mapping[40][0], 7)
+        self.assertLess(report["counters"].get("dedup_overlays", 0), 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
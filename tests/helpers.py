@@ -0,0 +1,50 @@
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import molutils.util.molecule as molecule_module
+
+# Stands in for psi4: prints an energy for the charge in the input, and logs its arguments and start time
+STUB_PSI4_SCRIPT = """#!{python}
+import re, sys, time
+job = sys.stdin.read()
+charge = int(re.search(r"\\{{\\n(-?[0-9]+) ", job).group(1))
+with open({log!r}, "a") as f:
+    f.write("%s %f\\n" % (" ".join(sys.argv[1:]), time.time()))
+time.sleep({delay})
+energies = {energies!r}
+if charge in energies:
+    print("    Total Energy =    %.10f" % energies[charge])
+"""
+
+
+def make_stub_psi4(directory, energies, delay=0.0):
+    path = os.path.join(directory, "psi4")
+    log = os.path.join(directory, "psi4.log")
+    with open(path, "w") as f:
+        f.write(STUB_PSI4_SCRIPT.format(python=sys.executable, log=log, delay=delay, energies=energies))
+    os.chmod(path, 0o755)
+    return path, log
+
+
+@contextmanager
+def charge_guess_settings(prescreen_window=None):
+    """
+    Runs charge guesses without the charge cache and with the given prescreen window, in a temporary directory for
+    stub programs and logs. The settings are restored and the directory removed afterwards, also when the settings
+    are changed inside the block.
+    :return: the temporary directory
+    """
+    directory = tempfile.mkdtemp()
+    cache = molecule_module.CHARGE_CACHE
+    window = molecule_module.CHARGE_PRESCREEN_WINDOW
+    molecule_module.CHARGE_CACHE = None
+    molecule_module.CHARGE_PRESCREEN_WINDOW = prescreen_window
+    try:
+        yield directory
+    finally:
+        molecule_module.CHARGE_CACHE = cache
+        molecule_module.CHARGE_PRESCREEN_WINDOW = window
+        shutil.rmtree(directory)
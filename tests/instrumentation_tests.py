@@ -0,0 +1,81 @@
+import asyncio
+import contextvars
+import threading
+import unittest
+
+from molutils.util import instrumentation
+
+
+class InstrumentationTest(unittest.TestCase):
+    def tearDown(self):
+        instrumentation.stop()
+
+    def test_disabled(self):
+        self.assertFalse(instrumentation.is_active())
+        with instrumentation.timer("parse"):
+            instrumentation.count("atoms_parsed", 3)
+        self.assertIsNone(instrumentation.stop())
+
+    def test_timers_and_counters(self):
+        instrumentation.start()
+        with instrumentation.timer("parse"):
+            instrumentation.count("atoms_parsed", 3)
+        with instrumentation.timer("parse"):
+            pass
+
+        def spawn():
+            for _ in range(100):
+                instrumentation.count("psi4_processes")
+        threads = [threading.Thread(target=spawn) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        report = instrumentation.stop()
+        self.assertFalse(instrumentation.is_active())
+        self.assertEqual(report["timers"]["parse"]["calls"], 2)
+        self.assertGreaterEqual(report["timers"]["parse"]["seconds"], 0.0)
+        self.assertEqual(report["counters"], {"atoms_parsed": 3, "psi4_processes": 400})
+
+        total = instrumentation.Profiler()
+        total.merge(report)
+        total.merge(report)
+        self.assertEqual(total.report()["counters"]["atoms_parsed"], 6)
+        self.assertEqual(total.report()["timers"]["parse"]["calls"], 4)
+
+    def test_collect(self):
+        instrumentation.start()
+        with instrumentation.collect() as profiler:
+            instrumentation.count("psi4_processes")
+            with instrumentation.timer("psi4_wait"):
+                pass
+
+            # Other threads report to the active profiler unless they run in a copy of this context
+            context = contextvars.copy_context()
+            threads = [threading.Thread(target=instrumentation.count, args=("psi4_processes",)),
+                       threading.Thread(target=context.run, args=(instrumentation.count, "psi4_processes"))]
+            for thread in threads:
+                thread.start()
+                thread.join()
+
+            # Tasks copy the context they are started in
+            async def spawn():
+                await asyncio.sleep(0)
+                instrumentation.count("psi4_processes")
+
+            async def run():
+                await asyncio.gather(*[spawn() for _ in range(3)])
+            asyncio.run(run())
+        instrumentation.count("atoms_parsed")
+
+        self.assertEqual(profiler.report()["counters"], {"psi4_processes": 5})
+        self.assertEqual(profiler.report()["timers"]["psi4_wait"]["calls"], 1)
+        self.assertEqual(instrumentation.stop()["counters"], {"psi4_processes": 1, "atoms_parsed": 1})
+
+        # Collecting does not need profiling to have been started, e.g. in a worker process
+        with instrumentation.collect() as profiler:
+            self.assertTrue(instrumentation.is_active())
+            instrumentation.count("atoms_parsed", 3)
+        self.assertFalse(instrumentation.is_active())
+        self.assertEqual(profiler.report()["counters"], {"atoms_parsed": 3})
@@ -0,0 +1,76 @@
+import math
+import unittest
+from io import StringIO
+
+import numpy as np
+
+import molutils.util.molecule_batch as molecule_batch_module
+from molutils.util.molecule import Molecule
+from molutils.util.molecule_batch import MoleculeBatch
+from tests.molecule_tests import DIMER_XYZ_FILE, WATER_XYZ_FILE
+from tests.trajectory_tests import TRAJECTORY_XYZ_FILE
+
+
+class MoleculeBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.molecule = Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE))
+        shifts = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, -2.5, 0.5]])
+        self.batch = MoleculeBatch("conformers", self.molecule.labels,
+                                   self.molecule.coordinates[np.newaxis] + shifts[:, np.newaxis], charge=1)
+
+    def tearDown(self):
+        molecule_batch_module.DISTANCE_CHUNK_SIZE = 1 << 20
+
+    def test_molecule_views(self):
+        self.assertEqual(len(self.batch), 3)
+        molecule = self.batch[1]
+        self.assertEqual((molecule.title, molecule.charge, len(molecule)), ("conformers", 1, 21))
+        self.assertEqual(molecule.labels.tolist(), self.molecule.labels.tolist())
+
+        # Views share the batch storage until atoms are added
+        molecule.coordinates[0, 0] = 42.0
+        self.assertEqual(self.batch.coordinates[1, 0, 0], 42.0)
+        molecule.add_atom("He", 0.0, 0.0, 0.0)
+        molecule.coordinates[0, 0] = 7.0
+        self.assertEqual(self.batch.coordinates[1, 0, 0], 42.0)
+
+        self.assertRaises(ValueError, MoleculeBatch, "bad", ["H"], np.zeros((2, 3)))
+
+    def test_charges_and_centroids(self):
+        self.assertEqual(self.batch.get_z_sum(), self.molecule.get_z_sum())
+        self.assertEqual(self.batch.get_possible_charges(-2, 2), self.molecule.get_possible_charges(-2, 2))
+        centroids = self.batch.centroids()
+        self.assertTrue(np.allclose(centroids[1] - centroids[0], [1.0, 0.0, 0.0]))
+
+    def test_min_distances(self):
+        expected = min(math.sqrt(sum((a - b) ** 2 for a, b in zip(atom_a[1:], atom_b[1:])))
+                       for i, atom_a in enumerate(self.molecule) for atom_b in list(self.molecule)[i + 1:])
+        self.assertTrue(np.allclose(self.batch.min_distances(), expected))
+
+        water = Molecule.from_xyz_file(StringIO(WATER_XYZ_FILE))
+        expected = [self.batch[frame].distance_from(water) for frame in range(3)]
+        self.assertEqual(self.batch.min_distances(water).tolist(), expected)
+        other = MoleculeBatch.from_molecules([water, water, water])
+        self.assertEqual(self.batch.min_distances(other).tolist(), expected)
+
+        # Small chunks give the same answer
+        molecule_batch_module.DISTANCE_CHUNK_SIZE = 7
+        self.assertEqual(self.batch.min_distances(water).tolist(), expected)
+
+        single_atom = MoleculeBatch("atom", ["N"], np.zeros((2, 1, 3)))
+        self.assertTrue(np.all(np.isnan(single_atom.min_distances())))
+
+    def test_formatting(self):
+        self.assertEqual(list(self.batch.iter_psi4()), [m.format_psi4() for m in self.batch])
+        self.assertEqual(list(self.batch.iter_gamess()), [m.format_gamess() for m in self.batch])
+
+    def test_from_frames(self):
+        frames = TRAJECTORY_XYZ_FILE.split(DIMER_XYZ_FILE + "\n")
+        batch = MoleculeBatch.from_xyz_frames(StringIO(frames[0] + frames[1]))
+        self.assertEqual(batch.coordinates.shape, (2, 3, 3))
+        self.assertEqual(batch.titles, ["input_molecule", "last_frame"])
+        self.assertRaises(ValueError, MoleculeBatch.from_xyz_frames, StringIO(TRAJECTORY_XYZ_FILE))
+
+
+if __name__ == '__main__':
+    unittest.main()
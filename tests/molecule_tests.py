@@ -1,10 +1,27 @@
+import asyncio
+import math
+import random
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import os
+import warnings
 from io import StringIO
 
-from molutils.util.molecule import Molecule
-from molutils.util.periodic_table import lookup_element_by_symbol
+import numpy
+
+import molutils.util.charge_estimate as charge_estimate
+import molutils.util.molecule as molecule_module
+from molutils.util.charge_cache import ChargeCache
+from molutils.util.format_detection import SNIFF_SIZE
+from molutils.util.molecule import Molecule, AUTO_FRAGMENTS
+from molutils.util.periodic_table import lookup_element_by_symbol, lookup_element_by_z, lookup_atomic_numbers, SYMBOLS
+from molutils.util.job_formatters.gamess import GamessJobFormatter
 from molutils.util.job_formatters.psi4 import Psi4JobFormatter
+from molutils.util.molecule_batch import MoleculeBatch
+from tests.helpers import charge_guess_settings, make_stub_psi4
 
 PATH_TO_PSI4 = "/opt/psi4/bin/psi4.run"
 
@@ -41,6 +58,17 @@ WATER_XYZ_FILE = (
     "H                   -1.419465    0.543189    0.243811\n"
 )
 
+LABELLED_WATER_XYZ_FILE = (
+    "6\n"
+    "two waters\n"
+    "OW   0.000  0.000  0.000\n"
+    "HW1  0.957  0.000  0.000\n"
+    "HW2 -0.240  0.927  0.000\n"
+    "OW   5.000  0.000  0.000\n"
+    "HW1  5.957  0.000  0.000\n"
+    "HW2  4.760  0.927  0.000\n"
+)
+
 NITROGEN_ATOM = (
     "1\n"
     "\n"
@@ -119,6 +147,13 @@ class MoleculeTest(unittest.TestCase):
         self.assertEqual(len(fragments[1]), 16)
         self.assertEqual(self.get_sorted_atom_string(fragments[1]), 'CCCCCHHHHHHHHHNN')
 
+    def test_fragment_labelled_atoms(self):
+        # Atom names from MD output are not element symbols, which is fine until something needs the elements
+        molecule = Molecule.from_xyz_file(StringIO(LABELLED_WATER_XYZ_FILE))
+        fragments = molecule.fragment(2)
+        self.assertEqual(sorted(len(fragment) for fragment in fragments), [3, 3])
+        self.assertIsNone(fragments[0].estimate_charge_energies([-1, 0, 1]))
+
     def test_z_sum(self):
         molecule = Molecule.from_xyz_file(StringIO(WATER_XYZ_FILE))
         self.assertEqual(molecule.get_z_sum(), 10)
@@ -127,6 +162,10 @@ class MoleculeTest(unittest.TestCase):
         self.assertEqual(lookup_element_by_symbol('H')[0], 1)
         self.assertEqual(lookup_element_by_symbol('h')[0], 1)
         self.assertIsNone(lookup_element_by_symbol('zz'))
+        self.assertEqual(lookup_element_by_z(8)[1], 'O')
+        self.assertEqual(SYMBOLS[17], 'Cl')
+        self.assertEqual(lookup_atomic_numbers(['O', 'h', 'H', 'cl', 'X']).tolist(), [8, 1, 1, 17, 0])
+        self.assertRaises(ValueError, lookup_atomic_numbers, ['H', 'zz'])
 
     def test_possible_charges(self):
         ionic_dimer = Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE))
@@ -211,3 +250,414 @@ class MoleculeTest(unittest.TestCase):
         fragments[1].multiplicity = 1
         job = Psi4JobFormatter(fragments).energy("sapt0")
         self.assertEqual(job, expected_output)
+
+    def test_array_backed_storage(self):
+        molecule = Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE))
+        array_molecule = Molecule.from_arrays(molecule.title, molecule.labels, molecule.coordinates)
+        self.assertTrue(array_molecule.is_array_backed)
+        self.assertEqual(array_molecule.coordinates.shape, (21, 3))
+        self.assertEqual(list(array_molecule), molecule.atom_list)
+        self.assertEqual(array_molecule.format_psi4(), molecule.format_psi4())
+        self.assertEqual(array_molecule.format_gamess(), molecule.format_gamess())
+        self.assertEqual(array_molecule.atomic_numbers.tolist()[:3], [6, 7, 6])
+
+        array_molecule.add_atom('Cl', 1, 2, 3)
+        array_molecule.merge(Molecule.from_xyz_file(StringIO(WATER_XYZ_FILE)))
+        self.assertEqual(len(array_molecule), 25)
+        self.assertEqual(list(array_molecule)[21], ('Cl', 1.0, 2.0, 3.0))
+        self.assertEqual(list(array_molecule)[22][0], 'O')
+
+        # Accessing the tuple list converts back so that mutations are kept
+        array_molecule.atom_list.append(('H', 0.0, 0.0, 0.0))
+        self.assertFalse(array_molecule.is_array_backed)
+        self.assertEqual(len(array_molecule), 26)
+        self.assertEqual(array_molecule.to_arrays().labels.tolist()[-1], 'H')
+
+    def test_derived_property_cache(self):
+        molecule = Molecule.from_xyz_file(StringIO(WATER_XYZ_FILE))
+        self.assertEqual((molecule.formula, molecule.get_z_sum()), ('H2O', 10))
+        self.assertIs(molecule.bounding_box, molecule.bounding_box)
+        self.assertEqual(molecule.bounding_box[0].tolist(), [-1.419465, -0.658276, 0.215737])
+        self.assertTrue(math.isclose(molecule.centroid[0], (0.008165 + 1.508729 - 1.419465) / 3))
+        geometry_hash = molecule.geometry_hash()
+
+        # Every way of changing the atoms moves the version on and refreshes the cached values
+        version = molecule.version
+        molecule.atom_list.append(('C', 0.0, 0.0, 5.0))
+        self.assertEqual((molecule.formula, molecule.get_z_sum()), ('CH2O', 16))
+        self.assertEqual(molecule.bounding_box[1][2], 5.0)
+        del molecule.atom_list[-1]
+        self.assertEqual(molecule.formula, 'H2O')
+        z_version = molecule.version
+        molecule.atom_list.sort(key=lambda atom: atom[0])
+        self.assertEqual([atom[0] for atom in molecule], ['H', 'H', 'O'])
+        molecule.atom_list.sort(reverse=True)
+        self.assertEqual([atom[0] for atom in molecule], ['O', 'H', 'H'])
+        self.assertGreater(molecule.version, z_version)
+        molecule.merge(Molecule.from_xyz_file(StringIO(NITROGEN_ATOM)))
+        self.assertEqual(molecule.formula, 'H2NO')
+        molecule.atom_list = molecule.atom_list[:1]
+        molecule.efp_pad_dummy_atoms()
+        self.assertEqual((molecule.formula, molecule.get_z_sum(), len(molecule)), ('O', 8, 3))
+        self.assertGreater(molecule.version, version)
+
+        molecule = Molecule.from_xyz_file(StringIO(WATER_XYZ_FILE)).to_arrays()
+        self.assertEqual(molecule.geometry_hash(), geometry_hash)
+        molecule.add_atom('H', 0.0, 0.0, 0.0)
+        self.assertEqual(molecule.formula, 'H3O')
+        self.assertNotEqual(molecule.geometry_hash(), geometry_hash)
+
+        # In-place coordinate changes need an explicit invalidation
+        centroid = molecule.centroid.copy()
+        molecule.coordinates[:] += 1.0
+        self.assertEqual(molecule.centroid.tolist(), centroid.tolist())
+        molecule.invalidate_cache()
+        self.assertTrue(numpy.allclose(molecule.centroid, centroid + 1.0))
+        self.assertRaises(ValueError, molecule.atomic_numbers.fill, 0)
+
+    def test_distance_from(self):
+        def all_pairs_distance(m1, m2):
+            return min(math.sqrt(math.pow(a1[1] - a2[1], 2) + math.pow(a1[2] - a2[2], 2) +
+                                 math.pow(a1[3] - a2[3], 2)) for a1 in m1 for a2 in m2)
+
+        fragments = sorted(Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE)).fragment(2), key=len)
+        self.assertEqual(fragments[0].distance_from(fragments[1]), all_pairs_distance(fragments[0], fragments[1]))
+        self.assertIsNone(fragments[0].distance_from(Molecule('')))
+
+        # Large enough to go through the spatial index rather than the all-pairs comparison
+        rng = random.Random(0)
+        cluster = Molecule('', [('Ar', rng.uniform(0, 30), rng.uniform(0, 30), rng.uniform(0, 30))
+                                for _ in range(2000)])
+        probe = Molecule('', [('Ar', rng.uniform(25, 40), rng.uniform(0, 10), rng.uniform(0, 10))
+                              for _ in range(50)])
+        self.assertEqual(cluster.distance_from(probe), all_pairs_distance(cluster, probe))
+        self.assertIs(cluster.spatial_index(), cluster.spatial_index())
+
+    def test_fragment_water_box(self):
+        # 125 well separated water molecules should split back into the original molecules, in order
+        atoms = []
+        for x in range(5):
+            for y in range(5):
+                for z in range(5):
+                    atoms.append(('O', 3.1 * x, 3.1 * y, 3.1 * z))
+                    atoms.append(('H', 3.1 * x + 0.757, 3.1 * y + 0.586, 3.1 * z))
+                    atoms.append(('H', 3.1 * x - 0.757, 3.1 * y + 0.586, 3.1 * z))
+        molecule = Molecule('water_box', atoms)
+        fragments = molecule.fragment(125)
+        self.assertEqual(len(fragments), 125)
+        self.assertEqual([list(f) for f in fragments], [atoms[i:i + 3] for i in range(0, len(atoms), 3)])
+        self.assertEqual(fragments[0].title, 'water_box125')
+
+        array_fragments = molecule.to_arrays().fragment(125)
+        self.assertEqual([list(f) for f in array_fragments], [list(f) for f in fragments])
+        self.assertRaises(ValueError, molecule.fragment, 0)
+
+    def test_fragment_auto(self):
+        molecule = Molecule.from_file(StringIO(DIMER_XYZ_FILE))
+        fragments = molecule.fragment(AUTO_FRAGMENTS)
+        self.assertEqual([f.title for f in fragments], ['molecule_title2', 'molecule_title2'])
+        self.assertEqual([sorted(f) for f in fragments], [sorted(f) for f in molecule.fragment(2)])
+
+        # Bonded atoms follow each other in their original order; dummy atoms never bond
+        atoms = [('H', 0.0, 0.0, 0.0), ('Cl', 5.0, 0.0, 0.0), ('H', 0.0, 0.0, 0.74), ('H', 5.0, 0.0, 1.27),
+                 ('X', 5.0, 0.0, 1.5)]
+        fragments = Molecule('mixture', atoms).to_arrays().fragment(AUTO_FRAGMENTS)
+        self.assertEqual([list(f) for f in fragments], [[atoms[0], atoms[2]], [atoms[1], atoms[3]], [atoms[4]]])
+
+    def test_read_xyz_path(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "molecule.xyz")
+            cases = [DIMER_XYZ_FILE, "\n\n" + WATER_XYZ_FILE.replace("\n", "\r\n"), NITROGEN_ATOM, "",
+                     # These are not bulk readable and go through the line-by-line parser
+                     WATER_XYZ_FILE + "end\n", WATER_XYZ_FILE.replace("O ", "Oxygen_atom ")]
+            for case in cases:
+                with open(path, "w") as f:
+                    f.write(case)
+                expected = Molecule.from_xyz_file(StringIO(case))
+                molecule = Molecule.from_xyz_file(path)
+                self.assertEqual(molecule.title, expected.title)
+                self.assertEqual(list(molecule), list(expected))
+            self.assertFalse(Molecule.from_xyz_file(path).is_array_backed)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_guess_charge_stub_psi4(self):
+        # These fragments are told apart by the estimate; it is switched off to exercise psi4
+        with charge_guess_settings() as directory:
+            ion = sorted(Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE)).fragment(2), key=len)[0]
+            self.assertEqual(ion.get_possible_charges(lower_range=-3, upper_range=3), [-3, -1, 1, 3])
+
+            psi4_path, log = make_stub_psi4(directory, {-3: -1.0, -1: -5.0, 1: -5.0}, delay=0.5)
+            ion.psi4_path = psi4_path
+            # -1 and 1 tie, so the first candidate wins as it always has; charge 3 produces no energy
+            self.assertEqual(ion.guess_charge(lower_range=-3, upper_range=3, max_workers=4, n_threads=2), -1)
+            self.assertEqual(ion.charge, -1)
+            with open(log) as f:
+                runs = [line.rsplit(" ", 1) for line in f.read().splitlines()]
+            self.assertEqual(len(runs), 4)
+            self.assertTrue(all(args == "-i stdin -o stdout -n 2" for args, _ in runs))
+            # All four runs started before the first one finished
+            start_times = [float(t) for _, t in runs]
+            self.assertLess(max(start_times) - min(start_times), 0.5)
+
+            psi4_path, log = make_stub_psi4(directory, {})
+            ion.psi4_path = psi4_path
+            self.assertIsNone(ion.guess_charge(max_workers=1))
+
+    def test_guess_charge_async(self):
+        with charge_guess_settings() as directory:
+            psi4_path, log = make_stub_psi4(directory, {-1: -5.0, 1: -6.0}, delay=0.3)
+            fragments = sorted(Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE), psi4_path).fragment(2), key=len)
+
+            async def guess_both():
+                # One shared limit lets only two psi4 runs go at once across both molecules
+                limit = asyncio.Semaphore(2)
+                return await asyncio.gather(*[f.guess_charge_async(limit=limit, n_threads=1) for f in fragments])
+
+            self.assertEqual(asyncio.run(guess_both()), [1, 1])
+            with open(log) as f:
+                runs = [line.rsplit(" ", 1) for line in f.read().splitlines()]
+            self.assertEqual(len(runs), 4)
+            self.assertTrue(all(args == "-i stdin -o stdout -n 1" for args, _ in runs))
+            start_times = sorted(float(t) for _, t in runs)
+            self.assertGreater(start_times[2] - start_times[0], 0.25)
+
+            # A slow estimate for one molecule does not hold up the event loop
+            ticks = []
+
+            def slow_estimate(candidates):
+                time.sleep(0.3)
+                return None
+
+            async def tick():
+                for _ in range(5):
+                    ticks.append(time.perf_counter())
+                    await asyncio.sleep(0.02)
+
+            async def guess_with_ticks():
+                return await asyncio.gather(tick(), fragments[0].guess_charge_async(n_threads=1))
+
+            molecule_module.CHARGE_PRESCREEN_WINDOW = 2.0
+            fragments[0].estimate_charge_energies = slow_estimate
+            self.assertEqual(asyncio.run(guess_with_ticks())[1], 1)
+            self.assertLess(ticks[-1] - ticks[0], 0.25)
+
+    def test_guess_charge_prescreen(self):
+        with charge_guess_settings(prescreen_window=molecule_module.CHARGE_PRESCREEN_WINDOW) as directory:
+            psi4_path, log = make_stub_psi4(directory, {-3: -9.0, -1: -5.0, 1: -6.0, 3: -7.0})
+            dimer = Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE), psi4_path)
+            self.assertIsNone(dimer.estimate_charge_energies([-1, 1]))
+            cation, anion = dimer.fragment(AUTO_FRAGMENTS)
+
+            # The estimate settles the default range on its own
+            self.assertEqual((cation.guess_charge(), anion.guess_charge()), (1, -1))
+            self.assertFalse(os.path.exists(log))
+
+            # Over a wider range it only rules out the unlikely candidates
+            energies = cation.estimate_charge_energies([-3, -1, 1, 3])
+            self.assertEqual(energies.argmin(), 2)
+            self.assertTrue(2.0 < energies[1] < 5.0 < energies[3] < energies[0])
+            molecule_module.CHARGE_PRESCREEN_WINDOW = 5.0
+            self.assertEqual(cation.guess_charge(lower_range=-3, upper_range=3), 1)
+            with open(log) as f:
+                self.assertEqual(len(f.read().splitlines()), 2)
+
+            # Neighbourhoods over the size limit are left to psi4
+            max_atoms = charge_estimate.MAX_ENVIRONMENT_ATOMS
+            charge_estimate.MAX_ENVIRONMENT_ATOMS = len(dimer) - 1
+            try:
+                self.assertIsNone(anion.estimate_charge_energies([-1, 1]))
+                self.assertEqual(anion.guess_charge(), 1)
+            finally:
+                charge_estimate.MAX_ENVIRONMENT_ATOMS = max_atoms
+            with open(log) as f:
+                self.assertEqual(len(f.read().splitlines()), 4)
+
+            # Changing the atoms breaks the link with the surroundings
+            cation.add_atom("He", 9.0, 9.0, 9.0)
+            self.assertIsNone(cation.estimate_charge_energies([-1, 1]))
+
+    def test_guess_charge_cache(self):
+        with charge_guess_settings() as directory:
+            molecule_module.CHARGE_CACHE = ChargeCache(os.path.join(directory, "charges.sqlite"))
+            psi4_path, log = make_stub_psi4(directory, {-1: -5.0, 1: -6.0})
+            fragments = sorted(Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE), psi4_path).fragment(2), key=len)
+            self.assertEqual(fragments[0].guess_charge(), 1)
+
+            # The same geometry under another title is answered from the cache without running psi4
+            ion = Molecule("other_title", list(fragments[0]), psi4_path=psi4_path)
+            self.assertEqual(ion.guess_charge(), 1)
+            self.assertEqual(ion.charge, 1)
+            with open(log) as f:
+                self.assertEqual(len(f.read().splitlines()), 2)
+
+            # A different charge range is a different question
+            ion.guess_charge(lower_range=-3, upper_range=3)
+            with open(log) as f:
+                self.assertEqual(len(f.read().splitlines()), 6)
+            self.assertEqual(len(molecule_module.CHARGE_CACHE), 2)
+
+            # So is a charge guessed with another prescreen window, which may have run psi4 on fewer candidates
+            molecule_module.CHARGE_PRESCREEN_WINDOW = 100.0
+            ion.guess_charge()
+            with open(log) as f:
+                self.assertEqual(len(f.read().splitlines()), 8)
+            self.assertEqual(len(molecule_module.CHARGE_CACHE), 3)
+
+    def test_guess_charge_unusable_cache(self):
+        with charge_guess_settings() as directory:
+            cache_path = os.path.join(directory, "not_a_directory", "charges.sqlite")
+            with open(os.path.dirname(cache_path), "w"):
+                pass
+            molecule_module.CHARGE_CACHE = ChargeCache(cache_path)
+            psi4_path, log = make_stub_psi4(directory, {-1: -5.0, 1: -6.0})
+            fragments = sorted(Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE), psi4_path).fragment(2), key=len)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                self.assertEqual(fragments[0].guess_charge(), 1)
+                self.assertEqual(fragments[0].guess_charge(), 1)
+            self.assertEqual([w.category for w in caught], [RuntimeWarning])
+            with open(log) as f:
+                self.assertEqual(len(f.read().splitlines()), 4)
+
+    def test_charge_cache_eviction(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = ChargeCache(os.path.join(directory, "charges.sqlite"), max_bytes=64 * 1024)
+            for i in range(2000):
+                cache.put("key%i" % i, i % 3 - 1)
+            self.assertLess(len(cache), 2000)
+            self.assertIsNone(cache.get("key0"))
+            self.assertEqual(cache.get("key1999"), 0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_write_formats(self):
+        molecule = Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE))
+        fragments = molecule.fragment(2)
+        for m in [molecule, molecule.to_arrays()]:
+            fp = StringIO()
+            m.write_psi4(fp)
+            self.assertEqual(fp.getvalue(), m.format_psi4())
+            self.assertTrue(fp.getvalue().startswith("molecule molecule_title {\n0 1\n  C 0.0000000000 "))
+
+            fp = StringIO()
+            m.write_gamess(fp)
+            self.assertEqual(fp.getvalue(), m.format_gamess())
+            self.assertIn("\nN   7.0   0.0000000000 0.0000000000 1.3740550000\n", fp.getvalue())
+
+        fp = StringIO()
+        Psi4JobFormatter(fragments).write(fp, "energy", "sapt0")
+        self.assertEqual(fp.getvalue(), Psi4JobFormatter(fragments).energy("sapt0"))
+        self.assertRaises(NotImplementedError, Psi4JobFormatter(fragments).write, fp, "makefp", None)
+
+    def test_format_many(self):
+        fragments = Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE)).fragment(AUTO_FRAGMENTS)
+        water = Molecule.from_xyz_file(StringIO(WATER_XYZ_FILE))
+        batch = MoleculeBatch.from_molecules([water, water.to_arrays()])
+        molecules = fragments + [fragments, water]
+
+        settings = {"basis_set": "aug-cc-pVDZ", "memory": 2, "memory_units": "Gb"}
+        inputs = Psi4JobFormatter.format_many(iter(molecules), "energy", None, **settings)
+        self.assertFalse(isinstance(inputs, list))
+        self.assertEqual(list(inputs), [Psi4JobFormatter(m, **settings).format("energy", None) for m in molecules])
+        self.assertEqual(list(Psi4JobFormatter.format_many(batch, "energy", "scf", **settings)),
+                         [Psi4JobFormatter(m, "aug-cc-pVDZ", 2, "Gb").energy("scf") for m in batch])
+
+        inputs = list(GamessJobFormatter.format_many(fragments + [water, [water]], "makefp", None,
+                                                     memory_replicated_gb=2))
+        self.assertEqual(inputs, [GamessJobFormatter(m, memory_replicated_gb=2).makefp()
+                                  for m in fragments + [water, water]])
+        self.assertTrue(inputs[0].startswith(" $SYSTEM MWORDS=250 MEMDDI=125 $END\n $CONTRL RUNTYP=MAKEFP $END\n"))
+        self.assertRaises(ValueError, list, GamessJobFormatter.format_many([fragments], "makefp", None))
+
+        # The header and footer are rendered once for all the molecules
+        renders = []
+
+        class CountingFormatter(GamessJobFormatter):
+            def _format_memory(self):
+                renders.append(self)
+                return GamessJobFormatter._format_memory(self)
+
+        self.assertEqual(list(CountingFormatter.format_many(fragments + [water], "makefp", None)),
+                         list(GamessJobFormatter.format_many(fragments + [water], "makefp", None)))
+        self.assertEqual(len(renders), 1)
+        self.assertRaises(NotImplementedError, list, GamessJobFormatter.format_many([water], "energy", None))
+
+        outputs = {}
+
+        class Output(StringIO):
+            def __init__(self, i):
+                StringIO.__init__(self)
+                self.i = i
+
+            def close(self):
+                outputs[self.i] = self.getvalue()
+                StringIO.close(self)
+
+        self.assertEqual(GamessJobFormatter.write_many(batch, "makefp", None, lambda i, m: Output(i)), len(batch))
+        self.assertEqual(outputs, dict(enumerate(GamessJobFormatter.format_many(batch, "makefp", None))))
+
+        # A charge that cannot be guessed stops the input before anything is written
+        for formatter, calc_type in ((Psi4JobFormatter(water), "energy"), (GamessJobFormatter(water), "makefp")):
+            fp = StringIO()
+            self.assertRaises(ValueError, formatter.write, fp, calc_type, None, guess_charge=True)
+            self.assertEqual(fp.getvalue(), "")
+        outputs.clear()
+        self.assertRaises(ValueError, GamessJobFormatter.write_many, [water], "makefp", None, lambda i, m: Output(i),
+                          guess_charge=True)
+        self.assertEqual(outputs, {})
+
+    def test_from_file_detection(self):
+        def write_text(path, text):
+            with open(path, "w") as f:
+                f.write(text)
+
+        class NonSeekableStream(object):
+            def __init__(self, text):
+                self._fp = StringIO(text)
+                self.reads = 0
+
+            def read(self, size=-1):
+                self.reads += 1
+                return self._fp.read(size)
+
+            def __iter__(self):
+                return iter(self._fp)
+
+        self.assertEqual(len(Molecule.from_file(StringIO(DIMER_XYZ_FILE))), 21)
+        self.assertEqual(len(Molecule.from_file(StringIO(PSI4_OUTPUT))), 24)
+
+        # A psi4 log long enough that the geometry lies beyond the sniffed part
+        psi4_log = "  Psi4: An Open-Source Ab Initio Electronic Structure Package\n" + "\n" * 20000 + PSI4_OUTPUT
+        stream = NonSeekableStream(psi4_log)
+        self.assertEqual(len(Molecule.from_file(stream)), 24)
+        self.assertEqual(stream.reads, 1)
+
+        stream = NonSeekableStream(WATER_XYZ_FILE * 3000)
+        self.assertEqual(len(Molecule.from_file(stream)), 9000)
+
+        self.assertRaises(ValueError, Molecule.from_file, StringIO("nothing to see here\n"))
+
+        # A psi4 log without a marker in the sniffed part is still read, by the psi4 parser after the XYZ one fails
+        unmarked_log = "Job started\n" + "Some notes about the job here\n" * 400 + PSI4_OUTPUT.replace("Psi4", "psi")
+        self.assertGreater(unmarked_log.index("==> Geometry"), SNIFF_SIZE)
+        self.assertEqual(len(Molecule.from_file(StringIO(unmarked_log))), 24)
+        self.assertEqual(len(Molecule.from_file(NonSeekableStream(unmarked_log))), 24)
+
+        # Paths that can only be read once, such as FIFOs, are opened once
+        directory = tempfile.mkdtemp()
+        try:
+            paths = {"log": unmarked_log, "xyz": DIMER_XYZ_FILE}
+            for name, text in paths.items():
+                path = os.path.join(directory, name)
+                write_text(path, text)
+                fifo = os.path.join(directory, name + ".fifo")
+                os.mkfifo(fifo)
+                writer = threading.Thread(target=write_text, args=(fifo, text))
+                writer.start()
+                self.assertEqual(len(Molecule.from_file(fifo)), len(Molecule.from_file(path)))
+                writer.join()
+        finally:
+            shutil.rmtree(directory)
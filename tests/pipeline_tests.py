@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from molutils.util.pipeline import Pipeline, Stage
+
+
+def square(value):
+    return value * value
+
+
+class PipelineTest(unittest.TestCase):
+    def test_order_and_errors(self):
+        def slow_for_small(value):
+            # Earlier items finish last, so ordering has to be restored
+            time.sleep(0.02 if value < 3 else 0.0)
+            if value == 5:
+                raise ValueError("five")
+            return value
+
+        async def add_one(value):
+            await asyncio.sleep(0)
+            return value + 1
+
+        stages = [Stage("first", slow_for_small, workers=4, executor=ThreadPoolExecutor(4)),
+                  Stage("second", add_one, workers=2), Stage("third", square)]
+        items = list(Pipeline(stages).run(range(8)))
+        self.assertEqual([item.index for item in items], list(range(8)))
+        self.assertEqual([item.value for item in items if item.error is None], [1, 4, 9, 16, 25, 49, 64])
+        self.assertIsInstance(items[5].error, ValueError)
+        self.assertEqual(set(items[5].timings), {"first"})
+        self.assertEqual(set(items[0].timings), {"first", "second", "third"})
+
+        unordered = list(Pipeline(stages, ordered=False).run(range(8)))
+        self.assertEqual(sorted(item.index for item in unordered), list(range(8)))
+        self.assertNotEqual([item.index for item in unordered], list(range(8)))
+
+    def test_backpressure(self):
+        lock = threading.Lock()
+        state = {"started": 0, "finished": 0, "most_in_flight": 0}
+
+        def start(value):
+            with lock:
+                state["started"] += 1
+                state["most_in_flight"] = max(state["most_in_flight"], state["started"] - state["finished"])
+            return value
+
+        pipeline = Pipeline([Stage("start", start, workers=2), Stage("square", square, workers=2)], max_in_flight=5)
+        for item in pipeline.run(range(200)):
+            # A slow consumer holds everything back
+            time.sleep(0.001)
+            with lock:
+                state["finished"] += 1
+            self.assertEqual(item.value, item.index * item.index)
+        self.assertEqual(state["finished"], 200)
+        self.assertLessEqual(state["most_in_flight"], 5)
+
+    def test_stop_early(self):
+        items = Pipeline([Stage("square", square)]).run(iter(range(1000000)))
+        self.assertEqual(next(items).value, 0)
+        items.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+
+import molutils.util.psi4_output as psi4_output
+from molutils.util.molecule import Molecule, LAST_GEOMETRY
+from molutils.util.psi4_output import parse_psi4_output, read_last_psi4_geometry
+from tests.molecule_tests import PSI4_OUTPUT
+
+OPTIMIZATION_STEP = (
+    "    Geometry (in Angstrom), charge = {charge}, multiplicity = 1:\n"
+    "\n"
+    "       Center              X                  Y                   Z               Mass\n"
+    "    ------------   -----------------  -----------------  -----------------  -----------------\n"
+    "           O          0.000000000000     0.000000000000    {z:.12f}    15.994914619570\n"
+    "           H          0.000000000000    -0.756950000000     0.520830000000     1.007825032230\n"
+    "           H          0.000000000000     0.756950000000     0.520830000000     1.007825032230\n"
+    "\n"
+    "  @DF-RHF Final Energy:   {scf:.10f}\n"
+    "\n"
+    "   => Energetics <=\n"
+    "\n"
+    "    Total Energy =                        {scf:.10f}\n"
+    "\n"
+    "\t-----------------------------------------------------------\n"
+    "\t ==================> DF-MP2 Energies <==================== \n"
+    "\t-----------------------------------------------------------\n"
+    "\t Reference Energy          =     {scf:.10f} [Eh]\n"
+    "\t Total Energy              =     {mp2:.10f} [Eh]\n"
+    "\t-----------------------------------------------------------\n"
+    "\t ================> DF-SCS-MP2 Energies <================== \n"
+    "\t Total Energy              =     -99.0000000000 [Eh]\n"
+)
+
+OPTIMIZATION_OUTPUT = (
+    "  Psi4: An Open-Source Ab Initio Electronic Structure Package\n" +
+    "".join(OPTIMIZATION_STEP.format(charge=0, z=-0.1 * i, scf=-76.0 - 0.01 * i, mp2=-76.2 - 0.01 * i)
+            for i in range(3)) +
+    "\n" * 5000 +
+    "\tFinal energy is    -76.2200000000\n"
+)
+
+# Psi4 prints geometries in Bohr when the molecule block says "units bohr"
+BOHR_OUTPUT = (
+    "  Psi4: An Open-Source Ab Initio Electronic Structure Package\n"
+    "    Geometry (in Bohr), charge = -1, multiplicity = 2:\n"
+    "\n"
+    "       Center              X                  Y                   Z               Mass\n"
+    "    ------------   -----------------  -----------------  -----------------  -----------------\n"
+    "           O          0.000000000000     0.000000000000    -0.124309000000    15.994914619570\n"
+    "           H          0.000000000000    -1.430429000000     0.986478000000     1.007825032230\n"
+    "\n"
+)
+
+
+class Psi4OutputTest(unittest.TestCase):
+    def test_parse(self):
+        output = parse_psi4_output(StringIO(OPTIMIZATION_OUTPUT))
+        self.assertEqual(len(output.geometries), 3)
+        self.assertEqual([g.atom_list[0][3] for g in output.geometries], [0.0, -0.1, -0.2])
+        self.assertEqual(output.geometries[-1].charge, 0)
+        self.assertEqual(output.scf_energies, [-76.0, -76.01, -76.02])
+        self.assertEqual(output.mp2_energies, [-76.2, -76.21, -76.22])
+        self.assertEqual(output.final_energy, -76.22)
+        self.assertEqual(output.energy, -76.22)
+
+        output = parse_psi4_output(StringIO(PSI4_OUTPUT))
+        self.assertEqual(len(output.last_geometry.atom_list), 24)
+        self.assertIsNone(output.energy)
+
+    def test_bohr_units(self):
+        # Geometries are read in Angstrom whatever unit the log uses, with the charge and multiplicity of its header
+        expected = [("O", 0.0, 0.0, -0.124309 * psi4_output.BOHR_TO_ANGSTROM),
+                    ("H", 0.0, -1.430429 * psi4_output.BOHR_TO_ANGSTROM, 0.986478 * psi4_output.BOHR_TO_ANGSTROM)]
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "bohr.out")
+            with open(path, "w") as f:
+                f.write(BOHR_OUTPUT)
+            for molecule in (Molecule.from_psi4_output(StringIO(BOHR_OUTPUT)), Molecule.from_file(path),
+                             Molecule.from_psi4_output(path, geometry=LAST_GEOMETRY)):
+                self.assertEqual(len(molecule), 2)
+                for atom, expected_atom in zip(molecule, expected):
+                    self.assertEqual(atom[0], expected_atom[0])
+                    for value, expected_value in zip(atom[1:], expected_atom[1:]):
+                        self.assertAlmostEqual(value, expected_value, places=9)
+                self.assertAlmostEqual(molecule.atom_list[1][2], -0.756950, places=6)
+                self.assertEqual((molecule.charge, molecule.multiplicity), (-1, 2))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_last_geometry(self):
+        directory = tempfile.mkdtemp()
+        block_size = psi4_output.TAIL_BLOCK_SIZE
+        try:
+            path = os.path.join(directory, "opt.out")
+            with open(path, "w") as f:
+                f.write(OPTIMIZATION_OUTPUT)
+
+            # Small blocks make the backwards search step over several block boundaries
+            for psi4_output.TAIL_BLOCK_SIZE in (7, 100, 65536):
+                geometry = read_last_psi4_geometry(path)
+                self.assertEqual([atom[3] for atom in geometry.atom_list], [-0.2, 0.52083, 0.52083])
+
+            molecule = Molecule.from_psi4_output(path, geometry=LAST_GEOMETRY)
+            self.assertEqual(list(molecule), list(Molecule.from_psi4_output(StringIO(OPTIMIZATION_OUTPUT),
+                                                                            geometry=LAST_GEOMETRY)))
+            self.assertEqual(Molecule.from_psi4_output(path).atom_list[0][3], 0.0)
+
+            with open(path, "w") as f:
+                f.write("no geometry here\n")
+            self.assertIsNone(read_last_psi4_geometry(path))
+        finally:
+            psi4_output.TAIL_BLOCK_SIZE = block_size
+            shutil.rmtree(directory)
@@ -0,0 +1,102 @@
+import os
+import sys
+import unittest
+from io import StringIO
+
+import molutils.util.molecule as molecule_module
+from molutils.util.molecule import Molecule
+from molutils.util.psi4_pool import Psi4WorkerPool, psi4_python
+from molutils.util.psi4_worker import max_rss_bytes, resident_memory
+from tests.helpers import charge_guess_settings
+from tests.molecule_tests import DIMER_XYZ_FILE
+
+# Stands in for psi4_worker.py: answers with an energy for the charge in each job, logging its process id. Charges
+# listed in crash make it exit, those in fail make it report an error, and its memory grows by growth per job.
+FAKE_WORKER_SCRIPT = """import json, os, re, sys
+energies = {energies!r}
+jobs = 0
+for line in sys.stdin:
+    charge = int(re.search(r"\\{{\\n(-?[0-9]+) ", json.loads(line)["job"]).group(1))
+    with open({log!r}, "a") as f:
+        f.write("%i\\n" % os.getpid())
+    if charge in {crash!r}:
+        sys.exit(1)
+    jobs += 1
+    print(json.dumps({{"energy": energies.get(charge), "error": "failed" if charge in {fail!r} else None,
+                      "memory": 1000 + jobs * {growth}}}), flush=True)
+"""
+
+
+class Psi4WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        settings = charge_guess_settings()
+        self.directory = settings.__enter__()
+        self.addCleanup(settings.__exit__, None, None, None)
+        self.log = os.path.join(self.directory, "workers.log")
+        self.ion = sorted(Molecule.from_xyz_file(StringIO(DIMER_XYZ_FILE)).fragment(2), key=len)[0]
+
+    def tearDown(self):
+        molecule_module.PSI4_POOL = None
+
+    def make_pool(self, size=1, crash=(), fail=(), growth=0, **kwargs):
+        script = os.path.join(self.directory, "fake_worker.py")
+        with open(script, "w") as f:
+            f.write(FAKE_WORKER_SCRIPT.format(energies={-3: -1.0, -1: -5.0, 1: -6.0, 3: -2.0}, log=self.log,
+                                              crash=list(crash), fail=list(fail), growth=growth))
+        return Psi4WorkerPool(size, python=sys.executable, worker_script=script, **kwargs)
+
+    def job(self, charge):
+        return self.ion._format_psi4_molecule(charge, 1)
+
+    def worker_pids(self):
+        with open(self.log) as f:
+            return f.read().split()
+
+    def test_workers_are_reused(self):
+        with self.make_pool(size=2) as pool:
+            molecule_module.PSI4_POOL = pool
+            self.assertEqual(self.ion.guess_charge(lower_range=-3, upper_range=3, max_workers=2), 1)
+            self.ion.charge = 0
+            self.assertEqual(self.ion.guess_charge(max_workers=1), 1)
+        pids = self.worker_pids()
+        self.assertEqual(len(pids), 6)
+        self.assertLessEqual(len(set(pids)), 2)
+        self.assertLessEqual(pool.workers_started, 2)
+
+    def test_restart_policy(self):
+        # A worker that dies gives no energy and is replaced
+        with self.make_pool(crash=[-1]) as pool:
+            molecule_module.PSI4_POOL = pool
+            self.assertEqual(self.ion.guess_charge(max_workers=1), 1)
+            self.assertEqual(pool.workers_started, 2)
+
+        # So is a worker that reports an error, one that has done max_jobs jobs, and one that has grown too much
+        with self.make_pool(fail=[-1]) as pool:
+            self.assertIsNone(pool.energy(self.job(-1)))
+            self.assertEqual(pool.workers_started, 1)
+            pool.energy(self.job(1))
+            self.assertEqual(pool.workers_started, 2)
+        with self.make_pool(max_jobs=2) as pool:
+            for _ in range(5):
+                pool.energy(self.job(1))
+            self.assertEqual(pool.workers_started, 3)
+        with self.make_pool(growth=100, max_memory_growth=250) as pool:
+            for _ in range(5):
+                pool.energy(self.job(1))
+            self.assertEqual(pool.workers_started, 2)
+
+    def test_resident_memory(self):
+        self.assertGreater(resident_memory(), 1024 * 1024)
+        self.assertEqual(max_rss_bytes(2048, "linux"), 2048 * 1024)
+        self.assertEqual(max_rss_bytes(2048, "darwin"), 2048)
+
+    def test_psi4_python(self):
+        psi4_path = os.path.join(self.directory, "psi4")
+        with open(psi4_path, "w") as f:
+            f.write("#!/usr/bin/env python3 -u\nimport psi4\n")
+        self.assertEqual(psi4_python(psi4_path), ["/usr/bin/env", "python3", "-u"])
+        self.assertEqual(psi4_python(os.path.join(self.directory, "missing")), [sys.executable])
+
+
+if __name__ == '__main__':
+    unittest.main()
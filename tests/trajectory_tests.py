@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+
+from molutils.util.trajectory import iter_xyz_frames, XYZFrameIndex
+from tests.molecule_tests import WATER_XYZ_FILE, DIMER_XYZ_FILE
+
+TRAJECTORY_XYZ_FILE = WATER_XYZ_FILE + DIMER_XYZ_FILE + "\n" + WATER_XYZ_FILE.replace("\n\n", "\nlast frame\n", 1)
+
+
+class TrajectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "trajectory.xyz")
+        with open(self.path, "w") as f:
+            f.write(TRAJECTORY_XYZ_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_iter_frames(self):
+        frames = list(iter_xyz_frames(StringIO(TRAJECTORY_XYZ_FILE)))
+        self.assertEqual([len(m) for m in frames], [3, 21, 3])
+        self.assertEqual([m.title for m in frames], ["input_molecule", "molecule_title", "last_frame"])
+        self.assertEqual([len(m) for m in iter_xyz_frames(self.path)], [3, 21, 3])
+
+        self.assertRaises(ValueError, list, iter_xyz_frames(StringIO("3\ntruncated\nH 0 0 0\n")))
+
+    def test_frame_index(self):
+        index = XYZFrameIndex.build(self.path)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.atom_counts.tolist(), [3, 21, 3])
+        self.assertEqual(list(index.read_frame(1)), list(list(iter_xyz_frames(self.path))[1]))
+        self.assertEqual(index[2].title, "last_frame")
+
+        index_path = index.save()
+        self.assertEqual(XYZFrameIndex.load(self.path).offsets.tolist(), index.offsets.tolist())
+
+        # A changed file invalidates the saved index
+        with open(self.path, "a") as f:
+            f.write(WATER_XYZ_FILE)
+        self.assertRaises(ValueError, XYZFrameIndex.load, self.path, index_path)
+        self.assertEqual(len(XYZFrameIndex.open(self.path)), 4)
+        self.assertEqual(len(XYZFrameIndex.load(self.path)), 4)